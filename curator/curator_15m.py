@@ -1,15 +1,18 @@
 import ccxt
 import pandas as pd
-import time
-import os
 import matplotlib.pyplot as plt
 from datetime import datetime
 from infra.bybit.auth import BybitAuth
+from infra.bybit.exchange_registry import create_exchange
+from curator.ohlcv_crawler import OhlcvCrawler
+from curator.ohlcv_store import OhlcvStore
+from modules.kline_decoder import decode_ccxt_ohlcv
 
 
 class BybitFetcher(BybitAuth):
-    def __init__(self):
+    def __init__(self, store_dir='strage/ohlcv'):
         super().__init__()
+        self.store = OhlcvStore(store_dir)
 
     def fetch_latest_ohlcv(self, limit=200):
         """
@@ -26,51 +29,56 @@ class BybitFetcher(BybitAuth):
             print(f"エラーが発生しました: {error}")
             return pd.DataFrame()
 
-    def fetch_all_ohlcv(self, since=None, limit=200):
+    def fetch_all_ohlcv(self, since=None, limit=1000, until=None, max_workers=4, out_dir='strage/crawl'):
         """
         指定した開始時刻から現在までのすべてのOHLCVデータを取得します。
+        期間を月単位のシャードに分けて並列に取得し、OhlcvStoreに追記します。
+        途中で停止した場合も、同じ引数で再実行すれば続きから取得します。
 
-        :param since: 開始時刻（ミリ秒）。デフォルトはexchangeのデフォルト。
-        :param limit: 一度に取得するローソク足の数（デフォルトは200）
+        :param since: 開始時刻（ミリ秒）
+        :param limit: 一度に取得するローソク足の数（デフォルトは1000、Bybitの上限）
+        :param until: 終了時刻（ミリ秒）。デフォルトは現在時刻。
+        :param max_workers: 並列に取得するシャード数
+        :param out_dir: チェックポイントの保存先
         :return: pandas DataFrame
         """
-        all_ohlcv = []
+        crawler = OhlcvCrawler(
+            self._create_exchange, self.store, self.symbol, self.timeframe,
+            out_dir=out_dir, max_workers=max_workers, limit=limit,
+        )
         try:
-            while True:
-                print(f"Fetching OHLCV data since {since} with limit {limit}")
-                ohlcv = self.exchange.fetch_ohlcv(self.symbol, timeframe=self.timeframe, since=since, limit=limit)
-                print(f"Fetched {len(ohlcv)} candles")
-                if not ohlcv:
-                    print("No more data to fetch.")
-                    break
-                all_ohlcv += ohlcv
-                last_timestamp = ohlcv[-1][0]
-                since = last_timestamp + 1  # 次のデータ取得のために1ミリ秒追加
-                # BybitのAPI制限を避けるために少し待機
-                time.sleep(self.exchange.rateLimit / 1000)
+            until = crawler.crawl(since, until)
         except ccxt.BaseError as error:
             print(f"エラーが発生しました: {error}")
+            print("再実行すると取得済みのシャードの続きから取得します。")
+            raise
 
-        df = self._ohlcv_to_dataframe(all_ohlcv)
+        df = self.store.read_range(self.symbol, self.timeframe, since or 0, until)
         print(f"Total candles fetched: {len(df)}")
         return df
 
+    def _create_exchange(self):
+        # 並列取得ではスレッドごとにexchangeを作り、レート制限はクローラ側でまとめて行う。
+        # 銘柄情報は保存したものを使い、スレッドごとに取得し直さない
+        return create_exchange('bybit', self.api_key, self.api_secret, {'enableRateLimit': False})
+
     def _ohlcv_to_dataframe(self, ohlcv):
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'Open', 'High', 'Low', 'Close', 'Volume'])
-        df.set_index('timestamp', inplace=True)
         # タイムスタンプをUTCに変換する部分を削除
-        df.index = pd.to_datetime(df.index, unit='ms')
-        return df
+        return decode_ccxt_ohlcv(ohlcv, tz=None)
+
+    def save_to_store(self, df):
+        """
+        OHLCVデータをOhlcvStoreに追記します。保存済みの足より古い足は書き込みません。
+        """
+        written = self.store.append(self.symbol, self.timeframe, df)
+        print(f"{written}本のローソク足を{self.store.root_dir}に保存しました。")
+
+    def read_range(self, start, end):
+        """
+        保存済みのOHLCVデータから [start, end) の範囲を読み込みます。
+        """
+        return self.store.read_range(self.symbol, self.timeframe, start, end)
 
-    def save_to_csv_pkl(self, df, filename='bybit_15m_kline'):
-        # ディレクトリが存在しない場合は作成
-        directory = os.path.dirname(filename)
-        if directory and not os.path.exists(directory):
-            os.makedirs(directory)
-        df.to_csv(filename + '.csv')
-        df.to_pickle(filename + '.pkl')
-        print(f"データを{filename}に保存しました。")
-        
     def plot_ohlcv(self, df):
         df['Close'].plot(figsize=(12, 6), title='BTC/USD Close Price')
         plt.savefig('strage/btc_usd_close_price.png')
@@ -79,7 +87,6 @@ class BybitFetcher(BybitAuth):
 # 使用例
 if __name__ == "__main__":
     fetcher = BybitFetcher()
-    #FIXME: 長期間のデータを取得できない
     # 取得開始日を日付で指定できるように変更
     start_date_str = '2023-01-01'  
     try:
@@ -90,12 +97,10 @@ if __name__ == "__main__":
         print(f"日付の形式が正しくありません: {ve}")
         exit(1)
     
+    # 取得したデータは strage/ohlcv に月ごとに保存される
     all_df = fetcher.fetch_all_ohlcv(since=since)
     print("すべてのデータ:")
     print(all_df)
     
-    # データをCSVに保存
-    fetcher.save_to_csv_pkl(all_df, 'strage/bybit_15m_kline')
-    
     # データをプロット
     fetcher.plot_ohlcv(all_df)
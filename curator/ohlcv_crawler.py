@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import ccxt
+
+from curator.ohlcv_store import OhlcvStore
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    スレッド間で共有する、1秒あたりのリクエスト数の制限。
+    """
+    def __init__(self, requests_per_second: float):
+        self.min_interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.min_interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class OhlcvCrawler:
+    """
+    取得期間を月単位のシャードに分割し、並列にOHLCVデータを取得するクローラ。
+    各ページは取得した時点でOhlcvStoreの月パーティションに追記し、進捗はチェックポイントに記録するため、
+    途中で停止しても再実行すれば続きから取得できる。
+    """
+    def __init__(self, exchange_factory: Callable[[], ccxt.Exchange], store: OhlcvStore, symbol: str, timeframe: str,
+                 out_dir: str = 'strage/crawl', max_workers: int = 4,
+                 requests_per_second: float = 20.0, limit: int = 1000, max_retries: int = 5):
+        """
+        :param exchange_factory: ccxtのexchangeを生成する関数（スレッドごとに1つ生成する）
+        :param store: 取得したローソク足の保存先
+        :param out_dir: チェックポイントの保存先
+        :param max_workers: 並列に取得するシャード数
+        :param requests_per_second: 全スレッド合計のリクエスト数の上限
+        :param limit: 1リクエストで取得するローソク足の数（Bybitは最大1000）
+        """
+        self.exchange_factory = exchange_factory
+        self.store = store
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.max_workers = max_workers
+        self.limit = limit
+        self.max_retries = max_retries
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.timeframe_ms = ccxt.Exchange.parse_timeframe(timeframe) * 1000
+
+        self.checkpoint_dir = os.path.join(out_dir, f"{symbol.replace('/', '_')}_{timeframe}")
+        self.checkpoint_path = os.path.join(self.checkpoint_dir, 'checkpoint.json')
+        self._checkpoint_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _exchange(self) -> ccxt.Exchange:
+        # ccxtの同期クライアントはスレッド間で共有しない
+        if not hasattr(self._local, 'exchange'):
+            self._local.exchange = self.exchange_factory()
+        return self._local.exchange
+
+    @staticmethod
+    def _month_end(timestamp: int) -> int:
+        """
+        timestamp を含む月の翌月1日0時（UTC、ミリ秒）を返す。
+        """
+        dt = datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc)
+        if dt.month == 12:
+            next_month = datetime(dt.year + 1, 1, 1, tzinfo=timezone.utc)
+        else:
+            next_month = datetime(dt.year, dt.month + 1, 1, tzinfo=timezone.utc)
+        return int(next_month.timestamp() * 1000)
+
+    @classmethod
+    def _split_shards(cls, since: int, until: int) -> List[Tuple[str, int, int]]:
+        """
+        [since, until) を月境界で分割し、(シャード名, 開始ms, 終了ms) のリストを返す。
+        """
+        shards = []
+        start = since
+        while start < until:
+            end = min(cls._month_end(start), until)
+            shards.append((datetime.fromtimestamp(start / 1000, tz=timezone.utc).strftime('%Y-%m'), start, end))
+            start = end
+        return shards
+
+    def _load_checkpoint(self) -> Dict[str, Dict[str, int]]:
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path) as f:
+            return json.load(f)
+
+    def _update_checkpoint(self, checkpoint: Dict[str, Dict[str, int]], name: str, start: int, cursor: int,
+                           end: int, done: bool) -> None:
+        """
+        :param start: 取得を始めた時刻（ミリ秒）。[start, cursor) の足は続けて取得済み。
+        :param end: シャードの終了時刻（ミリ秒）。done は月末まで確定した足をすべて取得した場合だけTrueにする。
+        """
+        with self._checkpoint_lock:
+            checkpoint[name] = {'start': start, 'cursor': cursor, 'end': end, 'done': done}
+            tmp_path = self.checkpoint_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(checkpoint, f)
+            os.replace(tmp_path, self.checkpoint_path)
+
+    @staticmethod
+    def _covers(entry: Dict[str, int], start: int) -> bool:
+        """
+        チェックポイントの記録が start から取得したものか。start のない古い記録はどこから取得したか分からない。
+        """
+        return 'start' in entry and entry['start'] <= start
+
+    def _fetch_page(self, since: int) -> list:
+        for attempt in range(self.max_retries):
+            self.rate_limiter.wait()
+            try:
+                return self._exchange().fetch_ohlcv(self.symbol, timeframe=self.timeframe, since=since, limit=self.limit)
+            except (ccxt.NetworkError, ccxt.RateLimitExceeded) as error:
+                wait_time = 2 ** attempt
+                logger.warning(f"取得に失敗したため{wait_time}秒後に再試行します: {error}")
+                time.sleep(wait_time)
+        raise ccxt.NetworkError(f"OHLCVの取得に{self.max_retries}回失敗しました: since={since}")
+
+    def _crawl_shard(self, name: str, start: int, end: int, checkpoint: Dict[str, Dict[str, int]], now: int) -> None:
+        """
+        1つのシャードを取得し、ページごとにストアへ追記する。確定していない足（ts + 足の長さ > now）は保存しない。
+        前回の取得が start 以前から始まっている場合だけ続きから取得し、それ以外は start から取得する
+        （前回より前にさかのぼる部分はストアが保存済みの足の前に挿入する）。
+        """
+        entry = checkpoint.get(name, {})
+        # 前回 [entry['start'], reach) を続けて取得済み。チェックポイントの更新前に停止した場合も、
+        # ストアに書き込み済みの足は取り直さない。ただし最後の足は確定前に保存した可能性があるため取り直す
+        # （ストアは同じ時刻の最後の足を上書きする）
+        reach = None
+        if 'start' in entry:
+            reach = entry['cursor']
+            last = self.store.last_timestamp(self.symbol, self.timeframe, month=name)
+            if last is not None and entry['start'] <= last < end:
+                reach = max(reach, last)
+        if self._covers(entry, start) and reach >= start:
+            since, first = reach, entry['start']
+        else:
+            # 記録がない場合も、ストアの足が start までさかのぼっていれば最後の足から取得する
+            since, first = start, start
+            stored_first = self.store.first_timestamp(self.symbol, self.timeframe, month=name)
+            last = self.store.last_timestamp(self.symbol, self.timeframe, month=name)
+            if reach is None and stored_first is not None and stored_first <= start <= last < end:
+                since = last
+        fetched = 0
+        # 月末がまだ来ていない、または until で月の途中までに切ったシャードは取得済みにしない
+        complete = end == self._month_end(start) and end <= now
+
+        done = False
+        while since < end:
+            ohlcv = self._fetch_page(since)
+            page = [candle for candle in ohlcv if since <= candle[0] < end and candle[0] + self.timeframe_ms <= now]
+            if not page:
+                # シャードより後のデータだけが返った場合、このシャードにはもうデータがない
+                done = complete and any(candle[0] >= end for candle in ohlcv)
+                break
+            self.store.append(self.symbol, self.timeframe, page)
+            fetched += len(page)
+            since = page[-1][0] + self.timeframe_ms
+            # 前回取得を始めた時刻まで埋めたら、前回の続きに進む
+            if reach is not None and first < entry['start'] <= since < reach:
+                since = reach
+            # 取得件数がlimit未満の場合は最新の足まで取得済み
+            if len(ohlcv) < self.limit:
+                break
+            self._update_checkpoint(checkpoint, name, first, since, end, done=False)
+
+        self._update_checkpoint(checkpoint, name, first, since, end, done=complete and (done or since >= end))
+        logger.info(f"シャード {name} の取得が完了しました: {fetched}本")
+
+    def crawl(self, since: Optional[int], until: Optional[int] = None) -> int:
+        """
+        [since, until) のOHLCVデータを取得してストアに保存し、until を返す。
+
+        :param since: 開始時刻（ミリ秒）。Noneの場合は直近limit本分。
+        :param until: 終了時刻（ミリ秒）。デフォルトは現在時刻。
+        """
+        now = int(time.time() * 1000)
+        until = until or now
+        if since is None:
+            since = until - self.limit * self.timeframe_ms
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        checkpoint = self._load_checkpoint()
+        shards = self._split_shards(since, until)
+
+        # シャードの開始時刻から月末まで取得済みのシャードは飛ばし、それ以外は _crawl_shard が再開する位置を決める。
+        # start のない古いチェックポイントは、どこから取得したか分からないため取得し直す
+        pending = [shard for shard in shards
+                   if not (checkpoint.get(shard[0], {}).get('done') and self._covers(checkpoint[shard[0]], shard[1]))]
+        logger.info(f"{len(shards)}シャード中{len(pending)}シャードを取得します。")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._crawl_shard, name, start, end, checkpoint, now)
+                       for name, start, end in pending]
+            for future in as_completed(futures):
+                future.result()
+
+        return until
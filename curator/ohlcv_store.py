@@ -0,0 +1,232 @@
+import os
+import logging
+from datetime import datetime
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 1本のローソク足のレコード形式
+OHLCV_DTYPE = np.dtype([
+    ('timestamp', '<i8'),
+    ('Open', '<f8'),
+    ('High', '<f8'),
+    ('Low', '<f8'),
+    ('Close', '<f8'),
+    ('Volume', '<f8'),
+])
+
+TimeLike = Union[int, str, datetime, pd.Timestamp]
+
+
+class OhlcvStore:
+    """
+    OHLCVデータを symbol/timeframe/月 ごとのバイナリファイルに保存するストア。
+    各ファイルは時刻順の固定長レコードを追記するだけ（最後の足だけは同じ時刻の足で上書きできる）なので、
+    読み込み時は必要な月のファイルだけをmemmapで開いて範囲を切り出せる。
+    保存済みの足より古い足（月の途中から取得していた場合のさかのぼった取得）は、月のファイルを書き直して挿入する。
+    """
+    def __init__(self, root_dir: str = 'strage/ohlcv'):
+        self.root_dir = root_dir
+
+    def _dir(self, symbol: str, timeframe: str) -> str:
+        return os.path.join(self.root_dir, symbol.replace('/', '_'), timeframe)
+
+    def _path(self, symbol: str, timeframe: str, month: str) -> str:
+        return os.path.join(self._dir(symbol, timeframe), f'{month}.bin')
+
+    @staticmethod
+    def _to_ms(value: TimeLike) -> int:
+        """
+        ミリ秒・文字列・datetimeをUNIXミリ秒に変換する。naiveな日時はUTCとみなす。
+        """
+        if isinstance(value, (int, np.integer)):
+            return int(value)
+        ts = pd.Timestamp(value)
+        if ts.tzinfo is not None:
+            ts = ts.tz_convert('UTC').tz_localize(None)
+        return int(ts.value // 1_000_000)
+
+    @staticmethod
+    def _month_of(timestamps: np.ndarray) -> np.ndarray:
+        return timestamps.astype('datetime64[ms]').astype('datetime64[M]')
+
+    def _open(self, path: str) -> np.ndarray:
+        """
+        パーティションを読み取り専用のmemmapで開く。書き込み途中の端数レコードは無視する。
+        """
+        count = os.path.getsize(path) // OHLCV_DTYPE.itemsize
+        if count == 0:
+            return np.empty(0, dtype=OHLCV_DTYPE)
+        return np.memmap(path, dtype=OHLCV_DTYPE, mode='r', shape=(count,))
+
+    def _last_timestamp_of(self, path: str) -> Optional[int]:
+        if not os.path.exists(path):
+            return None
+        records = self._open(path)
+        return int(records['timestamp'][-1]) if len(records) else None
+
+    @staticmethod
+    def to_records(ohlcv: Union[list, pd.DataFrame]) -> np.ndarray:
+        """
+        ccxt形式のリスト、またはOpen〜Volume列を持つDataFrameをレコード配列に変換する。
+        """
+        if isinstance(ohlcv, pd.DataFrame):
+            records = np.empty(len(ohlcv), dtype=OHLCV_DTYPE)
+            index = ohlcv.index
+            if isinstance(index, pd.DatetimeIndex):
+                if index.tz is not None:
+                    index = index.tz_convert('UTC').tz_localize(None)
+                records['timestamp'] = index.values.astype('datetime64[ms]').astype(np.int64)
+            else:
+                records['timestamp'] = np.asarray(index, dtype=np.int64)
+            for name in OHLCV_DTYPE.names[1:]:
+                records[name] = ohlcv[name].to_numpy(dtype=np.float64)
+            return records
+
+        array = np.asarray(ohlcv, dtype=np.float64).reshape(-1, len(OHLCV_DTYPE.names))
+        records = np.empty(len(array), dtype=OHLCV_DTYPE)
+        records['timestamp'] = array[:, 0].astype(np.int64)
+        for i, name in enumerate(OHLCV_DTYPE.names[1:], start=1):
+            records[name] = array[:, i]
+        return records
+
+    def append(self, symbol: str, timeframe: str, ohlcv: Union[list, pd.DataFrame]) -> int:
+        """
+        ローソク足を月ごとのパーティションに追記する。最後の足と同じ時刻の足は、
+        確定前の足を保存していた場合に直せるよう、最後の足を上書きする。
+        最後の足より古い足を含む場合は、保存済みの足と合わせて時刻順に並べ直したファイルに置き換える
+        （同じ時刻の足は新しく渡した足を残す）。
+
+        :return: 書き込んだ本数（上書きした足を含む）
+        """
+        records = self.to_records(ohlcv)
+        if len(records) == 0:
+            return 0
+        records = records[np.argsort(records['timestamp'], kind='stable')]
+
+        months = self._month_of(records['timestamp'])
+        boundaries = np.flatnonzero(months[1:] != months[:-1]) + 1
+        written = 0
+        for chunk in np.split(records, boundaries):
+            month = str(self._month_of(chunk['timestamp'][:1])[0])
+            path = self._path(symbol, timeframe, month)
+            if len(chunk) > 1:
+                # 同じ時刻の足が重複した場合は後の（新しい）1本だけ残す
+                chunk = chunk[np.concatenate((np.diff(chunk['timestamp']) > 0, [True]))]
+            last = self._last_timestamp_of(path)
+            if last is not None and chunk['timestamp'][0] < last:
+                written += self._rewrite_partition(path, chunk)
+                continue
+            if last is not None:
+                self._truncate_partial_record(path)
+                same = chunk[chunk['timestamp'] == last]
+                if len(same):
+                    with open(path, 'r+b') as f:
+                        f.seek(-OHLCV_DTYPE.itemsize, os.SEEK_END)
+                        same.tofile(f)
+                    written += 1
+                chunk = chunk[chunk['timestamp'] > last]
+            if len(chunk) == 0:
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._truncate_partial_record(path)
+            with open(path, 'ab') as f:
+                chunk.tofile(f)
+            written += len(chunk)
+        return written
+
+    def _rewrite_partition(self, path: str, chunk: np.ndarray) -> int:
+        """
+        保存済みの足と chunk を時刻順に並べ直したファイルを一時ファイルに書き、置き換える。
+        書き込み中に停止しても元のファイルは壊れない。
+
+        :return: 書き込んだ本数（chunk の本数）
+        """
+        stored = np.array(self._open(path))
+        merged = np.concatenate((stored, chunk))
+        merged = merged[np.argsort(merged['timestamp'], kind='stable')]
+        merged = merged[np.concatenate((np.diff(merged['timestamp']) > 0, [True]))]
+        tmp_path = path + '.tmp'
+        merged.tofile(tmp_path)
+        os.replace(tmp_path, path)
+        return len(chunk)
+
+    @staticmethod
+    def _truncate_partial_record(path: str) -> None:
+        # 書き込み途中で停止した場合の端数バイトを削除する
+        if not os.path.exists(path):
+            return
+        size = os.path.getsize(path)
+        remainder = size % OHLCV_DTYPE.itemsize
+        if remainder:
+            with open(path, 'r+b') as f:
+                f.truncate(size - remainder)
+
+    def partitions(self, symbol: str, timeframe: str) -> List[str]:
+        """
+        保存済みの月(YYYY-MM)の一覧を古い順に返す。
+        """
+        directory = self._dir(symbol, timeframe)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-len('.bin')] for name in os.listdir(directory) if name.endswith('.bin'))
+
+    def last_timestamp(self, symbol: str, timeframe: str, month: Optional[str] = None) -> Optional[int]:
+        """
+        保存済みの最新の足の時刻（ミリ秒）を返す。monthを指定した場合はその月の中での最新。
+        """
+        months = [month] if month else self.partitions(symbol, timeframe)[::-1]
+        for name in months:
+            last = self._last_timestamp_of(self._path(symbol, timeframe, name))
+            if last is not None:
+                return last
+        return None
+
+    def first_timestamp(self, symbol: str, timeframe: str, month: Optional[str] = None) -> Optional[int]:
+        """
+        保存済みの最古の足の時刻（ミリ秒）を返す。monthを指定した場合はその月の中での最古。
+        """
+        months = [month] if month else self.partitions(symbol, timeframe)
+        for name in months:
+            path = self._path(symbol, timeframe, name)
+            if os.path.exists(path):
+                records = self._open(path)
+                if len(records):
+                    return int(records['timestamp'][0])
+        return None
+
+    def read_range_records(self, symbol: str, timeframe: str, start: TimeLike, end: TimeLike) -> np.ndarray:
+        """
+        [start, end) の範囲のレコード配列を返す。該当する月のパーティションだけを読む。
+        """
+        start_ms, end_ms = self._to_ms(start), self._to_ms(end)
+        if end_ms <= start_ms:
+            return np.empty(0, dtype=OHLCV_DTYPE)
+
+        first_month, last_month = self._month_of(np.array([start_ms, end_ms - 1], dtype=np.int64))
+        slices = []
+        for month in np.arange(first_month, last_month + 1):
+            path = self._path(symbol, timeframe, str(month))
+            if not os.path.exists(path):
+                continue
+            records = self._open(path)
+            timestamps = records['timestamp']
+            lo = np.searchsorted(timestamps, start_ms, side='left')
+            hi = np.searchsorted(timestamps, end_ms, side='left')
+            if hi > lo:
+                slices.append(np.array(records[lo:hi]))
+        if not slices:
+            return np.empty(0, dtype=OHLCV_DTYPE)
+        return np.concatenate(slices)
+
+    def read_range(self, symbol: str, timeframe: str, start: TimeLike, end: TimeLike) -> pd.DataFrame:
+        """
+        [start, end) の範囲のOHLCVデータをtimestampをインデックスとするDataFrameで返す。
+        """
+        records = self.read_range_records(symbol, timeframe, start, end)
+        df = pd.DataFrame({name: records[name] for name in OHLCV_DTYPE.names[1:]})
+        df.index = pd.DatetimeIndex(records['timestamp'].astype('datetime64[ms]'), name='timestamp')
+        return df
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+import ccxt
+
+from infra.bybit.exchange_registry import get_async_exchange, load_credentials
+
+logger = logging.getLogger(__name__)
+
+
+class OrderAck(NamedTuple):
+    """
+    注文・取消・価格変更の結果を取引所によらない形にしたもの。error がNoneでなければ失敗。
+    """
+    id: Optional[str]
+    symbol: str
+    side: Optional[str]
+    price: Optional[float]
+    amount: Optional[float]
+    filled: float
+    status: str             # open / closed / canceled / rejected
+    error: Optional[str]
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _order_error(order: Dict[str, Any]) -> Optional[str]:
+    # 一括のAPIでは、失敗した注文の info に取引所のエラーコードとメッセージが入る
+    info = order.get('info') or {}
+    code = info.get('code', info.get('retCode'))
+    if code not in (None, 0, '0'):
+        return f"{code}: {info.get('msg', info.get('retMsg'))}"
+    if order.get('status') == 'rejected':
+        return 'rejected'
+    return None
+
+
+def normalize_order(order: Dict[str, Any], request: Optional[Dict[str, Any]] = None) -> OrderAck:
+    """
+    ccxtの注文の形式を OrderAck にする。一括のAPIは id しか返さないことがあるため、足りない値は request で補う。
+    """
+    request = request or {}
+    error = _order_error(order)
+
+    def value(name: str) -> Any:
+        return order.get(name) if order.get(name) is not None else request.get(name)
+
+    return OrderAck(
+        id=value('id'),
+        symbol=value('symbol'),
+        side=value('side'),
+        price=value('price'),
+        amount=value('amount'),
+        filled=order.get('filled') or 0.0,
+        status='rejected' if error else (order.get('status') or 'open'),
+        error=error,
+    )
+
+
+def failed_ack(request: Dict[str, Any], error: BaseException) -> OrderAck:
+    return OrderAck(request.get('id'), request.get('symbol'), request.get('side'), request.get('price'),
+                    request.get('amount'), 0.0, 'rejected', f"{type(error).__name__}: {error}")
+
+
+class AsyncBybitTrader:
+    """
+    BybitTrader と BybitOrder の非同期版（ccxt.async_support）。
+    複数の注文は一括のAPI（create-batch / amend-batch / cancel-batch）で batch_size 件ずつまとめ、
+    まとめた単位のリクエストを同時に発行する。そのため、N件の注文の価格の変更は往復1回分の時間で終わる。
+    リクエストの間隔は ccxt のレート制限（enableRateLimit）に任せる。
+    """
+    def __init__(self, symbol: str = 'BTC/USDT', exchange: Any = None, batch_size: int = 10):
+        """
+        :param exchange: ccxt.async_support の exchange（デフォルトは exchange_registry で共有するインスタンス）。
+                         実行中のイベントループが必要なため、指定しない場合は最初に使うときに取得する。
+        :param batch_size: 一括のAPIで1回に送る注文の数（Bybitの現物は10件まで）
+        """
+        self.symbol = symbol
+        self._exchange = exchange
+        self.batch_size = batch_size
+
+    @property
+    def exchange(self) -> Any:
+        if self._exchange is None:
+            api_key, secret = load_credentials()
+            self._exchange = get_async_exchange('bybit', api_key, secret, {'enableRateLimit': True})
+        return self._exchange
+
+    def _has(self, name: str) -> bool:
+        return bool(getattr(self.exchange, 'has', {}).get(name))
+
+    def _chunks(self, items: Sequence[Any]) -> List[Sequence[Any]]:
+        return [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+
+    async def _batched(self, method: str, single, requests: List[Dict[str, Any]], call) -> List[OrderAck]:
+        """
+        一括のAPIがあれば batch_size 件ずつ、なければ1件ずつのリクエストを同時に発行し、requests の順に結果を返す。
+        """
+        if not requests:
+            return []
+        if self._has(method):
+            chunks = self._chunks(requests)
+            results = await asyncio.gather(*(call(chunk) for chunk in chunks), return_exceptions=True)
+            acks: List[OrderAck] = []
+            for chunk, result in zip(chunks, results):
+                if isinstance(result, BaseException):
+                    acks.extend(failed_ack(request, result) for request in chunk)
+                else:
+                    acks.extend(normalize_order(order, request) for order, request in zip(result, chunk))
+            return acks
+        results = await asyncio.gather(*(single(request) for request in requests), return_exceptions=True)
+        return [failed_ack(request, result) if isinstance(result, BaseException) else normalize_order(result, request)
+                for request, result in zip(requests, results)]
+
+    async def fetch_balance(self) -> Dict[str, float]:
+        """
+        利用可能な残高（通貨 -> 数量）を返す。
+        """
+        return (await self.exchange.fetch_balance())['free']
+
+    async def fetch_open_orders(self) -> List[OrderAck]:
+        return [normalize_order(order) for order in await self.exchange.fetch_open_orders(self.symbol)]
+
+    async def create_limit_orders(self, orders: Sequence[Dict[str, Any]]) -> List[OrderAck]:
+        """
+        指値注文をまとめて出す。
+
+        :param orders: {'side': 'buy' または 'sell', 'amount': 数量, 'price': 価格} のリスト
+        """
+        requests = []
+        for order in orders:
+            if order['side'] not in ('buy', 'sell'):
+                raise ValueError("sideには 'buy' または 'sell' を指定してください。")
+            requests.append({'symbol': self.symbol, 'type': 'limit', 'side': order['side'],
+                             'amount': order['amount'], 'price': order['price'], 'params': order.get('params', {})})
+        return await self._batched(
+            'createOrders',
+            lambda r: self.exchange.create_order(r['symbol'], 'limit', r['side'], r['amount'], r['price'], r['params']),
+            requests,
+            lambda chunk: self.exchange.create_orders(list(chunk)),
+        )
+
+    async def create_limit_order(self, side: str, amount: float, price: float) -> OrderAck:
+        return (await self.create_limit_orders([{'side': side, 'amount': amount, 'price': price}]))[0]
+
+    async def reprice_orders(self, orders: Sequence[OrderAck], prices: Sequence[float]) -> List[OrderAck]:
+        """
+        板に置いている注文の価格をまとめて変更する（数量はそのまま）。
+
+        :param orders: fetch_open_orders や create_limit_orders の結果
+        :param prices: 各注文の新しい価格
+        """
+        requests = [{'id': order.id, 'symbol': self.symbol, 'type': 'limit', 'side': order.side,
+                     'amount': order.amount, 'price': price} for order, price in zip(orders, prices)]
+        return await self._batched(
+            'editOrders',
+            lambda r: self.exchange.edit_order(r['id'], r['symbol'], 'limit', r['side'], r['amount'], r['price']),
+            requests,
+            lambda chunk: self.exchange.edit_orders(list(chunk)),
+        )
+
+    async def cancel_orders(self, ids: Sequence[str]) -> List[OrderAck]:
+        """
+        指定した注文をまとめて取り消す。
+        """
+        requests = [{'id': str(order_id), 'symbol': self.symbol} for order_id in ids]
+        acks = await self._batched(
+            'cancelOrders',
+            lambda r: self.exchange.cancel_order(r['id'], self.symbol),
+            requests,
+            lambda chunk: self.exchange.cancel_orders([r['id'] for r in chunk], self.symbol),
+        )
+        # 取消の応答には状態が入らないことがあるため、成功したものは canceled にする
+        return [ack._replace(status='canceled') if ack.ok else ack for ack in acks]
+
+    async def cancel_all_orders(self) -> List[OrderAck]:
+        """
+        銘柄の有効な注文をすべて取り消す。一括取消のAPIがあれば1回のリクエストで済ませる。
+        """
+        if self._has('cancelAllOrders'):
+            try:
+                orders = await self.exchange.cancel_all_orders(self.symbol)
+            except ccxt.BaseError as e:
+                logger.error(f"注文のキャンセルでエラー: {e}")
+                return [failed_ack({'symbol': self.symbol}, e)]
+            acks = [normalize_order(order, {'symbol': self.symbol}) for order in orders or []]
+            return [ack._replace(status='canceled') if ack.ok else ack for ack in acks]
+        return await self.cancel_orders([order.id for order in await self.fetch_open_orders()])
+
+    async def close(self) -> None:
+        if self._exchange is not None:
+            await self._exchange.close()
+
+
+# 10件の指値注文の価格を変更する場合の、1件ずつと一括の比較（取引所はシミュレーション）
+if __name__ == "__main__":
+    import sys
+    import time
+    from infra.sim.matching_engine import MatchingEngine
+    from infra.sim.sim_bybit import SimulatedAsyncCcxtExchange
+
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+
+    async def main() -> None:
+        engine = MatchingEngine(base='BTC', quote='USDT', balances={'USDT': 100_000.0}, min_order_size=0.000048,
+                                size_step=0.000001)
+        engine.on_bar(0, 60_000, 60_000, 60_000, 60_000, 1.0)
+        exchange = SimulatedAsyncCcxtExchange(engine, 'BTC/USDT', latency=latency)
+        trader = AsyncBybitTrader('BTC/USDT', exchange=exchange)
+        ladder = [{'side': 'buy', 'amount': 0.01, 'price': 59_000 - 100 * i} for i in range(10)]
+
+        start = time.perf_counter()
+        placed = await trader.create_limit_orders(ladder)
+        print(f"注文 {len(placed)}件: {(time.perf_counter() - start) * 1000:.0f} ms  成功 {sum(ack.ok for ack in placed)}件")
+
+        start = time.perf_counter()
+        for ack in placed:
+            await exchange.edit_order(ack.id, 'BTC/USDT', 'limit', ack.side, ack.amount, ack.price - 50)
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        repriced = await trader.reprice_orders(placed, [ack.price - 100 for ack in placed])
+        batched = time.perf_counter() - start
+        print(f"価格の変更 {len(repriced)}件（往復 {latency * 1000:.0f} ms）: 1件ずつ {sequential * 1000:.0f} ms  "
+              f"一括 {batched * 1000:.0f} ms  成功 {sum(ack.ok for ack in repriced)}件")
+
+        start = time.perf_counter()
+        canceled = await trader.cancel_all_orders()
+        print(f"取消 {len(canceled)}件: {(time.perf_counter() - start) * 1000:.0f} ms  残り {len(engine.orders)}件")
+
+    asyncio.run(main())
@@ -1,20 +1,14 @@
-import ccxt
-import os
-from dotenv import load_dotenv
+from infra.bybit.exchange_registry import get_exchange, load_credentials
 
 class BybitAuth:
     def __init__(self,symbol='BTC/USDT', timeframe='15m'):
-        # 環境変数のロード
-        load_dotenv(".environment_pr/.env")
-
-        self.api_key = os.getenv('BYBIT_API_PUBLIC')
-        self.api_secret = os.getenv('BYBIT_API_SECRET')
+        # 環境変数のロード（.env の読み込みはプロセスで1回だけ）
+        self.api_key, self.api_secret = load_credentials(".environment_pr/.env")
     
         self.symbol = symbol
         self.timeframe = timeframe
-        self.exchange = ccxt.bybit({
-            'apiKey': self.api_key,
-            'secret': self.api_secret,
+        # 同じ認証情報のインスタンスはプロセスで1つを共有し、銘柄情報は strage/markets に保存したものを使う
+        self.exchange = get_exchange('bybit', self.api_key, self.api_secret, {
             'enableRateLimit': True,  # レートリミットを有効化
         })
         
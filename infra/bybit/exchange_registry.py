@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import asyncio
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+import ccxt
+import ccxt.async_support as ccxt_async
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# 取引所の銘柄情報（load_markets の結果）を保存するディレクトリと有効期限（秒）
+MARKETS_DIR = 'strage/markets'
+MARKETS_TTL = 24 * 60 * 60
+
+_instances: Dict[Tuple[str, str, str, str], ccxt.Exchange] = {}
+# 非同期版のインスタンスはイベントループごとに持つ
+_async_instances: Dict[Tuple[int, str, str, str, str], ccxt_async.Exchange] = {}
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def load_credentials(env_path: str = ".environment_pr/.env") -> Tuple[Optional[str], Optional[str]]:
+    """
+    BybitのAPIキーとシークレットを返す。.env はプロセスで1回だけ読み込む。
+    """
+    load_dotenv(env_path)
+    return os.getenv('BYBIT_API_PUBLIC'), os.getenv('BYBIT_API_SECRET')
+
+
+def _key(exchange_id: str, api_key: Optional[str], secret: Optional[str], config: Dict[str, Any]) -> Tuple[str, str, str, str]:
+    # シークレットはそのまま持たずにハッシュをキーにする
+    secret_hash = hashlib.sha256((secret or '').encode('utf-8')).hexdigest()
+    return exchange_id, api_key or '', secret_hash, json.dumps(config, sort_keys=True, default=str)
+
+
+def _markets_path(exchange_id: str, markets_dir: str) -> str:
+    return os.path.join(markets_dir, f'{exchange_id}.json')
+
+
+def restore_markets(exchange: Any, markets_dir: Optional[str] = MARKETS_DIR, ttl: float = MARKETS_TTL) -> bool:
+    """
+    保存済みの銘柄情報が有効期限内であれば、取引所に問い合わせずに exchange に設定する（同期版・非同期版の両方）。
+    設定した場合はTrueを返す。
+    """
+    path = _markets_path(exchange.id, markets_dir) if markets_dir else None
+    if not path or not os.path.exists(path) or time.time() - os.path.getmtime(path) >= ttl:
+        return False
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+        exchange.set_markets(saved['markets'], saved.get('currencies'))
+        return True
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"保存した銘柄情報を読み込めませんでした: {path} {e}")
+        return False
+
+
+def load_markets(exchange: ccxt.Exchange, markets_dir: Optional[str] = MARKETS_DIR, ttl: float = MARKETS_TTL,
+                 reload: bool = False) -> Dict[str, Any]:
+    """
+    保存済みの銘柄情報が有効期限内であれば取引所に問い合わせずに設定し、
+    そうでなければ load_markets で取得して保存する。
+
+    :param markets_dir: 保存先（Noneの場合は保存しない）
+    :param reload: 保存済みの銘柄情報を使わずに取得し直す
+    """
+    if not reload and restore_markets(exchange, markets_dir, ttl):
+        return exchange.markets
+
+    path = _markets_path(exchange.id, markets_dir) if markets_dir else None
+    markets = exchange.load_markets(reload=True)
+    if path:
+        os.makedirs(markets_dir, exist_ok=True)
+        # 他のプロセスが書きかけのファイルを読まないよう、一時ファイルに書いてから置き換える
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'markets': list(markets.values()), 'currencies': exchange.currencies}, f)
+        os.replace(tmp_path, path)
+    return markets
+
+
+def create_exchange(exchange_id: str = 'bybit', api_key: Optional[str] = None, secret: Optional[str] = None,
+                    config: Optional[Dict[str, Any]] = None, markets_dir: Optional[str] = MARKETS_DIR,
+                    markets_ttl: float = MARKETS_TTL) -> ccxt.Exchange:
+    """
+    共有しない新しいインスタンスを作る（スレッドごとにインスタンスが必要なクローラなど）。
+    銘柄情報は保存済みのものを使う。
+    """
+    exchange = getattr(ccxt, exchange_id)({'apiKey': api_key, 'secret': secret, **(config or {})})
+    try:
+        load_markets(exchange, markets_dir, markets_ttl)
+    except ccxt.BaseError as e:
+        # 取得できない場合は、最初のリクエストのときに ccxt が取得する
+        logger.warning(f"{exchange_id}の銘柄情報を取得できませんでした: {e}")
+    return exchange
+
+
+def get_exchange(exchange_id: str = 'bybit', api_key: Optional[str] = None, secret: Optional[str] = None,
+                 config: Optional[Dict[str, Any]] = None, markets_dir: Optional[str] = MARKETS_DIR,
+                 markets_ttl: float = MARKETS_TTL) -> ccxt.Exchange:
+    """
+    取引所・認証情報・設定ごとにプロセスで1つのインスタンスを返す。
+    同じ組み合わせで呼んだ BybitAuth のサブクラスは同じインスタンス（とレート制限と銘柄情報）を共有する。
+    ccxtの同期クライアントはスレッドセーフではないため、複数のスレッドから使う場合は create_exchange を使う。
+
+    :param config: apiKey と secret 以外の ccxt の設定（例: {'enableRateLimit': True}）
+    """
+    key = _key(exchange_id, api_key, secret, config or {})
+    with _lock:
+        exchange = _instances.get(key)
+        if exchange is None:
+            exchange = create_exchange(exchange_id, api_key, secret, config, markets_dir, markets_ttl)
+            _instances[key] = exchange
+        return exchange
+
+
+def get_async_exchange(exchange_id: str = 'bybit', api_key: Optional[str] = None, secret: Optional[str] = None,
+                       config: Optional[Dict[str, Any]] = None, markets_dir: Optional[str] = MARKETS_DIR,
+                       markets_ttl: float = MARKETS_TTL) -> ccxt_async.Exchange:
+    """
+    get_exchange の非同期版（ccxt.async_support）。実行中のイベントループごとに1つのインスタンスを返す。
+    銘柄情報は保存済みのものがあれば使い、なければ最初のリクエストのときに ccxt が取得する。
+    使い終わったら close_async_exchanges でセッションを閉じる。
+    """
+    loop = asyncio.get_running_loop()
+    key = (id(loop),) + _key(exchange_id, api_key, secret, config or {})
+    exchange = _async_instances.get(key)
+    if exchange is None:
+        exchange = getattr(ccxt_async, exchange_id)({'apiKey': api_key, 'secret': secret, **(config or {})})
+        restore_markets(exchange, markets_dir, markets_ttl)
+        _async_instances[key] = exchange
+    return exchange
+
+
+async def close_async_exchanges() -> None:
+    """
+    実行中のイベントループの非同期版のインスタンスを閉じる。
+    """
+    loop_id = id(asyncio.get_running_loop())
+    for key in [key for key in _async_instances if key[0] == loop_id]:
+        await _async_instances.pop(key).close()
+
+
+def clear_exchanges() -> None:
+    """
+    共有しているインスタンスをすべて破棄する（認証情報を変えた場合など）。
+    """
+    with _lock:
+        _instances.clear()
@@ -1,7 +1,5 @@
-import time
-import pandas as pd
-from datetime import datetime, timedelta, timezone
 from infra.bybit.auth import BybitAuth
+from modules.kline_decoder import decode_ccxt_ohlcv
 
 class BybitKlineDataFetcher(BybitAuth):
     def __init__(self):
@@ -9,22 +7,24 @@ class BybitKlineDataFetcher(BybitAuth):
         
         
     
-    def fetch_ohlcv(self):
+    def fetch_ohlcv(self, limit=None):
         """
         OHLCVデータを取得します。
+
+        :param limit: 取得する本数（indicator_lookback.plan_lookback で求めた本数など）。
+                      Noneの場合は取引所のデフォルトの本数。
         """
-  
-        ohlcv = self.exchange.fetch_ohlcv(self.symbol, self.timeframe)
-        for candle in ohlcv:
-            print(f"Time: {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(candle[0] / 1000))}, "
-                    f"Open: {candle[1]}, High: {candle[2]}, Low: {candle[3]}, Close: {candle[4]}, Volume: {candle[5]}")
-            
-            df = pd.DataFrame(ohlcv, columns=['timestamp', 'Open', 'High', 'Low', 'Close', 'Volume'])
-            
-            df.set_index('timestamp', inplace=True)
-            return df
+        since, params = None, {}
+        if limit is not None and limit > 1000:
+            # Bybitは1回のリクエストで1000本までのため、開始時刻を指定してccxtに分割して取得させる
+            since = self.exchange.milliseconds() - limit * self.exchange.parse_timeframe(self.timeframe) * 1000
+            params = {'paginate': True}
+        ohlcv = self.exchange.fetch_ohlcv(self.symbol, self.timeframe, since=since, limit=limit, params=params)
+        if limit is not None:
+            ohlcv = ohlcv[-limit:]
+        return decode_ccxt_ohlcv(ohlcv)
 
 # 動作確認
 if __name__ == "__main__":
     df = BybitKlineDataFetcher().fetch_ohlcv()
-    print(df)
\ No newline at end of file
+    print(df)
\ No newline at end of file
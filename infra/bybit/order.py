@@ -23,6 +23,7 @@ class BybitOrder(BybitAuth):
         super().__init__()
         
         self.min_order_size = 0.000048
+        self.equity_fraction = 0.7
         self.bybit_trader = BybitTrader()
         
         
@@ -32,8 +33,8 @@ class BybitOrder(BybitAuth):
         """
         try:
             # すべての関連変数をfloatに変換
-            #FIXME: balance_jpyの型が不明
-            balance_jpy = float(self.bybit_trader.fetch_balance()['JPY'])
+            # 決済通貨（BTC/USDTの場合はUSDT）の残高
+            balance_jpy = float(self.bybit_trader.fetch_balance()[self.symbol.split('/')[1]])
             current_price = float(current_price)
             self.equity_fraction = float(self.equity_fraction)
             self.size_step = float(min_size)
@@ -62,15 +62,10 @@ class BybitTrader(BybitAuth):
         すべてのオープン注文をキャンセルします。
         """
         try:
-            # すべてのオープン注文を取得
-            open_orders = self.exchange.fetch_open_orders()
+            # 一括取消のAPIで、注文の取得と1件ずつの取消をせずに1回のリクエストで取り消す
+            canceled = self.exchange.cancel_all_orders(self.symbol)
 
-            # 各注文をキャンセル
-            for order in open_orders:
-                order_id = order['id']
-                self.cansel_order(order_id)
-
-            print(f"{len(open_orders)} 注文のキャンセルが完了")
+            print(f"{len(canceled or [])} 注文のキャンセルが完了")
 
         except Exception as e:
             print(f"注文のキャンセルでエラー: {e}")
@@ -9,10 +9,12 @@ import asyncio
 import os
 import pybotters
 from pybotters.helpers import GMOCoinHelper
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 from dotenv import load_dotenv
 from datetime import datetime, timezone
 
+from infra.gmo.gmo_cache import MISSING, TtlCache
+
 # ロギングの設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -21,7 +23,13 @@ class GmoAuth:
     """
     GMOコインのAPI認証とデータ取得を行うクラス。
     """
-    def __init__(self, symbol_str: str = 'BTC'):
+    def __init__(self, symbol_str: str = 'BTC', cache_ttl: Optional[Dict[str, float]] = None,
+                 cache: Optional[TtlCache] = None):
+        """
+        :param cache_ttl: 銘柄情報・ティッカー・残高のキャッシュの有効期限（秒）。例: {'ticker': 0} でティッカーはキャッシュしない
+        :param cache: 他のインスタンスと共有するキャッシュ（指定した場合は cache_ttl を使わない）
+        """
+        self.cache = cache if cache is not None else TtlCache(cache_ttl)
         # 環境変数のロード
         load_dotenv(".environment/.env")
 
@@ -58,6 +66,9 @@ class GmoAuth:
         """
         アカウントの残高を取得する。
         """
+        cached = self.cache.get('balance', self.symbol_str)
+        if cached is not MISSING:
+            return cached
         try:
             method = 'GET'
             endPoint = 'https://api.coin.z.com/private'
@@ -66,7 +77,8 @@ class GmoAuth:
             response = requests.get(endPoint + path, headers=headers)
 
             balance = response.json()
-            return {'JPY': balance['data'][0]["amount"], 'BTC': balance['data'][1]["amount"]}
+            return self.cache.put('balance', self.symbol_str,
+                                  {'JPY': balance['data'][0]["amount"], 'BTC': balance['data'][1]["amount"]})
         
         except Exception as e:
             logger.exception("残高取得中にエラーが発生しました。")
@@ -76,6 +88,9 @@ class GmoAuth:
         """
         取引可能なシンボル情報を取得する。
         """
+        cached = self.cache.get('symbols', self.symbol_str)
+        if cached is not MISSING:
+            return cached
         try:
             endPoint = 'https://api.coin.z.com/public'
             path = '/v1/symbols'
@@ -85,11 +100,12 @@ class GmoAuth:
                 symbols = response.json()
                 for symbol in symbols['data']:
                     if symbol['symbol'] == f'{self.symbol_str}':
-                        return {
+                        return self.cache.put('symbols', self.symbol_str, {
                             'symbol': symbol['symbol'],
                             'minOrderSize': float(symbol['minOrderSize']),
-                            'sizeStep': float(symbol['sizeStep'])
-                        }
+                            'sizeStep': float(symbol['sizeStep']),
+                            'tickSize': float(symbol.get('tickSize', 1))
+                        })
             else:
                 logger.error(f"シンボルの取得に失敗しました: {response.status_code} {response.text}")
                 response.raise_for_status()
@@ -102,6 +118,9 @@ class GmoAuth:
         """
         現在のティッカー情報を取得する。
         """
+        cached = self.cache.get('ticker', self.symbol_str)
+        if cached is not MISSING:
+            return cached
         try:
             endPoint = 'https://api.coin.z.com/public'
             path = f'/v1/ticker'
@@ -111,12 +130,19 @@ class GmoAuth:
             response = requests.get(endPoint + path, params=params)
             response.raise_for_status()
             data = response.json()['data'][0]
-            return {'bid': data['bid'], 'ask': data['ask']}
+            return self.cache.put('ticker', self.symbol_str, {'bid': data['bid'], 'ask': data['ask']})
 
         except Exception as e:
             logger.exception("ティッカー情報取得中にエラーが発生しました。")
             raise e
 
+    def on_order_event(self, event: Dict[str, Any]) -> None:
+        """
+        Private WebSocketのイベントを受け取り、約定した場合は残高のキャッシュを消す。
+        """
+        if event.get('channel') == 'executionEvents' or event.get('orderStatus') == 'EXECUTED':
+            self.cache.invalidate('balance')
+
     def cancel_order(self) -> Dict[str, Any]:
         """
         注文をキャンセルする。
@@ -172,6 +198,30 @@ class GmoAuth:
 
         except Exception as e:
             return None
+
+    def fetch_active_orders(self) -> List[Dict[str, Any]]:
+        """
+        有効な注文をすべて取得する。size は約定していない残りの数量。
+        """
+        try:
+            method = 'GET'
+            endPoint = 'https://api.coin.z.com/private'
+            path = '/v1/activeOrders'
+            params = {
+                'symbol': self.symbol_str,
+                'page': 1,
+                'count': 100
+            }
+            headers = self._create_headers(method, path)
+            response = requests.get(endPoint + path, headers=headers, params=params)
+            response.raise_for_status()
+            return [{'orderId': order['orderId'], 'side': order['side'], 'price': float(order['price']),
+                     'size': float(order['size']) - float(order.get('executedSize', 0))}
+                    for order in response.json()['data'].get('list', [])]
+
+        except Exception as e:
+            logger.exception("有効注文の取得中にエラーが発生しました。")
+            raise e
     
     
            
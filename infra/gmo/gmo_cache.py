@@ -0,0 +1,55 @@
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# エンドポイントごとの有効期限（秒）。銘柄情報はほとんど変わらず、残高は約定のイベントで消す。
+DEFAULT_CACHE_TTL: Dict[str, float] = {
+    'symbols': 3600.0,
+    'ticker': 1.0,
+    'balance': 60.0,
+}
+
+# キャッシュにないことを表す値（Noneもキャッシュできるようにする）
+MISSING = object()
+
+
+class TtlCache:
+    """
+    エンドポイントごとに有効期限を設定できるキャッシュ。
+    有効期限を設定していない、または0以下のエンドポイントはキャッシュしない。
+    """
+    def __init__(self, ttl: Optional[Dict[str, float]] = None, clock: Callable[[], float] = time.monotonic):
+        """
+        :param ttl: エンドポイント名 -> 有効期限（秒）。指定しないエンドポイントは DEFAULT_CACHE_TTL の値を使う。
+        """
+        self.ttl = {**DEFAULT_CACHE_TTL, **(ttl or {})}
+        self.clock = clock
+        self._entries: Dict[Tuple[str, Hashable], Tuple[float, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, endpoint: str, key: Hashable = None) -> Any:
+        """
+        有効期限内の値を返す。ない場合は MISSING。
+        """
+        entry = self._entries.get((endpoint, key))
+        if entry is None or entry[0] <= self.clock():
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return entry[1]
+
+    def put(self, endpoint: str, key: Hashable, value: Any) -> Any:
+        ttl = self.ttl.get(endpoint, 0.0)
+        if ttl > 0:
+            self._entries[(endpoint, key)] = (self.clock() + ttl, value)
+        return value
+
+    def invalidate(self, *endpoints: str) -> None:
+        """
+        指定したエンドポイントの値を消す。指定しない場合はすべて消す。
+        """
+        if not endpoints:
+            self._entries.clear()
+            return
+        for entry_key in [entry_key for entry_key in self._entries if entry_key[0] in endpoints]:
+            del self._entries[entry_key]
@@ -0,0 +1,183 @@
+import asyncio
+import time
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from pybotters import Client
+
+from modules.kline_decoder import JST, build_ohlcv_frame
+
+logger = logging.getLogger(__name__)
+
+
+class GmoCandleBuilder:
+    """
+    GMOコインのPublic WebSocketの約定(trades)からローソク足をリアルタイムに組み立てるクラス。
+    期間が終わった時点で確定足をキューに流すため、REST APIで足を取り直す必要がない。
+    """
+    WS_URL = 'wss://api.coin.z.com/ws/public/v1'
+
+    def __init__(self, symbol: str = 'BTC', interval: str = '15min', history_size: int = 500, close_grace: float = 0.2):
+        """
+        :param symbol: 銘柄
+        :param interval: 足の長さ（pandasのTimedelta表記）
+        :param history_size: 保持する確定足の本数
+        :param close_grace: 期間終了後、遅れて届く約定を待つ秒数
+        """
+        self.symbol = symbol
+        self.interval_ms = int(pd.Timedelta(interval).total_seconds() * 1000)
+        self.close_grace = close_grace
+        # 確定足: [開始時刻(ms), Open, High, Low, Close, Volume]
+        self.bars: Deque[List[float]] = deque(maxlen=history_size)
+        self.current: Optional[List[float]] = None
+        self._closed: asyncio.Queue = asyncio.Queue()
+        self._started_ms = int(time.time() * 1000)
+        # 確定済み・形成中の足より前の期間に遅れて届き、集計しなかった約定の数
+        self.late_trades = 0
+
+    def _period_start(self, timestamp_ms: int) -> int:
+        return timestamp_ms - timestamp_ms % self.interval_ms
+
+    def seed(self, df: pd.DataFrame) -> None:
+        """
+        REST APIで取得した足で履歴を初期化する。形成中の足は含めない。
+        """
+        timestamps = df.index.as_unit('ms').asi8
+        current_start = self._period_start(int(time.time() * 1000))
+        values = df[['Open', 'High', 'Low', 'Close', 'Volume']].to_numpy(dtype=np.float64)
+        self.bars.clear()
+        for timestamp, row in zip(timestamps, values):
+            if timestamp < current_start:
+                self.bars.append([int(timestamp), *row])
+
+    def on_trade(self, price: float, size: float, timestamp_ms: int) -> None:
+        """
+        約定1件を現在の足に反映する。新しい期間の約定であれば現在の足を確定する。
+        """
+        start = self._period_start(timestamp_ms)
+        if self.current is not None and start > self.current[0]:
+            self._close_current()
+        if self.current is None:
+            self._fill_empty_periods(start)
+        # 前の期間の約定を新しい足に混ぜると高値・安値・出来高が崩れるため、数えて捨てる
+        latest = self.current[0] if self.current is not None else (self.bars[-1][0] if self.bars else None)
+        if latest is not None and (start < latest or (self.current is None and start == latest)):
+            self.late_trades += 1
+            logger.warning(f"確定済みの足の約定を無視しました: {timestamp_ms}（累計{self.late_trades}件）")
+            return
+        if self.current is None:
+            self.current = [start, price, price, price, price, size]
+            return
+        bar = self.current
+        bar[2] = max(bar[2], price)
+        bar[3] = min(bar[3], price)
+        bar[4] = price
+        bar[5] += size
+
+    def _close_current(self) -> None:
+        bar = self.current
+        self.current = None
+        self.bars.append(bar)
+        self._closed.put_nowait(self._to_dict(bar, complete=bar[0] >= self._started_ms))
+
+    def _fill_empty_periods(self, until: int) -> None:
+        # 約定がなかった期間（最後の確定足の次から until の前まで）はすべて直前の終値で出来高0の足を作る。
+        # 履歴の足が連続していないと指標が崩れるため、複数の期間が空いた場合も1本ずつ作る
+        if not self.bars:
+            return
+        start = self.bars[-1][0] + self.interval_ms
+        while start < until:
+            close = self.bars[-1][4]
+            self.current = [start, close, close, close, close, 0.0]
+            self._close_current()
+            start += self.interval_ms
+
+    @staticmethod
+    def _to_dict(bar: List[float], complete: bool) -> Dict[str, Any]:
+        return {
+            'DateTime': pd.Timestamp(bar[0], unit='ms', tz='UTC').tz_convert(JST),
+            'Open': bar[1],
+            'High': bar[2],
+            'Low': bar[3],
+            'Close': bar[4],
+            'Volume': bar[5],
+            # 接続前から始まっていた足は約定の一部しか集計できていない
+            'complete': complete,
+        }
+
+    def onmessage(self, msg: Any, ws: Any) -> None:
+        """
+        pybottersのhdlr_jsonとして約定メッセージを処理する。
+        """
+        if not isinstance(msg, dict) or msg.get('channel') != 'trades':
+            return
+        try:
+            timestamp = datetime.fromisoformat(msg['timestamp'].replace('Z', '+00:00'))
+            self.on_trade(float(msg['price']), float(msg['size']), int(timestamp.timestamp() * 1000))
+        except (KeyError, ValueError) as e:
+            logger.warning(f"約定メッセージの解析に失敗しました: {msg} {e}")
+
+    async def _close_on_boundary(self) -> None:
+        """
+        期間の終了時刻に、約定の有無にかかわらず現在の足を確定する。
+        """
+        while True:
+            now_ms = int(time.time() * 1000)
+            boundary = self._period_start(now_ms) + self.interval_ms
+            await asyncio.sleep((boundary - now_ms) / 1000 + self.close_grace)
+            if self.current is not None and self.current[0] < boundary:
+                self._close_current()
+            self._fill_empty_periods(boundary)
+
+    async def wait_closed_bar(self) -> Dict[str, Any]:
+        """
+        次に確定した足を待って返す。
+        """
+        return await self._closed.get()
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        確定足の履歴をGmoDataFetcherと同じ形式（DateTime(JST)インデックス）のDataFrameで返す。
+        """
+        if not self.bars:
+            return pd.DataFrame()
+        array = np.asarray(self.bars, dtype=np.float64)
+        return build_ohlcv_frame(array[:, 0].astype(np.int64), array[:, 1:], tz=JST, index_name='DateTime')
+
+    async def run(self) -> None:
+        """
+        WebSocketに接続し、約定の購読と足の確定を続ける。
+        """
+        self._started_ms = int(time.time() * 1000)
+        async with Client() as client:
+            ws = await client.ws_connect(
+                self.WS_URL,
+                send_json={
+                    'command': 'subscribe',
+                    'channel': 'trades',
+                    'symbol': self.symbol,
+                },
+                hdlr_json=self.onmessage,
+            )
+            logger.info(f"=== {self.symbol}の約定の購読を開始しました。 ===")
+            boundary_task = asyncio.create_task(self._close_on_boundary())
+            try:
+                await ws.wait()
+            finally:
+                boundary_task.cancel()
+
+
+async def main():
+    builder = GmoCandleBuilder(symbol='BTC', interval='1min')
+    asyncio.create_task(builder.run())
+    while True:
+        bar = await builder.wait_closed_bar()
+        print(bar)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
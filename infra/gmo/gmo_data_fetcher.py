@@ -1,19 +1,154 @@
+import asyncio
+import time
 import aiohttp
 import pandas as pd
 from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
 import logging
 
+from infra.gmo.gmo_kline_cache import GmoKlineCache
+from modules.kline_decoder import decode_gmo_klines
+
 logger = logging.getLogger(__name__)
 
+
+class RateLimiter:
+    """
+    1秒あたりのリクエスト数を制限する非同期レートリミッタ。
+    """
+    def __init__(self, requests_per_second: float):
+        self.min_interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._next_time = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.min_interval
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+
+
 class GmoDataFetcher:
     """
     GMOコインからデータを非同期で取得するクラス。
     """
-    def __init__(self, proxy: str = None):
+    # GMOコインのklinesの日付は日本時間6:00に切り替わる
+    DAY_START_HOUR = 6
+    # 4hour以上の足は年単位(YYYY)で取得する
+    YEARLY_INTERVALS = ('4hour', '8hour', '12hour', '1day', '1week', '1month')
+    # 日付の切り替えから最後の足が公開されるまでの猶予（足1本の長さに加える）
+    PUBLISH_GRACE = timedelta(minutes=5)
+
+    def __init__(self, proxy: str = None, cache_dir: Optional[str] = 'strage/kline_cache',
+                 max_concurrency: int = 5, requests_per_second: float = 5.0):
         self.RestAPI_url = 'https://api.coin.z.com/public'
         self.proxy = proxy
+        # cache_dirにNoneを指定した場合はキャッシュを使わない
+        self.cache = GmoKlineCache(cache_dir) if cache_dir else None
+        # 同時リクエスト数とPublic APIのレート制限
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+
+    def _is_closed_date(self, date_str: str, current_time: datetime) -> bool:
+        """
+        指定した日付のローソク足がすべて確定済みかどうかを判定する。
+        """
+        business_date = (current_time - timedelta(hours=self.DAY_START_HOUR)).strftime('%Y%m%d')
+        return date_str < business_date[:len(date_str)]
+
+    def _period_end(self, date_str: str, tz: timezone) -> datetime:
+        """
+        dateパラメータ(YYYYMMDD または YYYY)の期間が終わる日時（翌日または翌年の日本時間6:00）を返す。
+        """
+        if len(date_str) == 4:
+            start = datetime(int(date_str) + 1, 1, 1, tzinfo=tz)
+        else:
+            start = datetime.strptime(date_str, '%Y%m%d').replace(tzinfo=tz) + timedelta(days=1)
+        return start + timedelta(hours=self.DAY_START_HOUR)
 
-    async def fetch_kline_data(self, symbol: str, interval: str) -> pd.DataFrame:
+    def _is_complete(self, date_str: str, interval: str, df: pd.DataFrame, current_time: datetime) -> bool:
+        """
+        確定済みの日付について、取得したデータを以後取得し直さなくてよいか（最後の足まで含むか）を判定する。
+        日付の切り替え直後は最後の足がまだ公開されていないことがあるため、最後の足を含まない場合は
+        切り替えから足1本の長さと PUBLISH_GRACE が過ぎるまでは確定としない。
+        """
+        period_end = self._period_end(date_str, current_time.tzinfo)
+        interval_length = self._interval_timedelta(interval).to_pytimedelta()
+        if not df.empty and df.index[-1] >= period_end - interval_length:
+            return True
+        return current_time >= period_end + interval_length + self.PUBLISH_GRACE
+
+    def _date_keys(self, interval: str, start: datetime, end: datetime) -> List[str]:
+        """
+        期間内のklinesのdateパラメータ(YYYYMMDD または YYYY)を古い順に返す。
+        """
+        if interval in self.YEARLY_INTERVALS:
+            return [str(year) for year in range(start.year, end.year + 1)]
+        days = (end.date() - start.date()).days
+        return [(start + timedelta(days=i)).strftime('%Y%m%d') for i in range(days + 1)]
+
+    async def _fetch_day(self, session: aiohttp.ClientSession, symbol: str, interval: str, date_str: str,
+                         limiter: Optional[RateLimiter] = None) -> List[Dict[str, Any]]:
+        """
+        1日分（4hour以上の足は1年分）のローソク足を取得する。
+        """
+        url = f"{self.RestAPI_url}/v1/klines"
+        params = {
+            'symbol': symbol,
+            'interval': interval,
+            'date': date_str
+        }
+        if limiter is not None:
+            await limiter.wait()
+        async with session.get(url, params=params, proxy=self.proxy) as response:
+            response.raise_for_status()
+            ohlcv_data = await response.json()
+            if 'data' in ohlcv_data:
+                return ohlcv_data['data']
+            logger.warning(f"データが存在しません: {date_str}")
+            return []
+
+    async def _fetch_day_cached(self, session: aiohttp.ClientSession, symbol: str, interval: str, date_str: str,
+                                current_time: datetime, limiter: Optional[RateLimiter] = None) -> pd.DataFrame:
+        """
+        確定済みの日付はキャッシュから返し、それ以外はAPIから取得してキャッシュに反映する。
+        確定済みの日付でも最後の足が揃っていない場合は未確定として保存し、次の周期で取得し直す。
+        """
+        closed = self._is_closed_date(date_str, current_time)
+        if self.cache is not None and closed:
+            cached = self.cache.load(symbol, interval, date_str)
+            if cached is not None:
+                return cached
+
+        df = self._to_dataframe(await self._fetch_day(session, symbol, interval, date_str, limiter))
+        if self.cache is None or df.empty:
+            return df
+        if closed and self._is_complete(date_str, interval, df, current_time):
+            self.cache.save(symbol, interval, date_str, df)
+            return df
+        return self.cache.merge(symbol, interval, date_str, df)
+
+    @staticmethod
+    def _interval_timedelta(interval: str) -> pd.Timedelta:
+        """
+        klinesのinterval（1min, 1hour, 1day, 1week, 1month など）を足1本の長さに変換する。
+        1monthは31日として扱う。
+        """
+        if interval.endswith('week'):
+            return pd.Timedelta(weeks=int(interval[:-len('week')]))
+        if interval.endswith('month'):
+            return pd.Timedelta(days=31 * int(interval[:-len('month')]))
+        return pd.Timedelta(interval)
+
+    async def fetch_kline_data(self, symbol: str, interval: str, bars: Optional[int] = None) -> pd.DataFrame:
+        """
+        直近のローソク足を取得する。
+
+        :param bars: 取得する本数（indicator_lookback.plan_lookback で求めた本数など）。
+                     Noneの場合は前日と当日の足をすべて返す。
+        """
         #FIXME
         # JSTタイムゾーンを設定
         jst = timezone(timedelta(hours=9))
@@ -21,56 +156,21 @@ class GmoDataFetcher:
         # 現在の日時を取得
         current_time = datetime.now(jst)
         logger.info(f"現在の日時: {current_time}")
-        # 過去2日分の日付を取得
-        date_list = [(current_time - timedelta(days=i)).strftime('%Y%m%d') for i in range(2)]
-        date_list.reverse()  # 日付を古い順に並べ替え
-
-        url = f"{self.RestAPI_url}/v1/klines"
-        all_data = []
+        if bars is None:
+            # 過去2日分のデータを取得
+            start = current_time - timedelta(days=1)
+        else:
+            # 日付は日本時間6:00に切り替わるため、その分だけ前の日付から取得する
+            start = current_time - self._interval_timedelta(interval) * bars - timedelta(hours=self.DAY_START_HOUR)
+        df = await self.fetch_kline_range(symbol, interval, start, current_time)
 
-        async with aiohttp.ClientSession() as session:
-            for date_str in date_list:
-                params = {
-                    'symbol': symbol,
-                    'interval': interval,
-                    'date': date_str
-                }
-                async with session.get(url, params=params, proxy=self.proxy) as response:
-                    response.raise_for_status()
-                    ohlcv_data = await response.json()
-                    if 'data' in ohlcv_data:
-                        all_data.extend(ohlcv_data['data'])
-                    else:
-                        logger.warning(f"データが存在しません: {date_str}")
-
-        if not all_data:
+        if df.empty:
             logger.error("取得したデータが空です。")
-            return pd.DataFrame()  # 空のデータフレームを返す
-
-        df = pd.DataFrame(
-            all_data,
-            columns=['openTime', 'open', 'high', 'low', 'close', 'volume']
-        )
-        df.columns = ['openTime', 'Open', 'High', 'Low', 'Close', 'Volume']
-        df[['Open', 'High', 'Low', 'Close', 'Volume']] = df[['Open', 'High', 'Low', 'Close', 'Volume']].apply(pd.to_numeric)
-        df['openTime'] = df['openTime'].astype(int)
-        df['DateTime'] = df['openTime'].apply(self._convert_unix_time_to_datetime)
-
-        # 'openTime' 列を削除
-        df.drop('openTime', axis=1, inplace=True)
-
-        # 必要に応じてJSTに変換
-        df['DateTime'] = df['DateTime'].dt.tz_convert(jst)
-
-        # 日付でソート（重要）
-        df.sort_values('DateTime', inplace=True)
-
-        # 列の順序を変更（オプション）
-        cols = ['DateTime', 'Open', 'High', 'Low', 'Close', 'Volume']
-        df = df[cols]
-
-        # 'DateTime' 列をインデックスに設定
-        df.set_index('DateTime', inplace=True)
+            return df
+        if bars is not None:
+            if len(df) < bars:
+                logger.warning(f"{bars}本を要求しましたが、{len(df)}本しか取得できませんでした。")
+            df = df.iloc[-bars:]
 
         # 連続性を確認
         expected_interval = pd.Timedelta('15min')
@@ -86,15 +186,50 @@ class GmoDataFetcher:
 
         return df
 
-    
-    @staticmethod
-    def _convert_unix_time_to_datetime(unix_time):
+    async def fetch_kline_range(self, symbol: str, interval: str, start: datetime, end: Optional[datetime] = None,
+                                max_concurrency: Optional[int] = None,
+                                requests_per_second: Optional[float] = None) -> pd.DataFrame:
+        """
+        指定した期間のローソク足をまとめて取得する。
+        日付ごとのリクエストを同時実行数とレート制限の範囲で並列に発行し、時刻順に並べた1つのDataFrameを返す。
+        取得は日付単位で行うため、開始日と終了日の足はすべて含まれる。
+
+        :param start: 取得開始日時（naiveな場合はJSTとみなす）
+        :param end: 取得終了日時（デフォルトは現在時刻）
+        :param max_concurrency: 同時リクエスト数の上限（デフォルトはインスタンスの設定）
+        :param requests_per_second: 1秒あたりのリクエスト数の上限（デフォルトはインスタンスの設定）
+        """
+        jst = timezone(timedelta(hours=9))
+        current_time = datetime.now(jst)
+        end = end or current_time
+        start = start if start.tzinfo else start.replace(tzinfo=jst)
+        end = end if end.tzinfo else end.replace(tzinfo=jst)
+        date_list = self._date_keys(interval, start.astimezone(jst), end.astimezone(jst))
+
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+        limiter = RateLimiter(requests_per_second or self.requests_per_second)
+
+        async def fetch(session: aiohttp.ClientSession, date_str: str) -> pd.DataFrame:
+            async with semaphore:
+                return await self._fetch_day_cached(session, symbol, interval, date_str, current_time, limiter)
+
+        async with aiohttp.ClientSession() as session:
+            frames = await asyncio.gather(*(fetch(session, date_str) for date_str in date_list))
+
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame()
+
+        df = pd.concat(frames)
+        df = df[~df.index.duplicated(keep='last')].sort_index()
+        logger.info(f"{symbol} {interval}: {len(date_list)}件のリクエストで{len(df)}本のローソク足を取得しました。")
+        return df
+
+    def _to_dataframe(self, all_data: List[Dict[str, Any]]) -> pd.DataFrame:
         """
-        UNIXエポックタイムをUTCの日時に変換する。
+        APIのレスポンスをDateTime(JST)をインデックスとするDataFrameに変換する。
         """
-        if isinstance(unix_time, str):
-            unix_time = int(unix_time)
-        return datetime.fromtimestamp(unix_time / 1000, tz=timezone.utc)
+        return decode_gmo_klines(all_data, tz=timezone(timedelta(hours=9)))
 
 import asyncio
 from rich import print
@@ -0,0 +1,75 @@
+import os
+import logging
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class GmoKlineCache:
+    """
+    GMOコインのローソク足を (symbol, interval, date) 単位でディスクに保存するキャッシュ。
+    確定済みの日付は {date}.pkl、未確定の日付は {date}.partial.pkl として保存する。
+    """
+    def __init__(self, cache_dir: str = 'strage/kline_cache'):
+        self.cache_dir = cache_dir
+        # 確定済みデータはプロセス内でも保持し、毎サイクルの読み込みを省く
+        self._memory: Dict[Tuple[str, str, str], pd.DataFrame] = {}
+
+    def _path(self, symbol: str, interval: str, date_str: str, partial: bool = False) -> str:
+        suffix = '.partial.pkl' if partial else '.pkl'
+        return os.path.join(self.cache_dir, symbol, interval, f'{date_str}{suffix}')
+
+    def _read(self, path: str) -> Optional[pd.DataFrame]:
+        if not os.path.exists(path):
+            return None
+        try:
+            return pd.read_pickle(path)
+        except Exception as e:
+            # 壊れたキャッシュは再取得させる
+            logger.warning(f"キャッシュの読み込みに失敗しました: {path} {e}")
+            return None
+
+    def _write(self, path: str, df: pd.DataFrame) -> None:
+        # 書き込み途中のファイルが残らないよう一時ファイル経由で置き換える
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+
+    def load(self, symbol: str, interval: str, date_str: str) -> Optional[pd.DataFrame]:
+        """
+        確定済みの日付のデータを読み込む。存在しない場合はNoneを返す。
+        """
+        key = (symbol, interval, date_str)
+        if key in self._memory:
+            return self._memory[key]
+        df = self._read(self._path(symbol, interval, date_str))
+        if df is not None:
+            self._memory[key] = df
+        return df
+
+    def save(self, symbol: str, interval: str, date_str: str, df: pd.DataFrame) -> None:
+        """
+        確定済みの日付のデータを保存し、未確定データを削除する。
+        """
+        self._write(self._path(symbol, interval, date_str), df)
+        self._memory[(symbol, interval, date_str)] = df
+
+        partial_path = self._path(symbol, interval, date_str, partial=True)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+    def merge(self, symbol: str, interval: str, date_str: str, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        未確定の日付について、新しく取得した足をキャッシュ済みのデータにマージして保存する。
+        同じ時刻の足は新しいデータで上書きする。
+        """
+        path = self._path(symbol, interval, date_str, partial=True)
+        cached = self._read(path)
+        if cached is not None and not cached.empty:
+            df = pd.concat([cached, df])
+            df = df[~df.index.duplicated(keep='last')].sort_index()
+        self._write(path, df)
+        return df
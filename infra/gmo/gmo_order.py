@@ -1,5 +1,5 @@
 import logging
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 import requests
 import json
 import hmac
@@ -8,12 +8,14 @@ import time
 from datetime import datetime
 
 from infra.gmo.gmo_auth import GmoAuth
+from infra.gmo.gmo_cache import TtlCache
 
 logger = logging.getLogger(__name__)
 
 class GmoCoin(GmoAuth):
-    def __init__(self, proxies: Optional[Dict[str, str]] = None):
-        super().__init__()
+    def __init__(self, proxies: Optional[Dict[str, str]] = None, cache_ttl: Optional[Dict[str, float]] = None,
+                 cache: Optional[TtlCache] = None):
+        super().__init__(cache_ttl=cache_ttl, cache=cache)
         self.proxies = proxies  # プロキシ設定を保存
 
     def limit_order(self, symbol: str, side: str, amount: float, price: float) -> Dict[str, Any]:
@@ -59,6 +61,48 @@ class GmoCoin(GmoAuth):
                 timeout=10  # 必要に応じてタイムアウトを設定
             )
             response.raise_for_status()  # HTTPエラーが発生した場合例外を投げる
-            logger.info(f"Limit order response: {response.json()}")
+            result = response.json()
+            logger.info(f"Limit order response: {result}")
+            # FASの注文はすぐに約定することがあるため、残高を取得し直す
+            self.cache.invalidate('balance')
+            return result
         except requests.RequestException as e:
             logger.error(f"Limit order failed: {e}")
+            return {'status': -1, 'messages': [{'message_string': str(e)}]}
+
+    def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        body = json.dumps(payload)
+        headers = self._create_headers('POST', path, body)
+        response = requests.post("https://api.coin.z.com/private" + path, headers=headers, data=body,
+                                 proxies=self.proxies, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    def change_order(self, order_id: int, price: float) -> Dict[str, Any]:
+        """
+        有効な注文の価格を変更する（changeOrder）。取り消して出し直すより要求が少なく、数量はそのまま。
+        """
+        try:
+            result = self._post('/v1/changeOrder', {"orderId": int(order_id), "price": str(int(price))})
+        except requests.RequestException as e:
+            logger.error(f"Change order failed: {e}")
+            return {'status': -1, 'messages': [{'message_string': str(e)}]}
+        if result.get('status') != 0:
+            logger.error(f"Change order failed: {result.get('messages')}")
+        else:
+            # 変更した価格ですぐに約定することがあるため、残高を取得し直す
+            self.cache.invalidate('balance')
+        return result
+
+    def cancel_orders(self, order_ids: List[int]) -> Dict[str, Any]:
+        """
+        指定した注文をまとめて取り消す（cancelOrders、1回に10件まで）。
+        """
+        try:
+            result = self._post('/v1/cancelOrders', {"orderIds": [int(order_id) for order_id in order_ids]})
+        except requests.RequestException as e:
+            logger.error(f"Cancel orders failed: {e}")
+            return {'status': -1, 'messages': [{'message_string': str(e)}]}
+        if result.get('status') != 0:
+            logger.error(f"Cancel orders failed: {result.get('messages')}")
+        return result
@@ -6,13 +6,20 @@ import logging
 from pybotters import Client
 from pybotters.helpers import GMOCoinHelper
 from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
 from dotenv import load_dotenv
 
 # ロギングの設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-async def websocket_order_events():
+async def websocket_order_events(on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                                 on_connect: Optional[Callable[[], None]] = None):
+    """
+    Private WebSocketの注文・約定のイベントを受信する。
+    on_event を指定した場合は受信したイベントを渡す（GmoAuth.on_order_event で残高のキャッシュを消すなど）。
+    on_connect を指定した場合は接続・再接続するたびに呼ぶ（切断中のイベントは届かないため、注文を取得し直すなど）。
+    """
     load_dotenv(".environment/.env")  # 環境変数のロード
 
     apis = {
@@ -32,15 +39,26 @@ async def websocket_order_events():
             # POST /private/v1/ws-auth のエイリアス
             token = await gmohelper.create_access_token()
 
+            def forward(msg, ws):
+                if on_event is not None and isinstance(msg, dict) and 'channel' in msg:
+                    on_event(msg)
+
             ws = client.ws_connect(
                 # Private WebSocket URLを構築
                 f"wss://api.coin.z.com/ws/private/v1/{token}",
-                send_json={
-                    "command": "subscribe",
-                    "channel": "orderEvents",
-                    "option": "PERIODIC",
-                },
-                hdlr_json=store.onmessage,
+                send_json=[
+                    {
+                        "command": "subscribe",
+                        "channel": "orderEvents",
+                        "option": "PERIODIC",
+                    },
+                    {
+                        "command": "subscribe",
+                        "channel": "executionEvents",
+                        "option": "PERIODIC",
+                    },
+                ],
+                hdlr_json=[store.onmessage, forward],
             )
 
             # WebSocket URLとアクセストークンを管理するタスクを作成
@@ -48,6 +66,20 @@ async def websocket_order_events():
                 gmohelper.manage_ws_token(ws, token),
             )
 
+            async def watch_connection():
+                # pybotters は自動で再接続するため、接続が替わったことを current_ws で検知する
+                connected = None
+                while True:
+                    await ws
+                    if ws.current_ws is not connected:
+                        connected = ws.current_ws
+                        logger.info("Private WebSocketに接続しました。")
+                        on_connect()
+                    await asyncio.sleep(1.0)
+
+            if on_connect is not None:
+                asyncio.create_task(watch_connection())
+
             logger.info("=== WebSocket接続を開始しました。 ===")
             logger.info("ポジションサマリーイベントを待機中...")
 
@@ -0,0 +1,239 @@
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientBalance(Exception):
+    """
+    注文に必要な残高が足りない。
+    """
+
+
+class SimulatedOrder:
+    """
+    板に置かれた指値注文。約定のたびに executed_size を増やす。
+    """
+    __slots__ = ('order_id', 'side', 'price', 'size', 'executed_size', 'status', 'timestamp', 'placed_seq')
+
+    def __init__(self, order_id: int, side: str, price: float, size: float, timestamp: int, placed_seq: int):
+        self.order_id = order_id
+        self.side = side                # 'BUY' または 'SELL'
+        self.price = price
+        self.size = size
+        self.executed_size = 0.0
+        self.status = 'ORDERED'         # ORDERED / MODIFYING / EXECUTED / CANCELED
+        self.timestamp = timestamp      # 注文した時刻（UNIXミリ秒）
+        self.placed_seq = placed_seq    # 注文したときの足・約定の番号（同じ足では約定させない）
+
+    @property
+    def remaining(self) -> float:
+        return self.size - self.executed_size
+
+
+class MatchingEngine:
+    """
+    1銘柄の現物取引所をプロセス内で再現する約定エンジン。
+    足（on_bar）または約定（on_trade）を時刻順に流すと、置かれている指値注文を約定させ、
+    残高と注文・約定のイベントを更新する。
+
+    - 注文は出した後に流れてきた足・約定とだけ照合する（注文を出した足の値動きでは約定しない）。
+    - 板に置かれた指値は、価格が指値に届いた時点で指値の価格で約定する（メイカー）。
+      注文した時点で最終価格より有利な指値は、最終価格ですぐに約定する（テイカー、FASの即時約定分）。
+    - participation を指定すると、1本の足（1件の約定）で約定できる数量を出来高 × participation までにし、
+      残りは板に残す（FASの部分約定）。
+    """
+    def __init__(self, base: str = 'BTC', quote: str = 'JPY', balances: Optional[Dict[str, float]] = None,
+                 maker_fee: float = 0.0, taker_fee: float = 0.0005, min_order_size: float = 0.0001,
+                 size_step: float = 0.0001, participation: Optional[float] = None):
+        """
+        :param balances: 初期残高（通貨 -> 数量）
+        :param maker_fee: 板に置いた注文が約定したときの手数料率（マイナスは受け取り）
+        :param taker_fee: 注文してすぐに約定したときの手数料率
+        :param participation: 1本の足で約定できる数量の出来高に対する割合（Noneの場合は制限しない）
+        """
+        self.base = base
+        self.quote = quote
+        self.balances: Dict[str, float] = {base: 0.0, quote: 0.0}
+        self.balances.update(balances or {})
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.min_order_size = min_order_size
+        self.size_step = size_step
+        self.participation = participation
+
+        self.orders: Dict[int, SimulatedOrder] = {}       # 約定または取消されていない注文
+        self.history: List[SimulatedOrder] = []           # すべての注文
+        self.executions: List[Dict[str, Any]] = []
+        self.events: List[Dict[str, Any]] = []            # まだ読み出していないイベント
+        self._subscribers: List[Callable[[Dict[str, Any]], None]] = []
+        self.rejected_count = 0                           # 拒否した注文の数
+        self._next_id = 1
+        self._seq = 0
+        self.timestamp = 0
+        self.last_price: Optional[float] = None
+        self.last_bar: Optional[List[float]] = None       # [時刻, Open, High, Low, Close, Volume]
+
+    # 残高
+
+    def locked(self, currency: str) -> float:
+        """
+        有効な注文で拘束されている数量。
+        """
+        if currency == self.quote:
+            return sum(order.price * order.remaining for order in self.orders.values() if order.side == 'BUY')
+        if currency == self.base:
+            return sum(order.remaining for order in self.orders.values() if order.side == 'SELL')
+        return 0.0
+
+    def available(self, currency: str) -> float:
+        return self.balances.get(currency, 0.0) - self.locked(currency)
+
+    def equity(self, price: Optional[float] = None) -> float:
+        """
+        基軸通貨を price（省略時は最終価格）で評価した資産。
+        """
+        price = self.last_price if price is None else price
+        return self.balances[self.quote] + self.balances[self.base] * (price or 0.0)
+
+    # イベント
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None]) -> None:
+        """
+        注文・約定のイベントを受け取る関数を登録する（Private WebSocketの代わり）。
+        """
+        self._subscribers.append(callback)
+
+    def drain_events(self) -> List[Dict[str, Any]]:
+        """
+        まだ読み出していないイベントを返して消す。
+        """
+        events, self.events = self.events, []
+        return events
+
+    def _emit(self, event: Dict[str, Any]) -> None:
+        self.events.append(event)
+        for callback in self._subscribers:
+            callback(event)
+
+    def _order_event(self, order: SimulatedOrder, msg_type: str) -> None:
+        # GMOコインの orderEvents の形式
+        self._emit({
+            'channel': 'orderEvents', 'orderId': order.order_id, 'symbol': self.base, 'side': order.side,
+            'executionType': 'LIMIT', 'timeInForce': 'FAS', 'size': order.size, 'orderPrice': order.price,
+            'orderStatus': order.status, 'msgType': msg_type, 'orderTimestamp': order.timestamp,
+        })
+
+    # 注文
+
+    def place_limit_order(self, side: str, size: float, price: float) -> SimulatedOrder:
+        """
+        指値注文を出す。最終価格より有利な指値はその場で約定する。
+        """
+        side = side.upper()
+        try:
+            if side not in ('BUY', 'SELL'):
+                raise ValueError(f"side には BUY または SELL を指定してください: {side}")
+            if size < self.min_order_size - 1e-12 or price <= 0:
+                raise ValueError(f"注文の数量または価格が不正です: size={size} price={price}")
+            if side == 'BUY' and price * size > self.available(self.quote) + 1e-9:
+                raise InsufficientBalance(f"{self.quote}の残高が不足しています: 必要 {price * size} 利用可能 {self.available(self.quote)}")
+            if side == 'SELL' and size > self.available(self.base) + 1e-12:
+                raise InsufficientBalance(f"{self.base}の残高が不足しています: 必要 {size} 利用可能 {self.available(self.base)}")
+        except (ValueError, InsufficientBalance):
+            self.rejected_count += 1
+            raise
+
+        order = SimulatedOrder(self._next_id, side, price, size, self.timestamp, self._seq)
+        self._next_id += 1
+        self.orders[order.order_id] = order
+        self.history.append(order)
+        self._order_event(order, 'NOR')
+
+        if self.last_price is not None and (price >= self.last_price if side == 'BUY' else price <= self.last_price):
+            self._execute(order, order.remaining, self.last_price, self.taker_fee)
+        return order
+
+    def cancel_order(self, order_id: int) -> bool:
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return False
+        order.status = 'CANCELED'
+        self._order_event(order, 'CAN')
+        return True
+
+    def cancel_all(self) -> int:
+        """
+        有効な注文をすべて取り消し、取り消した数を返す（cancelBulkOrder）。
+        """
+        ids = list(self.orders)
+        for order_id in ids:
+            self.cancel_order(order_id)
+        return len(ids)
+
+    def change_order(self, order_id: int, price: float) -> SimulatedOrder:
+        """
+        有効な注文の価格を変更する（changeOrder）。新しい価格で板に置き直し、その足では約定させない。
+        """
+        order = self.orders.get(order_id)
+        if order is None:
+            raise KeyError(f"有効な注文がありません: {order_id}")
+        if order.side == 'BUY' and (price - order.price) * order.remaining > self.available(self.quote) + 1e-9:
+            raise InsufficientBalance(f"{self.quote}の残高が不足しています")
+        order.price = price
+        order.placed_seq = self._seq
+        self._order_event(order, 'COR')
+        if self.last_price is not None and (price >= self.last_price if order.side == 'BUY' else price <= self.last_price):
+            self._execute(order, order.remaining, self.last_price, self.taker_fee)
+        return order
+
+    # 約定
+
+    def _execute(self, order: SimulatedOrder, size: float, price: float, fee_rate: float) -> None:
+        notional = price * size
+        fee = notional * fee_rate
+        if order.side == 'BUY':
+            self.balances[self.quote] -= notional + fee
+            self.balances[self.base] += size
+        else:
+            self.balances[self.base] -= size
+            self.balances[self.quote] += notional - fee
+        order.executed_size += size
+        if order.remaining <= 1e-12:
+            order.status = 'EXECUTED'
+            self.orders.pop(order.order_id, None)
+        execution = {
+            'channel': 'executionEvents', 'orderId': order.order_id, 'symbol': self.base, 'side': order.side,
+            'executionPrice': price, 'executionSize': size, 'fee': fee, 'orderExecutedSize': order.executed_size,
+            'orderStatus': order.status, 'msgType': 'ER', 'executionTimestamp': self.timestamp,
+        }
+        self.executions.append(execution)
+        self._emit(execution)
+
+    def on_bar(self, timestamp: int, open_: float, high: float, low: float, close: float, volume: float) -> None:
+        """
+        確定した足を1本流し、価格が届いた指値注文を約定させる。
+        """
+        self._seq += 1
+        self.timestamp = timestamp
+        if self.orders:
+            available = None if self.participation is None else volume * self.participation
+            # 価格の良い注文から約定させる
+            for order in sorted(self.orders.values(), key=lambda o: -o.price if o.side == 'BUY' else o.price):
+                if order.placed_seq >= self._seq:
+                    continue
+                if (low <= order.price) if order.side == 'BUY' else (high >= order.price):
+                    size = order.remaining if available is None else min(order.remaining, available)
+                    if size <= 0:
+                        break
+                    self._execute(order, size, order.price, self.maker_fee)
+                    if available is not None:
+                        available -= size
+        self.last_price = close
+        self.last_bar = [timestamp, open_, high, low, close, volume]
+
+    def on_trade(self, timestamp: int, price: float, size: float) -> None:
+        """
+        約定（ティック）を1件流す。
+        """
+        self.on_bar(timestamp, price, price, price, price, size)
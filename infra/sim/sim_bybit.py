@@ -0,0 +1,210 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+import ccxt
+
+from infra.bybit.auth import BybitAuth
+from infra.sim.matching_engine import InsufficientBalance, MatchingEngine, SimulatedOrder
+
+logger = logging.getLogger(__name__)
+
+_STATUS = {'ORDERED': 'open', 'MODIFYING': 'open', 'EXECUTED': 'closed', 'CANCELED': 'canceled'}
+
+
+class SimulatedCcxtExchange:
+    """
+    BybitAuth.exchange（ccxt.bybit）のうち、BybitTrader と BybitOrder が使うメソッドを
+    MatchingEngine に対して実行するクラス。戻り値はccxtの共通形式にし、エラーもccxtの例外で返す。
+    """
+    id = 'bybit'
+    has = {'createOrders': True, 'editOrders': True, 'cancelOrders': True, 'cancelAllOrders': True}
+
+    def __init__(self, engine: MatchingEngine, symbol: str = 'BTC/USDT'):
+        self.engine = engine
+        self.symbol = symbol
+
+    def _check_symbol(self, symbol: Optional[str]) -> None:
+        if symbol is not None and symbol != self.symbol:
+            raise ccxt.BadSymbol(f"シミュレーションしていない銘柄です: {symbol}")
+
+    def _order(self, order: SimulatedOrder) -> Dict[str, Any]:
+        return {
+            'id': str(order.order_id), 'symbol': self.symbol, 'type': 'limit', 'side': order.side.lower(),
+            'price': order.price, 'amount': order.size, 'filled': order.executed_size,
+            'remaining': order.remaining, 'status': _STATUS[order.status], 'timestamp': order.timestamp,
+        }
+
+    def load_markets(self, reload: bool = False) -> Dict[str, Any]:
+        return {self.symbol: self.fetch_markets()[0]}
+
+    def fetch_markets(self) -> List[Dict[str, Any]]:
+        return [{
+            'id': self.symbol.replace('/', ''), 'symbol': self.symbol, 'base': self.engine.base,
+            'quote': self.engine.quote, 'spot': True,
+            'limits': {'amount': {'min': self.engine.min_order_size}},
+            'precision': {'amount': self.engine.size_step},
+        }]
+
+    def fetch_balance(self) -> Dict[str, Any]:
+        currencies = list(self.engine.balances)
+        free = {currency: self.engine.available(currency) for currency in currencies}
+        used = {currency: self.engine.locked(currency) for currency in currencies}
+        total = dict(self.engine.balances)
+        balance: Dict[str, Any] = {'free': free, 'used': used, 'total': total}
+        for currency in currencies:
+            balance[currency] = {'free': free[currency], 'used': used[currency], 'total': total[currency]}
+        return balance
+
+    def fetch_ticker(self, symbol: str) -> Dict[str, Any]:
+        self._check_symbol(symbol)
+        timestamp, open_, high, low, close, volume = self.engine.last_bar or [self.engine.timestamp] + [None] * 5
+        return {'symbol': self.symbol, 'timestamp': timestamp, 'open': open_, 'high': high, 'low': low,
+                'close': close, 'baseVolume': volume, 'bid': close, 'ask': close}
+
+    def create_order(self, symbol: str, type: str, side: str, amount: float, price: Optional[float] = None,
+                     params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        self._check_symbol(symbol)
+        if type != 'limit' or price is None:
+            raise ccxt.NotSupported("シミュレーションでは指値注文のみ出せます。")
+        try:
+            order = self.engine.place_limit_order(side, float(amount), float(price))
+        except InsufficientBalance as e:
+            raise ccxt.InsufficientFunds(str(e))
+        except ValueError as e:
+            raise ccxt.InvalidOrder(str(e))
+        return self._order(order)
+
+    def create_limit_buy_order(self, symbol: str, amount: float, price: float, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return self.create_order(symbol, 'limit', 'buy', amount, price, params)
+
+    def create_limit_sell_order(self, symbol: str, amount: float, price: float, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return self.create_order(symbol, 'limit', 'sell', amount, price, params)
+
+    def create_orders(self, orders: List[Dict[str, Any]], params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        一括注文。Bybitと同じく、失敗した注文はエラーコードとメッセージを info に入れて返す。
+        """
+        results = []
+        for order in orders:
+            try:
+                results.append(self.create_order(order['symbol'], order['type'], order['side'], order['amount'],
+                                                 order.get('price'), order.get('params')))
+            except ccxt.BaseError as e:
+                results.append({'id': None, 'status': 'rejected', 'info': {'code': 170131, 'msg': str(e)}})
+        return results
+
+    def edit_order(self, id: str, symbol: str, type: str, side: str, amount: Optional[float] = None,
+                   price: Optional[float] = None, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        self._check_symbol(symbol)
+        order = self.engine.orders.get(int(id))
+        if order is None:
+            raise ccxt.OrderNotFound(f"有効な注文がありません: {id}")
+        if amount is not None and abs(float(amount) - order.size) > 1e-12:
+            raise ccxt.NotSupported("シミュレーションでは価格のみ変更できます。")
+        try:
+            self.engine.change_order(order.order_id, float(price))
+        except InsufficientBalance as e:
+            raise ccxt.InsufficientFunds(str(e))
+        return self._order(order)
+
+    def edit_orders(self, orders: List[Dict[str, Any]], params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        results = []
+        for order in orders:
+            try:
+                results.append(self.edit_order(order['id'], order['symbol'], order['type'], order['side'],
+                                               order.get('amount'), order.get('price')))
+            except ccxt.BaseError as e:
+                results.append({'id': order['id'], 'info': {'code': 170213, 'msg': str(e)}})
+        return results
+
+    def cancel_order(self, id: str, symbol: Optional[str] = None, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        self._check_symbol(symbol)
+        order = self.engine.orders.get(int(id))
+        if order is None or not self.engine.cancel_order(order.order_id):
+            raise ccxt.OrderNotFound(f"有効な注文がありません: {id}")
+        return self._order(order)
+
+    def cancel_orders(self, ids: List[str], symbol: Optional[str] = None, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        results = []
+        for order_id in ids:
+            try:
+                results.append(self.cancel_order(order_id, symbol))
+            except ccxt.BaseError as e:
+                results.append({'id': order_id, 'info': {'code': 170213, 'msg': str(e)}})
+        return results
+
+    def cancel_all_orders(self, symbol: Optional[str] = None, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        self._check_symbol(symbol)
+        orders = list(self.engine.orders.values())
+        self.engine.cancel_all()
+        return [self._order(order) for order in orders]
+
+    def fetch_open_orders(self, symbol: Optional[str] = None, since: Optional[int] = None, limit: Optional[int] = None,
+                          params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        self._check_symbol(symbol)
+        return [self._order(order) for order in self.engine.orders.values()]
+
+    def fetch_order(self, id: str, symbol: Optional[str] = None, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        self._check_symbol(symbol)
+        for order in self.engine.history:
+            if order.order_id == int(id):
+                return self._order(order)
+        raise ccxt.OrderNotFound(f"注文がありません: {id}")
+
+
+class SimulatedAsyncCcxtExchange:
+    """
+    SimulatedCcxtExchange の非同期版（ccxt.async_support の代わり）。
+    各リクエストは latency 秒待ってから MatchingEngine に対して実行する（往復の時間の再現）。
+    """
+    def __init__(self, engine: MatchingEngine, symbol: str = 'BTC/USDT', latency: float = 0.0):
+        self._exchange = SimulatedCcxtExchange(engine, symbol)
+        self.id = self._exchange.id
+        self.has = self._exchange.has
+        self.latency = latency
+        self.request_count = 0
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self._exchange, name)
+
+        async def request(*args, **kwargs) -> Any:
+            self.request_count += 1
+            await asyncio.sleep(self.latency)
+            return method(*args, **kwargs)
+        return request
+
+    async def close(self) -> None:
+        pass
+
+
+class SimulatedBybitAuth(BybitAuth):
+    """
+    BybitAuth の代わりに SimulatedCcxtExchange を exchange に持つクラス。
+    engine はクラス属性で渡す（Strategy の __init__ は引数なしで super().__init__() を呼ぶため）。
+    """
+    engine: Optional[MatchingEngine] = None
+
+    def __init__(self, symbol: str = 'BTC/USDT', timeframe: str = '15m'):
+        if self.engine is None:
+            raise ValueError("SimulatedBybitAuth.engine が設定されていません。")
+        self.api_key = None
+        self.api_secret = None
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.exchange = SimulatedCcxtExchange(self.engine, symbol)
+
+
+def attach_exchange(obj: Any, exchange: SimulatedCcxtExchange, _seen: Optional[set] = None) -> None:
+    """
+    obj とその属性にある BybitAuth（Strategy が内部で作る BybitTrader や BybitOrder）の exchange を差し替える。
+    """
+    _seen = set() if _seen is None else _seen
+    if id(obj) in _seen:
+        return
+    _seen.add(id(obj))
+    if isinstance(obj, BybitAuth):
+        obj.exchange = exchange
+    for value in getattr(obj, '__dict__', {}).values():
+        if isinstance(value, BybitAuth):
+            attach_exchange(value, exchange, _seen)
@@ -0,0 +1,88 @@
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from infra.gmo.gmo_cache import TtlCache
+from infra.gmo.gmo_order import GmoCoin
+from infra.sim.matching_engine import InsufficientBalance, MatchingEngine
+
+logger = logging.getLogger(__name__)
+
+
+class SimulatedGmoCoin(GmoCoin):
+    """
+    GmoAuth と GmoCoin と同じメソッドを MatchingEngine に対して実行するクラス。
+    APIキーやネットワークを使わず、戻り値はGMOコインのAPIと同じ形（数値は文字列）にする。
+
+    engine はクラス属性で渡す（Strategy の __init__ は引数なしで super().__init__() を呼ぶため）。
+    """
+    engine: Optional[MatchingEngine] = None
+
+    def __init__(self, symbol_str: str = 'BTC', proxies: Optional[Dict[str, str]] = None):
+        if self.engine is None:
+            raise ValueError("SimulatedGmoCoin.engine が設定されていません。")
+        self.api_key = None
+        self.secret_key = None
+        self.symbol_str = symbol_str
+        self.proxies = proxies
+        self.cache = TtlCache()
+        # Private WebSocketと同じく、注文・約定のイベントを on_order_event で受け取る
+        self.engine.subscribe(self.on_order_event)
+
+    def fetch_balance(self) -> Dict[str, Any]:
+        return {'JPY': str(self.engine.balances[self.engine.quote]), 'BTC': str(self.engine.balances[self.engine.base])}
+
+    def fetch_symbols(self) -> Dict[str, Any]:
+        return {
+            'symbol': self.symbol_str,
+            'minOrderSize': self.engine.min_order_size,
+            'sizeStep': self.engine.size_step,
+            'tickSize': 1.0,
+        }
+
+    def fetch_ticker(self) -> Dict[str, Any]:
+        price = self.engine.last_price
+        return {'bid': str(price), 'ask': str(price)}
+
+    def cancel_order(self) -> Dict[str, Any]:
+        canceled = list(self.engine.orders)
+        self.engine.cancel_all()
+        return {'status': 0, 'data': {'success': canceled, 'failed': []}}
+
+    def check_order(self) -> Optional[Dict[str, Any]]:
+        for order in self.engine.orders.values():
+            return {'orderid': order.order_id, 'symbol': self.symbol_str, 'side': order.side,
+                    'price': str(order.price), 'size': str(order.size)}
+        return None
+
+    def fetch_active_orders(self) -> List[Dict[str, Any]]:
+        return [{'orderId': order.order_id, 'side': order.side, 'price': order.price, 'size': order.remaining}
+                for order in self.engine.orders.values()]
+
+    def change_order(self, order_id: int, price: float) -> Dict[str, Any]:
+        try:
+            self.engine.change_order(int(order_id), int(price))
+        except (KeyError, InsufficientBalance) as e:
+            logger.error(f"Change order failed: {e}")
+            return {'status': 1, 'messages': [{'message_code': 'ERR-5122', 'message_string': str(e)}]}
+        return {'status': 0}
+
+    def cancel_orders(self, order_ids: List[int]) -> Dict[str, Any]:
+        success = [order_id for order_id in order_ids if self.engine.cancel_order(int(order_id))]
+        failed = [order_id for order_id in order_ids if order_id not in success]
+        return {'status': 0, 'data': {'success': success, 'failed': failed}}
+
+    def limit_order(self, symbol: str, side: str, amount: float, price: float) -> Dict[str, Any]:
+        try:
+            # APIと同じく価格は整数、数量は文字列で送った値になる
+            order = self.engine.place_limit_order(side, float(str(amount)), int(price))
+        except (ValueError, InsufficientBalance) as e:
+            logger.error(f"Limit order failed: {e}")
+            return {'status': 1, 'messages': [{'message_code': 'ERR-201', 'message_string': str(e)}]}
+        return {'status': 0, 'data': str(order.order_id)}
+
+    async def order_events(self) -> AsyncIterator[Dict[str, Any]]:
+        """
+        まだ読み出していない注文・約定のイベントを返す（Private WebSocketの orderEvents と executionEvents）。
+        """
+        for event in self.engine.drain_events():
+            yield event
@@ -1,24 +1,33 @@
-from modules.logging_config import logging_config
-from typing import Tuple 
+import logging
+from typing import NamedTuple, Union
 
-class LimitPrice(Tuple):
-    bby_price: int
-    sell_price: int
+import numpy as np
 
-def calculate_limit_price_dist(self, current_price: float, atr_value: float, atr_ratio: float) -> LimitPrice:
+logger = logging.getLogger(__name__)
+
+class LimitPrice(NamedTuple):
+    buy_price: Union[int, np.ndarray]
+    sell_price: Union[int, np.ndarray]
+
+def calculate_limit_price_dist(current_price: float, atr_value: float, atr_ratio: float) -> LimitPrice:
         """
         指値距離と指値価格を計算する。
         """
         limit_price_dist = atr_value * atr_ratio
         buy_price = int(current_price - limit_price_dist)
         sell_price = int(current_price + limit_price_dist)
-        
-        self.logger.debug(f'指値距離: {limit_price_dist}, 指値価格: {buy_price}')
-        
-        return LimitPrice(buy_price=buy_price, sell_price=sell_price)
 
+        logger.debug(f'指値距離: {limit_price_dist}, 指値価格: {buy_price}')
+
+        return LimitPrice(buy_price=buy_price, sell_price=sell_price)
 
-        
-        
-        
-        
\ No newline at end of file
+def calculate_limit_prices(current_price: np.ndarray, atr_value: np.ndarray, atr_ratio: float) -> LimitPrice:
+        """
+        calculate_limit_price_dist と同じ指値価格を配列でまとめて計算する（バックテスト用）。
+        int() と同じく0方向に切り捨てる。
+        """
+        limit_price_dist = np.asarray(atr_value, dtype=np.float64) * atr_ratio
+        current_price = np.asarray(current_price, dtype=np.float64)
+        buy_price = np.trunc(current_price - limit_price_dist)
+        sell_price = np.trunc(current_price + limit_price_dist)
+        return LimitPrice(buy_price=buy_price, sell_price=sell_price)
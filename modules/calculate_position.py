@@ -1,31 +1,44 @@
-import logging_config
+import logging
+from typing import Optional
 
-logger = logging_config.getLogger(__name__)
+import numpy as np
 
-def calculate_position_size(self, balance_jpy: float, current_price: float,equity_fraction: float, min_order_size: float,size_step :float = None) -> float:
+logger = logging.getLogger(__name__)
+
+def calculate_position_size(balance_jpy: float, current_price: float,equity_fraction: float, min_order_size: float,size_step :Optional[float] = None) -> float:
         """
         ポジションサイズを計算する。
         """
-        
+
         try:
             # すべての関連変数をfloatに変換
             balance_jpy = float(balance_jpy)
             current_price = float(current_price)
             equity_fraction = float(equity_fraction)
             min_order_size = float(min_order_size)
-            size_step = float(self.size_step)
-            
+            size_step = float(size_step) if size_step is not None else min_order_size
+
             # ポジションサイズの計算
-            size = (balance_jpy * self.equity_fraction) / current_price
-            adjusted_size = max(self.min_order_size, size - (size % self.size_step))
+            size = (balance_jpy * equity_fraction) / current_price
+            adjusted_size = max(min_order_size, size - (size % size_step))
             #FIXME;roundの６を変更する
             adjusted_size = round(adjusted_size, 6)
-            
-            self.logger.debug(f'計算されたサイズ: {size}, 調整後サイズ: {adjusted_size}')
+
+            logger.debug(f'計算されたサイズ: {size}, 調整後サイズ: {adjusted_size}')
             return adjusted_size
         except ValueError as ve:
-            self.logger.error(f'数値への変換に失敗しました: {ve}')
+            logger.error(f'数値への変換に失敗しました: {ve}')
             return 0.0
         except Exception as e:
-            self.logger.error(f'ポジションサイズの計算に失敗しました: {e}')
-            return 0.0
\ No newline at end of file
+            logger.error(f'ポジションサイズの計算に失敗しました: {e}')
+            return 0.0
+
+def calculate_position_sizes(balance_jpy: np.ndarray, current_price: np.ndarray, equity_fraction: float,
+                             min_order_size: float, size_step: Optional[float] = None) -> np.ndarray:
+        """
+        calculate_position_size と同じポジションサイズを配列でまとめて計算する（バックテスト用）。
+        """
+        size_step = size_step if size_step is not None else min_order_size
+        size = np.asarray(balance_jpy, dtype=np.float64) * equity_fraction / np.asarray(current_price, dtype=np.float64)
+        adjusted_size = np.maximum(min_order_size, size - np.mod(size, size_step))
+        return np.round(adjusted_size, 6)
@@ -0,0 +1,153 @@
+# modules/kline_decoder.py
+from datetime import timedelta, timezone
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+JST = timezone(timedelta(hours=9))
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+GMO_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+TzLike = Optional[Union[str, timezone]]
+
+
+def build_ohlcv_frame(timestamps: np.ndarray, values: np.ndarray, tz: TzLike = 'UTC', index_name: str = 'DateTime') -> pd.DataFrame:
+    """
+    UNIXミリ秒の配列と (n, 5) のOHLCV配列からDataFrameを1回で組み立てる。
+    時刻順に並んでいない場合のみ並べ替え、同じ時刻の足は後のものを残す。
+
+    :param timestamps: UNIXエポック（ミリ秒）のint64配列
+    :param values: Open, High, Low, Close, Volume の順のfloat64配列
+    :param tz: インデックスのタイムゾーン。NoneのときはUTCのnaiveな時刻にする。
+    :param index_name: インデックス名
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64).reshape(-1, len(OHLCV_COLUMNS))
+
+    if len(timestamps) > 1 and not (np.diff(timestamps) > 0).all():
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, values = timestamps[order], values[order]
+        # 重複した時刻は最後の足を残す
+        keep = np.append(timestamps[1:] != timestamps[:-1], True)
+        timestamps, values = timestamps[keep], values[keep]
+
+    index = pd.DatetimeIndex(timestamps.astype('datetime64[ms]'), name=index_name)
+    if tz is not None:
+        index = index.tz_localize('UTC').tz_convert(tz)
+    return pd.DataFrame(values, index=index, columns=OHLCV_COLUMNS, copy=False)
+
+
+def decode_gmo_klines(rows: List[Dict[str, Any]], tz: TzLike = JST) -> pd.DataFrame:
+    """
+    GMOコインの /v1/klines のdata（文字列の辞書のリスト）をDataFrameに変換する。
+    """
+    n = len(rows)
+    if n == 0:
+        return pd.DataFrame()
+    timestamps = np.fromiter(map(int, map(itemgetter('openTime'), rows)), dtype=np.int64, count=n)
+    values = np.empty((n, len(GMO_FIELDS)), dtype=np.float64)
+    for i, field in enumerate(GMO_FIELDS):
+        values[:, i] = np.fromiter(map(float, map(itemgetter(field), rows)), dtype=np.float64, count=n)
+    return build_ohlcv_frame(timestamps, values, tz=tz, index_name='DateTime')
+
+
+def decode_ccxt_ohlcv(ohlcv: Sequence[Sequence[float]], tz: TzLike = 'UTC') -> pd.DataFrame:
+    """
+    ccxtの fetch_ohlcv の戻り値（[timestamp, open, high, low, close, volume] のリスト）をDataFrameに変換する。
+    """
+    if len(ohlcv) == 0:
+        return pd.DataFrame(columns=OHLCV_COLUMNS)
+    array = np.asarray(ohlcv, dtype=np.float64)
+    return build_ohlcv_frame(array[:, 0].astype(np.int64), array[:, 1:6], tz=tz, index_name='timestamp')
+
+
+def _legacy_decode_gmo(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    # 変更前の GmoDataFetcher.fetch_kline_data と同じ手順
+    from datetime import datetime
+    df = pd.DataFrame(rows, columns=['openTime', 'open', 'high', 'low', 'close', 'volume'])
+    df.columns = ['openTime', 'Open', 'High', 'Low', 'Close', 'Volume']
+    df[OHLCV_COLUMNS] = df[OHLCV_COLUMNS].apply(pd.to_numeric)
+    df['openTime'] = df['openTime'].astype(int)
+    df['DateTime'] = df['openTime'].apply(lambda t: datetime.fromtimestamp(t / 1000, tz=timezone.utc))
+    df.drop('openTime', axis=1, inplace=True)
+    df['DateTime'] = df['DateTime'].dt.tz_convert(JST)
+    df.sort_values('DateTime', inplace=True)
+    df = df[['DateTime'] + OHLCV_COLUMNS]
+    df.set_index('DateTime', inplace=True)
+    return df
+
+
+def _legacy_decode_ccxt(ohlcv: Sequence[Sequence[float]]) -> pd.DataFrame:
+    # 変更前の BybitFetcher._ohlcv_to_dataframe と同じ手順
+    df = pd.DataFrame(ohlcv, columns=['timestamp'] + OHLCV_COLUMNS)
+    df.set_index('timestamp', inplace=True)
+    df.index = pd.to_datetime(df.index, unit='ms')
+    return df
+
+
+def _assert_same_frame(result: pd.DataFrame, expected: pd.DataFrame) -> None:
+    # 変更前は文字列の価格を pd.to_numeric で整数の列にすることがあるため、値はfloat64に、
+    # 時刻はナノ秒の単位になるためミリ秒にそろえて比較する
+    expected = expected.astype(np.float64)
+    expected.index = expected.index.as_unit('ms')
+    pd.testing.assert_frame_equal(result, expected, check_exact=True, check_freq=False)
+
+
+def assert_matches_legacy(gmo_rows: List[Dict[str, Any]], ccxt_rows: Sequence[Sequence[float]]) -> None:
+    """
+    decode_gmo_klines と decode_ccxt_ohlcv の結果が変更前の変換（時刻の並べ替えと重複の除去を除く）と
+    インデックス（タイムゾーンと名前を含む）も値も一致することを、時刻順・逆順・重複を含む入力で確認する。
+    一致しない場合は AssertionError を送出する。
+    """
+    def dedupe(rows, key):
+        # 同じ時刻の足は後のものを残す（decoder の仕様）
+        return list({key(row): row for row in rows}.values())
+
+    for rows in (gmo_rows, gmo_rows[::-1], gmo_rows + gmo_rows[:10]):
+        expected = _legacy_decode_gmo(dedupe(rows, itemgetter('openTime')))
+        _assert_same_frame(decode_gmo_klines(rows), expected)
+        _assert_same_frame(decode_gmo_klines(rows, tz='UTC'), expected.tz_convert('UTC'))
+    # 重複した時刻は後の足の値になる
+    changed = [dict(gmo_rows[0], close=str(float(gmo_rows[0]['close']) + 1))]
+    assert decode_gmo_klines(gmo_rows + changed)['Close'].iloc[0] == float(changed[0]['close'])
+
+    for rows in (ccxt_rows, ccxt_rows[::-1], list(ccxt_rows) + list(ccxt_rows[:10])):
+        expected = _legacy_decode_ccxt(dedupe(rows, itemgetter(0))).sort_index()
+        _assert_same_frame(decode_ccxt_ohlcv(rows, tz=None), expected)
+        _assert_same_frame(decode_ccxt_ohlcv(rows), expected.tz_localize('UTC'))
+
+    assert decode_gmo_klines([]).empty
+    assert decode_ccxt_ohlcv([]).empty and list(decode_ccxt_ohlcv([]).columns) == OHLCV_COLUMNS
+
+
+# 1回あたりの変換コストの計測
+if __name__ == "__main__":
+    import time
+
+    def measure(func, data, repeat=3):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(data)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    rng = np.random.default_rng(0)
+    start_ms = 1672531200000
+    for n in (10_000, 100_000, 1_000_000):
+        close = 4_000_000 + rng.normal(0, 1000, n).cumsum()
+        gmo_rows = [
+            {'openTime': str(start_ms + i * 60_000), 'open': f'{c:.0f}', 'high': f'{c + 500:.0f}',
+             'low': f'{c - 500:.0f}', 'close': f'{c:.0f}', 'volume': '0.0123'}
+            for i, c in enumerate(close)
+        ]
+        ccxt_rows = [[start_ms + i * 60_000, c, c + 500, c - 500, c, 0.0123] for i, c in enumerate(close)]
+
+        assert_matches_legacy(gmo_rows[:10_000], ccxt_rows[:10_000])
+        repeat = 1 if n >= 1_000_000 else 3
+        print(f"n={n:>9,}  GMO    legacy {measure(_legacy_decode_gmo, gmo_rows, repeat):8.3f}s  "
+              f"decoder {measure(decode_gmo_klines, gmo_rows, repeat):8.3f}s")
+        print(f"n={n:>9,}  ccxt   legacy {measure(_legacy_decode_ccxt, ccxt_rows, repeat):8.3f}s  "
+              f"decoder {measure(lambda rows: decode_ccxt_ohlcv(rows, tz=None), ccxt_rows, repeat):8.3f}s")
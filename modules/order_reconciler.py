@@ -0,0 +1,77 @@
+import logging
+from typing import List, NamedTuple, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class DesiredOrder(NamedTuple):
+    """
+    戦略が出したい指値注文。
+    """
+    side: str           # 'BUY' または 'SELL'
+    size: float
+    price: float
+
+
+class LiveOrder(NamedTuple):
+    """
+    取引所に置かれている指値注文。size は約定していない残りの数量。
+    """
+    order_id: int
+    side: str
+    size: float
+    price: float
+
+
+class ReconcilePlan(NamedTuple):
+    """
+    置かれている注文を出したい注文に合わせるための操作。
+    cancel の後に change と place を行う（取消で拘束が外れた残高を新しい注文に使うため）。
+    """
+    keep: List[LiveOrder]                           # そのままにする注文
+    change: List[Tuple[LiveOrder, DesiredOrder]]    # 価格だけを変更する注文と変更後の注文
+    cancel: List[LiveOrder]                         # 取り消す注文
+    place: List[DesiredOrder]                       # 新しく出す注文
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.change or self.cancel or self.place)
+
+
+def reconcile_orders(desired: Sequence[DesiredOrder], live: Sequence[LiveOrder],
+                     price_tolerance: float, size_tolerance: float, size_tolerance_ratio: float = 0.0) -> ReconcilePlan:
+    """
+    出したい注文と置かれている注文を売買の方向ごとに価格の近い順に対応づけ、
+    - 価格の差が price_tolerance 以内かつ数量の差が size_tolerance 以内ならそのままにする
+    - 数量の差だけが size_tolerance 以内なら価格を変更する（GMOコインの changeOrder は価格のみ変更できる）
+    - それ以外は取り消して出し直す
+    対応する注文がない置かれている注文は取り消し、対応する注文がない出したい注文は新しく出す。
+
+    :param price_tolerance: そのままにする価格の差（呼値の単位の何倍かなど）
+    :param size_tolerance: 同じとみなす数量の差（数量の刻み幅など）
+    :param size_tolerance_ratio: 出したい数量に対する割合でも数量の差を許容する（残高から数量を決める場合、
+                                 価格が動くたびに数量が変わって出し直しにならないようにする）
+    """
+    plan = ReconcilePlan([], [], [], [])
+    for side in sorted({order.side.upper() for order in desired} | {order.side.upper() for order in live}):
+        wanted = [order for order in desired if order.side.upper() == side]
+        resting = [order for order in live if order.side.upper() == side]
+        for target in wanted:
+            if not resting:
+                plan.place.append(target)
+                continue
+            nearest = min(resting, key=lambda order: abs(order.price - target.price))
+            resting.remove(nearest)
+            same_size = abs(nearest.size - target.size) <= max(size_tolerance, target.size * size_tolerance_ratio)
+            if same_size and abs(nearest.price - target.price) <= price_tolerance:
+                plan.keep.append(nearest)
+            elif same_size:
+                plan.change.append((nearest, target))
+            else:
+                plan.cancel.append(nearest)
+                plan.place.append(target)
+        plan.cancel.extend(resting)
+
+    logger.debug(f'注文の差分 - 維持: {len(plan.keep)}, 価格変更: {len(plan.change)}, '
+                 f'取消: {len(plan.cancel)}, 新規: {len(plan.place)}')
+    return plan
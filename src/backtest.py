@@ -0,0 +1,304 @@
+# backtest.py
+import os
+import sys
+import logging
+from typing import Any, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+# modules をインポートできるようにリポジトリのルートをパスに追加する
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.calculate_limit_price import calculate_limit_prices
+from modules.calculate_position import calculate_position_size
+
+logger = logging.getLogger(__name__)
+
+# 戦略が参照する特徴量の列（Strategy.REQUIRED_COLUMNS と同じ）
+REQUIRED_COLUMNS = ['Close', 'ATR', 'RSI']
+# シミュレーションに使う列（backtest_arrays の引数の順）
+BACKTEST_COLUMNS = ['Open', 'High', 'Low', 'Close', 'ATR']
+
+
+class BacktestConfig(NamedTuple):
+    """
+    long_atr_strategy のパラメータと、シミュレーションの条件。
+    """
+    long_threshold: float = 0.01
+    atr_ratio: float = 0.3
+    equity_fraction: float = 0.7
+    min_order_size: float = 0.0001
+    size_step: float = 0.0001
+    fee_rate: float = 0.0005             # 板に置いた指値が約定したときの手数料率（取引所と銘柄に合わせて設定する）
+    taker_fee_rate: float = 0.0005       # 注文した時点で約定したとき（テイカー）の手数料率
+    close_position: bool = True          # 毎回、保有しているBTCをすべて売る指値を出す
+    size_at_limit_price: bool = False    # 注文の数量を終値ではなく買いの指値価格で計算する
+    initial_balance: float = 1_000_000.0
+
+
+# strategies/strategy_gmo_v001.py と strategies/strategy_bybit_v001.py の設定。
+# Bybitの戦略は self.position を設定しないため決済の売りを出さず、数量は BybitOrder が買いの指値価格で計算する
+GMO_CONFIG = BacktestConfig()
+BYBIT_CONFIG = BacktestConfig(atr_ratio=0.95, min_order_size=0.000048, size_step=0.000048, close_position=False,
+                              size_at_limit_price=True, initial_balance=10_000.0)
+
+
+class BacktestResult(NamedTuple):
+    """
+    バックテストの結果。trades は1行が1回の約定（side, price, size, fee と、売りの約定の平均取得価格に対する損益 pnl）。
+    equity は各足の終値で評価した資産（現金 + 保有量 × 終値）。
+    """
+    trades: pd.DataFrame
+    equity: pd.Series
+    total_return: float
+    max_drawdown: float
+    win_rate: float         # 損益が正だった売りの約定の割合
+    order_count: int        # 出した注文の数（拒否された注文を含まない）
+    rejected_count: int     # 残高不足などで拒否された注文の数
+
+
+def run_backtest(frame: pd.DataFrame, predictions: Optional[np.ndarray] = None,
+                 config: BacktestConfig = GMO_CONFIG) -> BacktestResult:
+    """
+    long_atr_strategy（reconcile=False、毎回すべて取り消して出し直す）を過去の足で再現する。
+
+    各足の確定時に前の足の注文をすべて取り消し、保有しているBTC（size_step 単位に切り捨て）が
+    min_order_size 以上なら 終値 + ATR × atr_ratio にすべて売る指値を出し、予測値が閾値を超えていれば
+    保有量によらず 終値 - ATR × atr_ratio に JPY残高 × equity_fraction 分の買いの指値を出す（買い増す）。
+    約定は infra/sim/matching_engine.py の MatchingEngine（participation=None）と同じく、
+    次の足の安値（高値）が指値に届いた場合に指値の価格で約定し、終値より有利な指値は注文した時点で終値で約定する。
+    残高を超える買いと保有量を超える売りは拒否する。
+
+    指値価格と約定の判定は配列の演算でまとめて求め、残高に依存する数量と約定だけを1足ずつ処理する。
+    assert_matches_event_backtest で run_event_backtest の結果と一致することを確認できる。
+
+    :param frame: Open, High, Low, Close, ATR の列を持つ特徴量のDataFrame
+    :param predictions: 各足の予測値。Noneの場合は frame の 'prediction' 列
+    """
+    if predictions is None:
+        predictions = frame['prediction'].to_numpy()
+    return backtest_arrays(*(frame[name].to_numpy(dtype=np.float64) for name in BACKTEST_COLUMNS),
+                           predictions, config=config, index=frame.index)
+
+
+def backtest_arrays(open_: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray, atr: np.ndarray,
+                    predictions: np.ndarray, config: BacktestConfig = GMO_CONFIG,
+                    index: Optional[pd.Index] = None) -> BacktestResult:
+    """
+    run_backtest の本体。各列の配列（共有メモリ上の配列など）をコピーせずに受け取る。
+
+    :param index: 足の時刻。Noneの場合は足の番号を使う。
+    """
+    predictions = np.asarray(predictions, dtype=np.float64)
+    n = len(close)
+    if len(predictions) != n:
+        raise ValueError(f"予測値の数 {len(predictions)} が足の数 {n} と一致しません。")
+
+    limit_price = calculate_limit_prices(close, atr, config.atr_ratio)
+    buy_prices = limit_price.buy_price.tolist()
+    sell_prices = limit_price.sell_price.tolist()
+    signal = (predictions > config.long_threshold).tolist()
+    # 足 t に出した注文が足 t+1 で約定するか
+    buy_reached = np.zeros(n, dtype=bool)
+    sell_reached = np.zeros(n, dtype=bool)
+    buy_reached[:-1] = low[1:] <= limit_price.buy_price[:-1]
+    sell_reached[:-1] = high[1:] >= limit_price.sell_price[:-1]
+    buy_reached = buy_reached.tolist()
+    sell_reached = sell_reached.tolist()
+    closes = np.asarray(close, dtype=np.float64).tolist()
+    maker_fee, taker_fee = config.fee_rate, config.taker_fee_rate
+    min_size, size_step = config.min_order_size, config.size_step
+
+    jpy, btc = float(config.initial_balance), 0.0
+    cost = 0.0              # 保有しているBTCの取得価格の合計（手数料を含む）
+    fills = []              # (足の位置, side, 価格, 数量, 手数料, 損益)
+    equity = np.empty(n)
+    order_count = rejected_count = 0
+
+    def execute(t: int, side: str, price: float, size: float, fee_rate: float) -> None:
+        nonlocal jpy, btc, cost
+        notional = price * size
+        fee = notional * fee_rate
+        if side == 'buy':
+            jpy -= notional + fee
+            cost += notional + fee
+            btc += size
+            fills.append((t, side, price, size, fee, np.nan))
+        else:
+            sold_cost = cost * size / btc if btc > 0 else 0.0
+            jpy += notional - fee
+            cost -= sold_cost
+            btc -= size
+            if btc <= 1e-12:
+                cost = 0.0
+            fills.append((t, side, price, size, fee, notional - fee - sold_cost))
+
+    buy_order = sell_order = -1     # 前の足で出し、板に残っている注文の足の位置
+    buy_size = sell_size = 0.0
+    for t in range(n):
+        # 前の足の注文の約定（MatchingEngine.on_bar と同じく価格の良い買いから）
+        if buy_order >= 0 and buy_reached[buy_order]:
+            execute(t, 'buy', buy_prices[buy_order], buy_size, maker_fee)
+        if sell_order >= 0 and sell_reached[sell_order]:
+            execute(t, 'sell', sell_prices[sell_order], sell_size, maker_fee)
+        # 残った注文はすべて取り消し、今回の注文は取消の前の残高で決める
+        buy_order = sell_order = -1
+        price = closes[t]
+        balance_jpy = jpy
+        if config.close_position:
+            size = btc - (btc % size_step)
+            size = round(size, 4)
+            if size >= min_size:
+                if sell_prices[t] <= 0 or size > btc + 1e-12:
+                    rejected_count += 1
+                else:
+                    order_count += 1
+                    if sell_prices[t] <= price:
+                        execute(t, 'sell', price, size, taker_fee)
+                    else:
+                        sell_order, sell_size = t, size
+        if signal[t]:
+            sizing_price = buy_prices[t] if config.size_at_limit_price else price
+            size = calculate_position_size(balance_jpy, sizing_price, config.equity_fraction, min_size, size_step)
+            if size < min_size - 1e-12 or buy_prices[t] <= 0 or buy_prices[t] * size > jpy + 1e-9:
+                rejected_count += 1
+            else:
+                order_count += 1
+                if buy_prices[t] >= price:
+                    execute(t, 'buy', price, size, taker_fee)
+                else:
+                    buy_order, buy_size = t, size
+        equity[t] = jpy + btc * price
+
+    index = pd.RangeIndex(n) if index is None else index
+    trades = pd.DataFrame(fills, columns=['bar', 'side', 'price', 'size', 'fee', 'pnl'])
+    trades.insert(0, 'time', index[trades.pop('bar').to_numpy(dtype=np.int64)])
+    pnl = trades.loc[trades['side'] == 'sell', 'pnl'].to_numpy()
+    peak = np.maximum.accumulate(equity) if n else equity
+    drawdown = float(np.max((peak - equity) / peak)) if n else 0.0
+    return BacktestResult(
+        trades=trades,
+        equity=pd.Series(equity, index=index, name='equity'),
+        total_return=float(equity[-1] / config.initial_balance - 1) if n else 0.0,
+        max_drawdown=drawdown,
+        win_rate=float((pnl > 0).mean()) if len(pnl) else float('nan'),
+        order_count=order_count,
+        rejected_count=rejected_count,
+    )
+
+
+def load_backtest_frame(store: Any, symbol: str, timeframe: str, start, end, model: Any = None) -> pd.DataFrame:
+    """
+    OhlcvStore の過去の足から特徴量を計算し、まとめて予測した 'prediction' 列を加えて返す。
+
+    :param store: curator.ohlcv_store.OhlcvStore
+    :param model: 予測に使うモデル。Noneの場合は load_model() のモデル。
+    """
+    from batch_predict import predict_frame
+    from calc_technical_indicators import calc_technical_indicators
+    from data_procces_and_predict import Config, load_model, select_feature_columns
+
+    model = load_model() if model is None else model
+    ohlcv = store.read_range(symbol, timeframe, start, end)
+    columns = select_feature_columns(model, Config.FEATURE_IMPORTANCE_THRESHOLD, REQUIRED_COLUMNS)
+    features = calc_technical_indicators(ohlcv, columns=columns)
+    features['prediction'] = predict_frame(features, model=model)
+    return features
+
+
+def run_strategy_backtest(frame: pd.DataFrame, predictions: Optional[np.ndarray] = None,
+                          config: BacktestConfig = GMO_CONFIG) -> Any:
+    """
+    strategies/strategy_gmo_v001.py の Strategy（reconcile=False）を、config の残高・手数料・数量の単位の
+    MatchingEngine（participation=None）で動かし、run_event_backtest の結果（EventBacktestResult）を返す。
+    run_backtest より遅いが、Strategy のコードそのものを実行する。
+
+    Strategy は閾値と atr_ratio を固定で持つため、config はそれ以外のフィールドだけを変えられる。
+
+    :param frame: Open, High, Low, Close, Volume と Strategy.REQUIRED_COLUMNS の列を持つ特徴量のDataFrame
+    """
+    from event_backtest import run_event_backtest, simulated_strategy
+    from infra.sim.matching_engine import MatchingEngine
+    from strategies.strategy_gmo_v001 import Strategy
+
+    if (config.long_threshold, config.atr_ratio, config.close_position, config.size_at_limit_price) != \
+            (GMO_CONFIG.long_threshold, GMO_CONFIG.atr_ratio, True, False):
+        raise ValueError(f"Strategy と異なる設定は実行できません: {config}")
+    engine = MatchingEngine(base='BTC', quote='JPY', balances={'JPY': config.initial_balance},
+                            maker_fee=config.fee_rate, taker_fee=config.taker_fee_rate,
+                            min_order_size=config.min_order_size, size_step=config.size_step)
+    strategy = simulated_strategy(Strategy, engine, symbol='BTC', equity_fraction=config.equity_fraction,
+                                  reconcile=False)
+    return run_event_backtest(strategy, engine, frame, predictions)
+
+
+def assert_matches_event_backtest(frame: pd.DataFrame, predictions: Optional[np.ndarray] = None,
+                                  config: BacktestConfig = GMO_CONFIG, rtol: float = 1e-9) -> BacktestResult:
+    """
+    run_backtest と、strategies/strategy_gmo_v001.py の Strategy を MatchingEngine で動かした
+    run_event_backtest の結果（run_strategy_backtest）の各足の資産、約定と注文と拒否の数が一致することを確認し、
+    run_backtest の結果を返す。一致しない場合は AssertionError を送出する。
+    """
+    if predictions is None:
+        predictions = frame['prediction'].to_numpy()
+    result = run_backtest(frame, predictions, config)
+    expected = run_strategy_backtest(frame, predictions, config)
+
+    assert expected.error_count == 0, f"戦略が{expected.error_count}回エラーになりました"
+    assert len(result.trades) == len(expected.executions), \
+        f"約定の数が一致しません: {len(result.trades)} != {len(expected.executions)}"
+    assert (result.order_count, result.rejected_count) == (expected.order_count, expected.rejected_count), \
+        f"注文・拒否の数が一致しません: {(result.order_count, result.rejected_count)} != " \
+        f"{(expected.order_count, expected.rejected_count)}"
+    if len(result.trades):
+        executions = expected.executions
+        assert (result.trades['side'].str.upper().to_numpy() == executions['side'].to_numpy()).all(), \
+            "約定の売買の方向が一致しません"
+        for column, name in (('price', 'executionPrice'), ('size', 'executionSize'), ('fee', 'fee')):
+            np.testing.assert_allclose(result.trades[column].to_numpy(), executions[name].to_numpy(dtype=np.float64),
+                                       rtol=rtol, err_msg=f"約定の {column} が一致しません")
+    np.testing.assert_allclose(result.equity.to_numpy(), expected.equity.to_numpy(), rtol=rtol,
+                               err_msg="各足の資産が一致しません")
+    return result
+
+
+# 1年分の15分足での所要時間と、Strategy を MatchingEngine で動かす場合との一致の確認
+if __name__ == "__main__":
+    import time
+    from catboost import CatBoostRegressor
+
+    from batch_predict import predict_frame
+    from calc_technical_indicators import calc_technical_indicators
+    from indicator_lookback import reference_prices
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 365 * 96
+    df = pd.DataFrame({name.capitalize(): values for name, values in reference_prices(n).items()},
+                      index=pd.date_range('2023-01-01', periods=n, freq='15min', name='timestamp'))
+
+    start = time.perf_counter()
+    features = calc_technical_indicators(df)
+    indicator_time = time.perf_counter() - start
+
+    target = features['Close'].pct_change(4).shift(-4).fillna(0.0) * 100
+    model = CatBoostRegressor(iterations=300, depth=6, verbose=False, allow_writing_files=False)
+    model.fit(features.iloc[:n // 4], target.iloc[:n // 4])
+    start = time.perf_counter()
+    predictions = predict_frame(features, model=model).to_numpy()
+    predict_time = time.perf_counter() - start
+
+    for name, config in (('GMO', GMO_CONFIG), ('Bybit', BYBIT_CONFIG)):
+        run_backtest(features, predictions, config)
+        start = time.perf_counter()
+        result = run_backtest(features, predictions, config)
+        backtest_time = time.perf_counter() - start
+        sells = (result.trades['side'] == 'sell').sum()
+        print(f"{name}: {len(features)}足 約定{len(result.trades)}回（売り{sells}回） 拒否{result.rejected_count}回  "
+              f"リターン {result.total_return:+.2%}  最大ドローダウン {result.max_drawdown:.2%}  "
+              f"勝率 {result.win_rate:.1%}  {backtest_time * 1000:7.1f} ms")
+
+    start = time.perf_counter()
+    assert_matches_event_backtest(features, predictions, GMO_CONFIG)
+    assert_matches_event_backtest(features, predictions, GMO_CONFIG._replace(fee_rate=-0.0001, equity_fraction=1.0))
+    print(f"run_event_backtest との一致を確認しました ({time.perf_counter() - start:.1f}s)")
+    print(f"指標の計算 {indicator_time:.3f}s  予測 {predict_time:.3f}s")
@@ -0,0 +1,140 @@
+# batch_predict.py
+import os
+import logging
+from typing import Any, Iterable, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from data_procces_and_predict import Config, load_model, pruned_feature_columns
+from feature_cache import FeatureCache
+
+logger = logging.getLogger(__name__)
+
+# 1回のpredictに渡す行数（特徴量の配列は行数 × 特徴量数 × 4バイトになる）
+DEFAULT_CHUNK_SIZE = 100_000
+
+
+def _feature_array(frame: pd.DataFrame, feature_names, fill_columns: Iterable[str] = ()) -> np.ndarray:
+    """
+    モデルの特徴量の順に並べたfloat32の配列を作る。重要度で除いて計算しなかった特徴量（fill_columns）は
+    0で埋め、それ以外の特徴量がない場合は KeyError にする（predict_and_save と同じ）。
+    CatBoostは内部でfloat32に変換するため、先にfloat32にしても予測値は変わらない。
+    """
+    unexpected = [name for name in feature_names if name not in frame.columns and name not in fill_columns]
+    if unexpected:
+        raise KeyError(f"モデルの特徴量が計算されていません: {unexpected}")
+    X = np.zeros((len(frame), len(feature_names)), dtype=np.float32)
+    for j, name in enumerate(feature_names):
+        if name in frame.columns:
+            X[:, j] = frame[name].to_numpy()
+    return X
+
+
+def predict_frame(df: pd.DataFrame, model: Any = None, thread_count: int = -1,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE, output_path: Optional[str] = None) -> pd.Series:
+    """
+    特徴量のDataFrameのすべての行を予測し、足の時刻をインデックスとするSeriesで返す。
+
+    :param model: 予測に使うモデル。Noneの場合は load_model() のモデル。
+    :param thread_count: CatBoostの予測に使うスレッド数（-1はすべてのコア）
+    :param chunk_size: 1回の予測に渡す行数
+    :param output_path: 指定した場合は予測値をCSVファイルに追記する
+    """
+    model = load_model() if model is None else model
+    chunks = (df.iloc[start:start + chunk_size] for start in range(0, len(df), chunk_size))
+    predictions = list(predict_chunks(chunks, model=model, thread_count=thread_count, output_path=output_path))
+    if not predictions:
+        return pd.Series(np.empty(0), index=df.index, name='prediction')
+    return pd.concat(predictions)
+
+
+def predict_chunks(chunks: Iterable[pd.DataFrame], model: Any = None, thread_count: int = -1,
+                   output_path: Optional[str] = None) -> Iterator[pd.Series]:
+    """
+    特徴量のDataFrameを1つずつ受け取り、チャンクごとの予測値を返すジェネレータ。
+    ディスクから順に読み込んだチャンクを渡せば、全期間の特徴量をメモリに載せずに予測できる。
+
+    :param output_path: 指定した場合は予測値をCSVファイルに追記する
+    """
+    model = load_model() if model is None else model
+    feature_names = list(model.feature_names_)
+    pruned = set(pruned_feature_columns(model, Config.FEATURE_IMPORTANCE_THRESHOLD))
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        values = model.predict(_feature_array(chunk, feature_names, pruned), thread_count=thread_count)
+        predictions = pd.Series(values, index=chunk.index, name='prediction')
+        if output_path is not None:
+            save_predictions(predictions, output_path)
+        yield predictions
+
+
+def save_predictions(predictions: pd.Series, output_path: str) -> None:
+    """
+    予測値をCSVファイルに追記する。ファイルがない場合はヘッダーを書く。
+    """
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    header = not os.path.exists(output_path)
+    predictions.to_csv(output_path, mode='a', header=header)
+
+
+def iter_feature_chunks(cache: FeatureCache, symbol: str, timeframe: str, ohlcv: pd.DataFrame,
+                        columns: Optional[Iterable[str]] = None,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    特徴量のキャッシュを更新し、chunk_size 行ずつ読み出す。
+    キャッシュの列ファイルはmemmapで読むため、メモリに載るのは1チャンク分だけになる。
+
+    :param columns: 読み出す特徴量の列（モデルの feature_names_ など）。Noneの場合はすべての列。
+    """
+    cache.update(symbol, timeframe, ohlcv)
+    for start in range(0, len(ohlcv), chunk_size):
+        chunk = cache.read(symbol, timeframe, ohlcv.iloc[start:start + chunk_size], columns=columns)
+        if not chunk.empty:
+            yield chunk
+
+
+# 1行ずつ予測する場合との比較
+if __name__ == "__main__":
+    import sys
+    import time
+    import tempfile
+    from catboost import CatBoostRegressor
+
+    from calc_technical_indicators import build_feature_matrix
+    from indicator_lookback import reference_prices
+
+    # 15分足の5年分
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5 * 365 * 96
+    df = pd.DataFrame({name.capitalize(): values for name, values in reference_prices(n).items()},
+                      index=pd.date_range('2019-01-01', periods=n, freq='15min', name='timestamp'))
+    features = build_feature_matrix(df)
+    target = features['Close'].pct_change().shift(-1).fillna(0.0)
+    model = CatBoostRegressor(iterations=500, depth=6, verbose=False, allow_writing_files=False)
+    model.fit(features.iloc[:50_000], target.iloc[:50_000])
+
+    rows = 2000
+    start = time.perf_counter()
+    for i in range(rows):
+        model.predict(features.iloc[[i]].reindex(columns=model.feature_names_, fill_value=0.0))
+    per_row = (time.perf_counter() - start) / rows
+    print(f"1行ずつ      {per_row * 1000:8.3f} ms/行  （{len(features)}行で約{per_row * len(features):.0f}s）")
+
+    start = time.perf_counter()
+    batch = predict_frame(features, model=model)
+    print(f"まとめて予測 {time.perf_counter() - start:8.3f}s  （{len(features)}行）")
+
+    expected = model.predict(features.reindex(columns=model.feature_names_, fill_value=0.0))
+    print(f"DataFrameを渡した予測との最大差: {np.abs(batch.to_numpy() - expected).max():.3e}")
+
+    with tempfile.TemporaryDirectory() as root:
+        cache = FeatureCache(root_dir=root)
+        start = time.perf_counter()
+        streamed = pd.concat(predict_chunks(
+            iter_feature_chunks(cache, 'BTC/USDT', '15m', df, columns=model.feature_names_), model=model,
+            output_path=os.path.join(root, 'predictions.csv')))
+        print(f"キャッシュから読み込んで予測 {time.perf_counter() - start:8.3f}s  "
+              f"最大差 {np.abs(streamed.to_numpy() - batch.to_numpy()).max():.3e}")
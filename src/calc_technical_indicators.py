@@ -1,84 +1,253 @@
 # calc_technical_indicators.py
+import json
+import hashlib
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
 import talib
+import numpy as np
 import pandas as pd
 
 
-def calc_technical_indicators(df):
-        # テクニカル指標を追加
-        open, high, low, close, volume = df["Open"], df["High"], df["Low"], df["Close"], df["Volume"]
+class IndicatorSpec(NamedTuple):
+    """
+    1つのTA-Lib関数の呼び出しと、その出力列の定義。
+    """
+    function: str                # TA-Libの関数名
+    columns: Tuple[str, ...]     # 出力列（TA-Libの出力順）
+    inputs: Tuple[str, ...]      # 入力する価格（open, high, low, close, volume）
+    params: Dict[str, Any]
+    normalize: Optional[str]     # 標準化の方法（'hilo', 'close_diff', 'close'）。Noneはそのまま
+    cumulative: bool = False     # 計算開始からの累積値（開始位置によって水準が変わる）
+
+
+def _normalize(values: np.ndarray, method: str, hilo: np.ndarray, close: np.ndarray) -> np.ndarray:
+    """
+    価格(hilo または close)を引いた後、価格(close)で割る、または価格(close)で割るだけで標準化する。
+    TA-Libの出力配列をその場で書き換える。
+    """
+    if method == 'hilo':
+        np.subtract(values, hilo, out=values)
+    elif method == 'close_diff':
+        np.subtract(values, close, out=values)
+    np.divide(values, close, out=values)
+    return values
+
+
+INDICATORS: List[IndicatorSpec] = [
+    IndicatorSpec('BBANDS', ('BBANDS_upperband', 'BBANDS_middleband', 'BBANDS_lowerband'), ('close',), dict(timeperiod=5, nbdevup=2, nbdevdn=2, matype=0), 'hilo'),
+    IndicatorSpec('DEMA', ('DEMA',), ('close',), dict(timeperiod=30), 'hilo'),
+    IndicatorSpec('EMA', ('EMA',), ('close',), dict(timeperiod=30), 'hilo'),
+    IndicatorSpec('HT_TRENDLINE', ('HT_TRENDLINE',), ('close',), dict(), 'hilo'),
+    IndicatorSpec('KAMA', ('KAMA',), ('close',), dict(timeperiod=30), 'hilo'),
+    IndicatorSpec('MA', ('MA',), ('close',), dict(timeperiod=30, matype=0), 'hilo'),
+    IndicatorSpec('MIDPOINT', ('MIDPOINT',), ('close',), dict(timeperiod=14), 'hilo'),
+    IndicatorSpec('SMA', ('SMA',), ('close',), dict(timeperiod=30), 'hilo'),
+    IndicatorSpec('T3', ('T3',), ('close',), dict(timeperiod=5, vfactor=0), 'hilo'),
+    IndicatorSpec('TEMA', ('TEMA',), ('close',), dict(timeperiod=30), 'hilo'),
+    IndicatorSpec('TRIMA', ('TRIMA',), ('close',), dict(timeperiod=30), 'hilo'),
+    IndicatorSpec('WMA', ('WMA',), ('close',), dict(timeperiod=30), 'hilo'),
+    IndicatorSpec('LINEARREG', ('LINEARREG',), ('close',), dict(timeperiod=14), 'close_diff'),
+    IndicatorSpec('LINEARREG_INTERCEPT', ('LINEARREG_INTERCEPT',), ('close',), dict(timeperiod=14), 'close_diff'),
+
+    IndicatorSpec('AD', ('AD',), ('high', 'low', 'close', 'volume'), dict(), 'close', cumulative=True),
+    IndicatorSpec('ADOSC', ('ADOSC',), ('high', 'low', 'close', 'volume'), dict(fastperiod=3, slowperiod=10), 'close'),
+    IndicatorSpec('APO', ('APO',), ('close',), dict(fastperiod=12, slowperiod=26, matype=0), 'close'),
+    IndicatorSpec('HT_PHASOR', ('HT_PHASOR_inphase', 'HT_PHASOR_quadrature'), ('close',), dict(), 'close'),
+    IndicatorSpec('LINEARREG_SLOPE', ('LINEARREG_SLOPE',), ('close',), dict(timeperiod=14), 'close'),
+    IndicatorSpec('MACD', ('MACD_macd', 'MACD_macdsignal', 'MACD_macdhist'), ('close',), dict(fastperiod=12, slowperiod=26, signalperiod=9), 'close'),
+    IndicatorSpec('MINUS_DM', ('MINUS_DM',), ('high', 'low'), dict(timeperiod=14), 'close'),
+    IndicatorSpec('MOM', ('MOM',), ('close',), dict(timeperiod=10), 'close'),
+    IndicatorSpec('OBV', ('OBV',), ('close', 'volume'), dict(), 'close', cumulative=True),
+    IndicatorSpec('PLUS_DM', ('PLUS_DM',), ('high', 'low'), dict(timeperiod=14), 'close'),
+    IndicatorSpec('STDDEV', ('STDDEV',), ('close',), dict(timeperiod=5, nbdev=1), 'close'),
+    IndicatorSpec('TRANGE', ('TRANGE',), ('high', 'low', 'close'), dict(), 'close'),
+
+    IndicatorSpec('ADX', ('ADX',), ('high', 'low', 'close'), dict(timeperiod=14), None),
+    IndicatorSpec('ADXR', ('ADXR',), ('high', 'low', 'close'), dict(timeperiod=14), None),
+    IndicatorSpec('AROON', ('AROON_aroondown', 'AROON_aroonup'), ('high', 'low'), dict(timeperiod=14), None),
+    IndicatorSpec('AROONOSC', ('AROONOSC',), ('high', 'low'), dict(timeperiod=14), None),
+    IndicatorSpec('BOP', ('BOP',), ('open', 'high', 'low', 'close'), dict(), None),
+    IndicatorSpec('CCI', ('CCI',), ('high', 'low', 'close'), dict(timeperiod=14), None),
+    IndicatorSpec('DX', ('DX',), ('high', 'low', 'close'), dict(timeperiod=14), None),
+    # skip MACDEXT MACDFIX たぶん同じなので
+    IndicatorSpec('MFI', ('MFI',), ('high', 'low', 'close', 'volume'), dict(timeperiod=14), None),
+    IndicatorSpec('MINUS_DI', ('MINUS_DI',), ('high', 'low', 'close'), dict(timeperiod=14), None),
+    IndicatorSpec('PLUS_DI', ('PLUS_DI',), ('high', 'low', 'close'), dict(timeperiod=14), None),
+    IndicatorSpec('RSI', ('RSI',), ('close',), dict(timeperiod=14), None),
+    IndicatorSpec('STOCH', ('STOCH_slowk', 'STOCH_slowd'), ('high', 'low', 'close'), dict(fastk_period=5, slowk_period=3, slowk_matype=0, slowd_period=3, slowd_matype=0), None),
+    IndicatorSpec('STOCHF', ('STOCHF_fastk', 'STOCHF_fastd'), ('high', 'low', 'close'), dict(fastk_period=5, fastd_period=3, fastd_matype=0), None),
+    IndicatorSpec('STOCHRSI', ('STOCHRSI_fastk', 'STOCHRSI_fastd'), ('close',), dict(timeperiod=14, fastk_period=5, fastd_period=3, fastd_matype=0), None),
+    IndicatorSpec('TRIX', ('TRIX',), ('close',), dict(timeperiod=30), None),
+    IndicatorSpec('ULTOSC', ('ULTOSC',), ('high', 'low', 'close'), dict(timeperiod1=7, timeperiod2=14, timeperiod3=28), None),
+    IndicatorSpec('WILLR', ('WILLR',), ('high', 'low', 'close'), dict(timeperiod=14), None),
+
+    IndicatorSpec('ATR', ('ATR',), ('high', 'low', 'close'), dict(timeperiod=14), None),
+    IndicatorSpec('NATR', ('NATR',), ('high', 'low', 'close'), dict(timeperiod=14), None),
+
+    IndicatorSpec('HT_DCPERIOD', ('HT_DCPERIOD',), ('close',), dict(), None),
+    IndicatorSpec('HT_DCPHASE', ('HT_DCPHASE',), ('close',), dict(), None),
+    IndicatorSpec('HT_SINE', ('HT_SINE_sine', 'HT_SINE_leadsine'), ('close',), dict(), None),
+    IndicatorSpec('HT_TRENDMODE', ('HT_TRENDMODE',), ('close',), dict(), None),
+
+    IndicatorSpec('BETA', ('BETA',), ('high', 'low'), dict(timeperiod=5), None),
+    IndicatorSpec('CORREL', ('CORREL',), ('high', 'low'), dict(timeperiod=30), None),
+
+    IndicatorSpec('LINEARREG_ANGLE', ('LINEARREG_ANGLE',), ('close',), dict(timeperiod=14), None),
+]
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+FEATURE_COLUMNS = [column for spec in INDICATORS for column in spec.columns]
+# 計算を始めた位置によって水準が変わる列（取得した本数の窓で計算する推論時と値が合わない）
+CUMULATIVE_COLUMNS = [column for spec in INDICATORS if spec.cumulative for column in spec.columns]
+# 標準化など INDICATORS に現れない計算方法を変えた場合に上げる
+FEATURE_FORMAT_VERSION = 1
+
+
+def indicator_config_hash(specs: Optional[List[IndicatorSpec]] = None) -> str:
+    """
+    指標の定義とTA-Libのバージョンから、特徴量の計算方法を表すハッシュを返す。
+    """
+    payload = json.dumps({
+        'format': FEATURE_FORMAT_VERSION,
+        'talib': talib.__version__,
+        'indicators': [spec._asdict() for spec in (INDICATORS if specs is None else specs)],
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def compute_indicator(spec: IndicatorSpec, prices: Dict[str, np.ndarray], hilo: np.ndarray, close: np.ndarray) -> List[np.ndarray]:
+    """
+    1つの指標を計算し、標準化した出力を spec.columns の順に返す。
+
+    :param prices: 小文字の価格名（open, high, low, close, volume）からfloat64配列への辞書
+    """
+    outputs = getattr(talib, spec.function)(*(prices[name] for name in spec.inputs), **spec.params)
+    if len(spec.columns) == 1:
+        outputs = (outputs,)
+    if spec.normalize is None:
+        return list(outputs)
+    return [_normalize(values, spec.normalize, hilo, close) for values in outputs]
+
+
+def select_indicators(columns: Optional[Iterable[str]] = None) -> List[IndicatorSpec]:
+    """
+    指定した列を出力する指標だけを返す。Noneの場合はすべての指標。
+    """
+    if columns is None:
+        return list(INDICATORS)
+    wanted = set(columns)
+    unknown = wanted - set(FEATURE_COLUMNS) - set(PRICE_COLUMNS)
+    if unknown:
+        raise ValueError(f"計算できない特徴量が指定されました: {sorted(unknown)}")
+    return [spec for spec in INDICATORS if wanted.intersection(spec.columns)]
+
+
+def build_feature_matrix(df: pd.DataFrame, columns: Optional[Iterable[str]] = None, dtype=np.float64) -> pd.DataFrame:
+    """
+    OHLCVとテクニカル指標を1つの2次元配列に書き込み、最後に1回だけDataFrameにする。
+    列の追加のたびにDataFrameがコピーされることがなく、NaNを含む先頭の行も配列の切り出しで除く。
+
+    :param columns: 必要な特徴量の列。指定した場合は、その列を出力する指標だけを計算する。
+    :param dtype: 特徴量の型。np.float32 を指定するとメモリが半分になる（計算自体はfloat64で行う）。
+    """
+    wanted = None if columns is None else set(columns)
+    specs = select_indicators(wanted)
+    feature_columns = [column for spec in specs for column in spec.columns if wanted is None or column in wanted]
+    output_columns = PRICE_COLUMNS + feature_columns
+
+    n = len(df)
+    # 列ごとに連続した領域に書き込めるよう列優先で確保する（DataFrameの内部形式とも一致する）
+    matrix = np.empty((n, len(output_columns)), dtype=dtype, order='F')
+    prices = {}
+    for j, name in enumerate(PRICE_COLUMNS):
+        prices[name.lower()] = df[name].to_numpy(dtype=np.float64)
+        matrix[:, j] = prices[name.lower()]
+    close = prices['close']
+    hilo = (prices['high'] + prices['low']) / 2
+    valid = np.ones(n, dtype=bool)
+
+    j = len(PRICE_COLUMNS)
+    for spec in specs:
+        for column, values in zip(spec.columns, compute_indicator(spec, prices, hilo, close)):
+            if wanted is not None and column not in wanted:
+                continue
+            matrix[:, j] = values
+            valid &= ~np.isnan(values)
+            j += 1
+
+    # NaNはウォームアップ中の先頭の行にしか出ないため、通常はコピーせずに切り出せる
+    first = int(np.argmax(valid)) if valid.any() else n
+    if valid[first:].all():
+        matrix, index = matrix[first:], df.index[first:]
+    else:
+        matrix, index = matrix[valid], df.index[valid]
+    return pd.DataFrame(matrix, index=index, columns=output_columns, copy=False)
+
+
+def calc_technical_indicators(df, columns: Optional[Iterable[str]] = None, dtype=np.float64):
+    """
+    テクニカル指標の列を追加し、NaNを含む行を除いたDataFrameを返す。
+
+    :param columns: 必要な特徴量の列。指定した場合は、その列を出力する指標だけを計算し、その列だけを追加する。
+    :param dtype: 特徴量の型（build_feature_matrix を参照）
+    """
+    return build_feature_matrix(df, columns=columns, dtype=dtype)
+
+
+# 列ごとに追加する従来の方法との比較（時間とメモリのピーク）
+if __name__ == "__main__":
+    import sys
+    import time
+    import tracemalloc
+
+    def legacy_calc(df):
+        # 変更前と同じく、列を1つずつ追加してから標準化し、最後にdropnaする
+        prices = {name.lower(): df[name] for name in PRICE_COLUMNS}
+        close = prices['close']
         hilo = (df['High'] + df['Low']) / 2
-        # 価格(hilo または close)を引いた後、価格(close)で割ることで標準化
-        df['BBANDS_upperband'], df['BBANDS_middleband'], df['BBANDS_lowerband'] = talib.BBANDS(close, timeperiod=5, nbdevup=2, nbdevdn=2, matype=0)
-        df['BBANDS_upperband'] = (df['BBANDS_upperband'] - hilo) / close
-        df['BBANDS_middleband'] = (df['BBANDS_middleband'] - hilo) / close
-        df['BBANDS_lowerband'] = (df['BBANDS_lowerband'] - hilo) / close
-        df['DEMA'] = (talib.DEMA(close, timeperiod=30) - hilo) / close
-        df['EMA'] = (talib.EMA(close, timeperiod=30) - hilo) / close
-        df['HT_TRENDLINE'] = (talib.HT_TRENDLINE(close) - hilo) / close
-        df['KAMA'] = (talib.KAMA(close, timeperiod=30) - hilo) / close
-        df['MA'] = (talib.MA(close, timeperiod=30, matype=0) - hilo) / close
-        df['MIDPOINT'] = (talib.MIDPOINT(close, timeperiod=14) - hilo) / close
-        df['SMA'] = (talib.SMA(close, timeperiod=30) - hilo) / close
-        df['T3'] = (talib.T3(close, timeperiod=5, vfactor=0) - hilo) / close
-        df['TEMA'] = (talib.TEMA(close, timeperiod=30) - hilo) / close
-        df['TRIMA'] = (talib.TRIMA(close, timeperiod=30) - hilo) / close
-        df['WMA'] = (talib.WMA(close, timeperiod=30) - hilo) / close
-        df['LINEARREG'] = (talib.LINEARREG(close, timeperiod=14) - close) / close
-        df['LINEARREG_INTERCEPT'] = (talib.LINEARREG_INTERCEPT(close, timeperiod=14) - close) / close
-
-
-        # 価格(close)で割ることで標準化
-        df['AD'] = talib.AD(high, low, close, volume) / close
-        df['ADOSC'] = talib.ADOSC(high, low, close, volume, fastperiod=3, slowperiod=10) / close
-        df['APO'] = talib.APO(close, fastperiod=12, slowperiod=26, matype=0) / close
-        df['HT_PHASOR_inphase'], df['HT_PHASOR_quadrature'] = talib.HT_PHASOR(close)
-        df['HT_PHASOR_inphase'] /= close
-        df['HT_PHASOR_quadrature'] /= close
-        df['LINEARREG_SLOPE'] = talib.LINEARREG_SLOPE(close, timeperiod=14) / close
-        df['MACD_macd'], df['MACD_macdsignal'], df['MACD_macdhist'] = talib.MACD(close, fastperiod=12, slowperiod=26, signalperiod=9)
-        df['MACD_macd'] /= close
-        df['MACD_macdsignal'] /= close
-        df['MACD_macdhist'] /= close
-        df['MINUS_DM'] = talib.MINUS_DM(high, low, timeperiod=14) / close
-        df['MOM'] = talib.MOM(close, timeperiod=10) / close
-        df['OBV'] = talib.OBV(close, volume) / close
-        df['PLUS_DM'] = talib.PLUS_DM(high, low, timeperiod=14) / close
-        df['STDDEV'] = talib.STDDEV(close, timeperiod=5, nbdev=1) / close
-        df['TRANGE'] = talib.TRANGE(high, low, close) / close
-
-
-        df['ADX'] = talib.ADX(high, low, close, timeperiod=14)
-        df['ADXR'] = talib.ADXR(high, low, close, timeperiod=14)
-        df['AROON_aroondown'], df['AROON_aroonup'] = talib.AROON(high, low, timeperiod=14)
-        df['AROONOSC'] = talib.AROONOSC(high, low, timeperiod=14)
-        df['BOP'] = talib.BOP(open, high, low, close)
-        df['CCI'] = talib.CCI(high, low, close, timeperiod=14)
-        df['DX'] = talib.DX(high, low, close, timeperiod=14)
-        # skip MACDEXT MACDFIX たぶん同じなので
-        df['MFI'] = talib.MFI(high, low, close, volume, timeperiod=14)
-        df['MINUS_DI'] = talib.MINUS_DI(high, low, close, timeperiod=14)
-        df['PLUS_DI'] = talib.PLUS_DI(high, low, close, timeperiod=14)
-        df['RSI'] = talib.RSI(close, timeperiod=14)
-        df['STOCH_slowk'], df['STOCH_slowd'] = talib.STOCH(high, low, close, fastk_period=5, slowk_period=3, slowk_matype=0, slowd_period=3, slowd_matype=0)
-        df['STOCHF_fastk'], df['STOCHF_fastd'] = talib.STOCHF(high, low, close, fastk_period=5, fastd_period=3, fastd_matype=0)
-        df['STOCHRSI_fastk'], df['STOCHRSI_fastd'] = talib.STOCHRSI(close, timeperiod=14, fastk_period=5, fastd_period=3, fastd_matype=0)
-        df['TRIX'] = talib.TRIX(close, timeperiod=30)
-        df['ULTOSC'] = talib.ULTOSC(high, low, close, timeperiod1=7, timeperiod2=14, timeperiod3=28)
-        df['WILLR'] = talib.WILLR(high, low, close, timeperiod=14)
-
-        df['ATR'] = talib.ATR(high, low, close, timeperiod=14)
-        df['NATR'] = talib.NATR(high, low, close, timeperiod=14)
-
-        df['HT_DCPERIOD'] = talib.HT_DCPERIOD(close)
-        df['HT_DCPHASE'] = talib.HT_DCPHASE(close)
-        df['HT_SINE_sine'], df['HT_SINE_leadsine'] = talib.HT_SINE(close)
-        df['HT_TRENDMODE'] = talib.HT_TRENDMODE(close)
-
-        df['BETA'] = talib.BETA(high, low, timeperiod=5)
-        df['CORREL'] = talib.CORREL(high, low, timeperiod=30)
-
-        df['LINEARREG_ANGLE'] = talib.LINEARREG_ANGLE(close, timeperiod=14)
-        
+        for spec in INDICATORS:
+            outputs = getattr(talib, spec.function)(*(prices[name] for name in spec.inputs), **spec.params)
+            if len(spec.columns) == 1:
+                outputs = (outputs,)
+            for column, values in zip(spec.columns, outputs):
+                df[column] = values
+                if spec.normalize == 'hilo':
+                    df[column] = (df[column] - hilo) / close
+                elif spec.normalize == 'close_diff':
+                    df[column] = (df[column] - close) / close
+                elif spec.normalize == 'close':
+                    df[column] /= close
         df.dropna(inplace=True)
-        
-        return df
\ No newline at end of file
+        return df
+
+    def measure(func, df):
+        df = df.copy()
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func(df)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return elapsed, peak / 2**20, result
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [200, 100_000, 5_000_000]
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        close = 4_000_000 + rng.normal(0, 5000, n).cumsum()
+        spread = np.abs(rng.normal(0, 3000, (n, 2)))
+        df = pd.DataFrame({
+            'Open': close + rng.normal(0, 1000, n),
+            'High': close + spread[:, 0],
+            'Low': close - spread[:, 1],
+            'Close': close,
+            'Volume': np.abs(rng.normal(1, 0.5, n)),
+        }, index=pd.date_range('2020-01-01', periods=n, freq='1min'))
+
+        results = {}
+        for name, func in (('legacy', legacy_calc),
+                           ('float64', build_feature_matrix),
+                           ('float32', lambda frame: build_feature_matrix(frame, dtype=np.float32))):
+            elapsed, peak, results[name] = measure(func, df)
+            print(f"n={n:>9,}  {name:<8} {elapsed:8.3f}s  peak {peak:9.1f} MiB")
+        pd.testing.assert_frame_equal(results['legacy'], results['float64'], check_dtype=False)
+        del results
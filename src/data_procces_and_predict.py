@@ -1,9 +1,15 @@
 #data_procces_and_predict.py
 import os
 import logging
+from typing import Dict, Iterable, List, Optional
+
 import pandas as pd
 from catboost import CatBoostRegressor
 from calc_technical_indicators import calc_technical_indicators
+from model_registry import ModelRegistry
+from model_ensemble import EnsembleMember, ModelEnsemble
+from inference_server import InferenceClient
+from tree_evaluator import ObliviousTreeModel
 from infra.gmo.gmo_data_fetcher import GmoDataFetcher
 
 # ロギングの設定
@@ -14,28 +20,179 @@ logger = logging.getLogger(__name__)
 class Config:
     MODEL_DIR = os.path.join('models')
     OUTPUT_DIR = os.path.join('Storage', 'predictions')
+    MODEL_NAME = 'default'
+    MODEL_FILE = 'simple_catboost_model.cbm'
+    # モデルファイルの更新を確認する間隔（秒）
+    MODEL_CHECK_INTERVAL = 5.0
+    # 'numpy' の場合はCatBoostの対称木をNumPyで評価する（予測値は同じで、1行の予測が速い）
+    MODEL_EVALUATOR = 'catboost'
+    # 複数のモデルを同時に予測して重みつき平均する場合のモデルファイル名 -> 重み（空の場合は MODEL_FILE のみ）
+    ENSEMBLE_MODELS: Dict[str, float] = {}
+    # 推論サーバーのUnixソケット（Noneの場合はプロセス内でモデルを読み込んで予測する）
+    INFERENCE_SOCKET: Optional[str] = os.getenv('INFERENCE_SOCKET')
+    # 特徴量の重要度がこの値以下の指標は計算しない（Noneの場合はモデルの全特徴量を計算する）。
+    # 重要度が0の特徴量（分岐に使われていない）だけを除く場合は予測値は変わらない
+    FEATURE_IMPORTANCE_THRESHOLD: Optional[float] = None
+    # Trueの場合は、重要度が0より大きく閾値以下の特徴量も計算せずに0で埋める（予測値が変わる）。
+    # Falseの場合はそれらの特徴量は計算し、閾値は重要度が0の特徴量にだけ適用する
+    ALLOW_LOSSY_FEATURE_PRUNING = False
 
-def load_model() -> CatBoostRegressor:
-    model_path = os.path.join(Config.MODEL_DIR, 'simple_catboost_model.cbm')
-    
-    if not os.path.exists(model_path):
-        logger.error(f"モデルファイルが存在しません: {model_path}")
-        raise FileNotFoundError(f"モデルファイルが存在しません: {model_path}")
-    
-    model = CatBoostRegressor()
-    model.load_model(model_path)
-    
-    return model
+# モデルはプロセス内で1回だけ読み込み、ファイルが更新されたときに差し替える
+registry = ModelRegistry(check_interval=Config.MODEL_CHECK_INTERVAL)
+
+def load_model(name: Optional[str] = None) -> CatBoostRegressor:
+    """
+    レジストリに登録したモデルを返す。ファイルが更新されていれば読み込み直したモデルを返す。
+
+    :param name: モデル名。Noneの場合は Config のモデル。
+    """
+    if name is None:
+        name = Config.MODEL_NAME
+        # Config を書き換えた場合にも追従する（パスが同じであれば何もしない）
+        loader = ObliviousTreeModel.from_cbm_bytes if Config.MODEL_EVALUATOR == 'numpy' else None
+        registry.register(name, os.path.join(Config.MODEL_DIR, Config.MODEL_FILE), loader)
+    return registry.get(name)
+
+_ensemble: Optional[ModelEnsemble] = None
+
+def load_ensemble() -> Optional[ModelEnsemble]:
+    """
+    Config.ENSEMBLE_MODELS のモデルをレジストリに登録し、アンサンブルを返す。設定されていなければNoneを返す。
+    モデルの名前はファイル名から拡張子を除いたもの。
+    """
+    global _ensemble
+    if not Config.ENSEMBLE_MODELS:
+        return None
+    loader = ObliviousTreeModel.from_cbm_bytes if Config.MODEL_EVALUATOR == 'numpy' else None
+    members = []
+    for file, weight in Config.ENSEMBLE_MODELS.items():
+        name = os.path.splitext(file)[0]
+        registry.register(name, os.path.join(Config.MODEL_DIR, file), loader)
+        members.append(EnsembleMember(name, weight))
+    if _ensemble is None or _ensemble.members != members:
+        if _ensemble is not None:
+            _ensemble.close()
+        _ensemble = ModelEnsemble(registry, members,
+                                  fill_columns=lambda model: pruned_feature_columns(model, Config.FEATURE_IMPORTANCE_THRESHOLD))
+    return _ensemble
+
+_client: Optional[InferenceClient] = None
+
+def _inference_client() -> Optional[InferenceClient]:
+    """
+    Config.INFERENCE_SOCKET が設定されていれば推論サーバーのクライアントを返す。
+    """
+    global _client
+    if not Config.INFERENCE_SOCKET:
+        return None
+    if _client is None or _client.socket_path != Config.INFERENCE_SOCKET:
+        _client = InferenceClient(Config.INFERENCE_SOCKET)
+    return _client
+
+# 除く特徴量について警告したモデルと設定（毎周期同じ警告を出さない）
+_pruning_warned = set()
+
+def pruned_feature_columns(model: CatBoostRegressor, importance_threshold: Optional[float] = None,
+                           allow_lossy: Optional[bool] = None) -> List[str]:
+    """
+    重要度が importance_threshold 以下のため計算しない（0で埋める）特徴量の列を返す。
+    重要度が0より大きい特徴量はモデルが分岐に使っているため、0で埋めると予測値が変わる。
+    そのような特徴量は allow_lossy がTrueの場合だけ除き、捨てる重要度を警告する。
+
+    :param allow_lossy: Noneの場合は Config.ALLOW_LOSSY_FEATURE_PRUNING
+    """
+    if importance_threshold is None:
+        return []
+    allow_lossy = Config.ALLOW_LOSSY_FEATURE_PRUNING if allow_lossy is None else allow_lossy
+    importances = dict(zip(model.feature_names_, model.get_feature_importance()))
+    lossy = {name: float(importance) for name, importance in importances.items()
+             if 0.0 < importance <= importance_threshold}
+    key = (id(model), importance_threshold, allow_lossy)
+    if lossy and key not in _pruning_warned:
+        _pruning_warned.add(key)
+        if allow_lossy:
+            logger.warning(f"モデルが使っている特徴量を0で埋めるため予測値が変わります "
+                           f"（重要度の合計 {sum(lossy.values()):.4f}）: {lossy}")
+        else:
+            logger.warning(f"重要度が0より大きい特徴量は除かずに計算します（除く場合は "
+                           f"Config.ALLOW_LOSSY_FEATURE_PRUNING をTrueにしてください）: {lossy}")
+    return [name for name, importance in importances.items()
+            if importance <= 0.0 or (allow_lossy and importance <= importance_threshold)]
+
+def select_feature_columns(model: CatBoostRegressor, importance_threshold: Optional[float] = None,
+                           required: Iterable[str] = ()) -> List[str]:
+    """
+    モデルが使う特徴量の列を返す。
+    importance_threshold を指定した場合は、重要度がその値以下の特徴量を除く（pruned_feature_columns）。
+    重要度が0より大きい特徴量は Config.ALLOW_LOSSY_FEATURE_PRUNING がTrueの場合だけ除くため、
+    それ以外では予測値は変わらない。
+
+    :param required: モデル以外（戦略など）で必要な列
+    """
+    pruned = pruned_feature_columns(model, importance_threshold)
+    if pruned:
+        logger.info(f"重要度が{importance_threshold}以下の特徴量を除きます: {pruned}")
+    columns = [name for name in model.feature_names_ if name not in pruned]
+    return columns + [name for name in required if name not in columns]
+
+def model_input(row: pd.DataFrame, model: CatBoostRegressor) -> pd.DataFrame:
+    """
+    行をモデルの特徴量の順に並べる。重要度で除いて計算しなかった特徴量だけを0で埋め、
+    それ以外の特徴量がない場合（名前の違うモデルに差し替えた場合など）は KeyError にする。
+    """
+    missing = [name for name in model.feature_names_ if name not in row.columns]
+    if missing:
+        unexpected = sorted(set(missing) - set(pruned_feature_columns(model, Config.FEATURE_IMPORTANCE_THRESHOLD)))
+        if unexpected:
+            raise KeyError(f"モデルの特徴量が計算されていません: {unexpected}")
+    return row.reindex(columns=model.feature_names_, fill_value=0.0)
+
+def model_feature_columns(required: Iterable[str] = ()) -> List[str]:
+    """
+    現在のモデルと Config.FEATURE_IMPORTANCE_THRESHOLD から計算が必要な特徴量の列を返す。
+    推論サーバーを使う場合は、サーバーのモデルの特徴量を使う。アンサンブルの場合は全モデルの特徴量の和集合。
+    """
+    ensemble = load_ensemble()
+    if ensemble is not None:
+        columns: List[str] = []
+        for member in ensemble.members:
+            selected = select_feature_columns(registry.get(member.name), Config.FEATURE_IMPORTANCE_THRESHOLD)
+            columns.extend(name for name in selected if name not in columns)
+        return columns + [name for name in required if name not in columns]
+    client = _inference_client()
+    if client is not None:
+        try:
+            return select_feature_columns(client.describe(Config.MODEL_NAME), Config.FEATURE_IMPORTANCE_THRESHOLD, required)
+        except OSError as e:
+            logger.warning(f"推論サーバーに接続できないため、モデルを読み込みます: {e}")
+    return select_feature_columns(load_model(), Config.FEATURE_IMPORTANCE_THRESHOLD, required)
 
 def predict_and_save(df) -> float:
     """
     最新のデータを用いて予測を行い、結果を保存する関数
+    推論サーバーを使う場合は最新の行をサーバーに送り、接続できなければプロセス内のモデルで予測する。
+    アンサンブルを設定した場合は全モデルを同時に予測し、重みつき平均を返す。
     """
+    ensemble = load_ensemble()
+    if ensemble is not None:
+        result = ensemble.predict(df)
+        logger.info(f"各モデルの予測 {result.predictions} (所要時間 {result.total_ms:.2f} ms)")
+        return result.value
+
+    client = _inference_client()
+    if client is not None:
+        try:
+            # サーバーはない特徴量をエラーにするため、除いた特徴量の0をこちらで入れて送る
+            X = model_input(df.iloc[[-1]], client.describe(Config.MODEL_NAME))
+            return client.predict(X.iloc[0].astype(float).to_dict(), model=Config.MODEL_NAME)
+        except OSError as e:
+            logger.warning(f"推論サーバーに接続できないため、モデルを読み込んで予測します: {e}")
+
     model = load_model()
     latest_row = df.iloc[[-1]]
     
     # 特徴量名を保持するために values を使用しない
-    X = latest_row 
+    X = model_input(latest_row, model)
     
     prediction = model.predict(X)[0]
     prediction_value = float(prediction)
@@ -43,10 +200,14 @@ def predict_and_save(df) -> float:
     return prediction_value
 
 if __name__ == "__main__":
-    # データの取得と前処理
-    df = GmoDataFetcher().fetch_ohlcv(symbol='BTC/JPY', timeframe='15m', limit=100)
-    df = calc_technical_indicators(df)
+    import asyncio
+    from indicator_lookback import plan_lookback
+
+    # データの取得と前処理（指標の値が安定するのに必要な本数だけ取得する）
+    columns = model_feature_columns()
+    df = asyncio.run(GmoDataFetcher().fetch_kline_data(symbol='BTC', interval='15min', bars=plan_lookback(columns).fetch_bars()))
+    df = calc_technical_indicators(df, columns=columns)
     
     # 予測の実行
-    result = predict_and_save()
+    result = predict_and_save(df)
     logger.info(f"返された予測結果: {result}")
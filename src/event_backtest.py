@@ -0,0 +1,194 @@
+# event_backtest.py
+import io
+import os
+import sys
+import logging
+import contextlib
+from typing import Any, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+# infra と strategies をインポートできるようにリポジトリのルートをパスに追加する
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from infra.sim.matching_engine import MatchingEngine
+
+logger = logging.getLogger(__name__)
+
+
+class EventBacktestResult(NamedTuple):
+    """
+    イベント駆動のバックテストの結果。equity は各判断時点の資産（決済通貨建て）。
+    """
+    equity: pd.Series
+    executions: pd.DataFrame
+    order_count: int
+    rejected_count: int     # 残高不足などで拒否された注文の数
+    error_count: int        # 戦略が例外を送出した足の数
+    total_return: float
+    max_drawdown: float
+
+
+def simulated_strategy(strategy_cls: type, engine: MatchingEngine, *args, **kwargs) -> Any:
+    """
+    Strategy クラスを変更せずに、取引所のメソッドだけを engine に向けたインスタンスを作る。
+    GmoCoin を継承する戦略は SimulatedGmoCoin、BybitAuth を継承する戦略は SimulatedBybitAuth を
+    Strategy と取引所のクラスの間に挟む。Bybitの戦略が内部で作る BybitTrader・BybitOrder の exchange も差し替える。
+    """
+    from infra.gmo.gmo_order import GmoCoin
+    from infra.bybit.auth import BybitAuth
+
+    if issubclass(strategy_cls, GmoCoin):
+        from infra.sim.sim_gmo import SimulatedGmoCoin as adapter
+    elif issubclass(strategy_cls, BybitAuth):
+        from infra.sim.sim_bybit import SimulatedBybitAuth as adapter
+    else:
+        raise TypeError(f"GmoCoin または BybitAuth を継承した戦略を指定してください: {strategy_cls}")
+
+    cls = type(f'Simulated{strategy_cls.__name__}', (strategy_cls, adapter), {'engine': engine})
+    strategy = cls(*args, **kwargs)
+    if issubclass(strategy_cls, BybitAuth):
+        from infra.sim.sim_bybit import attach_exchange
+        attach_exchange(strategy, strategy.exchange)
+    return strategy
+
+
+def run_event_backtest(strategy: Any, engine: MatchingEngine, frame: pd.DataFrame,
+                       predictions: Optional[np.ndarray] = None, ticks: Optional[pd.DataFrame] = None,
+                       window: int = 1, quiet: bool = True) -> EventBacktestResult:
+    """
+    足を1本ずつ engine に流し、各足の確定時に strategy.long_atr_strategy を呼ぶ。
+    ライブの trade() と同じく、戦略が送出した例外はその足だけの失敗として記録して次の足に進む。
+
+    :param frame: 特徴量のDataFrame（インデックスは足の開始時刻、Open, High, Low, Close, Volume と戦略の列）
+    :param predictions: 各足の予測値。Noneの場合は frame の 'prediction' 列
+    :param ticks: 約定（インデックスは時刻、price と size の列）。指定した場合は足の代わりに約定を流して
+                  注文と照合し、足の確定時刻（次の足の開始時刻）に戦略を呼ぶ。
+    :param window: 戦略に渡す直近の足の本数
+    :param quiet: 実行中は戦略と取引所クラスのログと標準出力を抑える（拒否された注文の数は結果に残る）
+    """
+    if predictions is None:
+        predictions = frame['prediction'].to_numpy()
+    predictions = np.asarray(predictions, dtype=np.float64).tolist()
+    n = len(frame)
+    timestamps = frame.index.as_unit('ms').asi8
+    bars = frame[['Open', 'High', 'Low', 'Close', 'Volume']].to_numpy(dtype=np.float64).tolist()
+    equity = np.empty(n)
+    # 戦略には参照する列だけを渡す（列の少ないDataFrameの方が1足ごとの切り出しと列の参照が速い）
+    columns = getattr(strategy, 'REQUIRED_COLUMNS', None)
+    strategy_frame = frame[list(columns)] if columns else frame
+    initial_equity = engine.equity(bars[0][0]) if n else 0.0
+
+    if ticks is not None:
+        tick_times = ticks.index.as_unit('ms').asi8
+        tick_prices = ticks['price'].to_numpy(dtype=np.float64).tolist()
+        tick_sizes = ticks['size'].to_numpy(dtype=np.float64).tolist()
+        interval = int(np.median(np.diff(timestamps))) if n > 1 else 0
+        # 各足の確定時刻までの約定の位置
+        bounds = np.searchsorted(tick_times, timestamps + interval).tolist()
+        tick_times = tick_times.tolist()
+
+    with contextlib.ExitStack() as stack:
+        if quiet:
+            logging.disable(logging.ERROR)
+            stack.callback(logging.disable, logging.NOTSET)
+            stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        position = 0
+        error_count = 0
+        for t in range(n):
+            if ticks is None:
+                engine.on_bar(timestamps[t], *bars[t])
+            else:
+                for i in range(position, bounds[t]):
+                    engine.on_trade(tick_times[i], tick_prices[i], tick_sizes[i])
+                position = max(position, bounds[t])
+                # 足の値は確定した足のものにする（fetch_ticker など）
+                engine.last_bar = [int(timestamps[t]), *bars[t]]
+                engine.last_price = bars[t][3]
+            try:
+                strategy.long_atr_strategy(strategy_frame.iloc[max(0, t - window + 1):t + 1], predictions[t])
+            except Exception as e:
+                error_count += 1
+                logger.error(f"トレード中にエラーが発生しました: {e}")
+            equity[t] = engine.equity()
+
+    executions = pd.DataFrame(engine.executions)
+    if not executions.empty:
+        executions.index = pd.DatetimeIndex(executions['executionTimestamp'].astype('datetime64[ms]'), name='timestamp')
+    peak = np.maximum.accumulate(equity) if n else equity
+    return EventBacktestResult(
+        equity=pd.Series(equity, index=frame.index, name='equity'),
+        executions=executions,
+        order_count=len(engine.history),
+        rejected_count=engine.rejected_count,
+        error_count=error_count,
+        total_return=float(equity[-1] / initial_equity - 1) if n and initial_equity else 0.0,
+        max_drawdown=float(np.max((peak - equity) / peak)) if n else 0.0,
+    )
+
+
+# 3か月分の1分足と、1週間分の約定を流す場合の所要時間
+if __name__ == "__main__":
+    import time
+    import tempfile
+    from catboost import CatBoostRegressor
+
+    from batch_predict import predict_frame
+    from calc_technical_indicators import calc_technical_indicators
+    from indicator_lookback import reference_prices
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 90 * 24 * 60
+    df = pd.DataFrame({name.capitalize(): values for name, values in reference_prices(n).items()},
+                      index=pd.date_range('2024-01-01', periods=n, freq='1min', name='timestamp'))
+    features = calc_technical_indicators(df, columns=['ATR', 'RSI', 'MOM', 'MACD_macd', 'NATR'])
+    target = features['Close'].pct_change(15).shift(-15).fillna(0.0) * 100
+    model = CatBoostRegressor(iterations=200, depth=6, verbose=False, allow_writing_files=False)
+    model.fit(features.iloc[:len(features) // 4], target.iloc[:len(features) // 4])
+    features['prediction'] = predict_frame(features, model=model)
+
+    # logs/ にログファイルを作る取引所クラスがあるため、一時ディレクトリで実行する
+    with tempfile.TemporaryDirectory() as root:
+        os.chdir(root)
+        os.makedirs('logs')
+        from strategies.strategy_gmo_v001 import Strategy as GmoStrategy
+        from strategies.strategy_bybit_v001 import Strategy as BybitStrategy
+
+        engine = MatchingEngine(base='BTC', quote='JPY', balances={'JPY': 1_000_000.0}, participation=0.1)
+        strategy = simulated_strategy(GmoStrategy, engine, symbol='BTC')
+        start = time.perf_counter()
+        result = run_event_backtest(strategy, engine, features)
+        elapsed = time.perf_counter() - start
+        print(f"GMO   {len(features)}本の1分足 {elapsed:6.1f}s ({elapsed / len(features) * 1e6:.0f} µs/本)  "
+              f"注文 {result.order_count} (拒否 {result.rejected_count})  エラー {result.error_count}  約定 {len(result.executions)}  "
+              f"リターン {result.total_return:+.2%}  最大ドローダウン {result.max_drawdown:.2%}")
+
+        engine = MatchingEngine(base='BTC', quote='USDT', balances={'USDT': 10_000.0}, min_order_size=0.000048,
+                                size_step=0.000001, participation=0.1)
+        strategy = simulated_strategy(BybitStrategy, engine, symbol='BTC/USDT', order_size=0.001)
+        bybit_features = features.copy()
+        bybit_features[['Open', 'High', 'Low', 'Close', 'ATR']] /= 150
+        start = time.perf_counter()
+        result = run_event_backtest(strategy, engine, bybit_features)
+        elapsed = time.perf_counter() - start
+        print(f"Bybit {len(features)}本の1分足 {elapsed:6.1f}s ({elapsed / len(features) * 1e6:.0f} µs/本)  "
+              f"注文 {result.order_count} (拒否 {result.rejected_count})  エラー {result.error_count}  約定 {len(result.executions)}  "
+              f"リターン {result.total_return:+.2%}  最大ドローダウン {result.max_drawdown:.2%}")
+
+        # 1週間分の足を、1本あたり30件の約定に分けて流す
+        week = features.iloc[:7 * 24 * 60]
+        rng = np.random.default_rng(0)
+        per_bar = 30
+        offsets = np.sort(rng.integers(0, 60_000, size=(len(week), per_bar)), axis=1)
+        tick_times = (week.index.as_unit('ms').asi8[:, None] + offsets).ravel()
+        prices = rng.uniform(week['Low'].to_numpy()[:, None], week['High'].to_numpy()[:, None], size=(len(week), per_bar))
+        prices[:, 0], prices[:, -1] = week['Open'].to_numpy(), week['Close'].to_numpy()
+        ticks = pd.DataFrame({'price': prices.ravel(), 'size': np.repeat(week['Volume'].to_numpy() / per_bar, per_bar)},
+                             index=pd.DatetimeIndex(tick_times.astype('datetime64[ms]')))
+        engine = MatchingEngine(base='BTC', quote='JPY', balances={'JPY': 1_000_000.0}, participation=0.1)
+        strategy = simulated_strategy(GmoStrategy, engine, symbol='BTC')
+        start = time.perf_counter()
+        result = run_event_backtest(strategy, engine, week, ticks=ticks)
+        elapsed = time.perf_counter() - start
+        print(f"約定 {len(ticks)}件 {elapsed:6.1f}s ({elapsed / len(ticks) * 1e6:.1f} µs/件)  "
+              f"注文 {result.order_count}  約定 {len(result.executions)}  リターン {result.total_return:+.2%}")
@@ -11,8 +11,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # 必要なモジュールのインポート
 from calc_technical_indicators import calc_technical_indicators
+from indicator_lookback import plan_lookback
 from infra.gmo.gmo_data_fetcher import GmoDataFetcher
-from data_procces_and_predict import predict_and_save
+from data_procces_and_predict import predict_and_save, model_feature_columns
 from strategies.strategy_bybit_v001 import Strategy
 from strategies.strategy_v002 import Strategy
 from infra.bybit.auth import BybitAuth
@@ -51,8 +52,11 @@ async def trade():
         symbols = auth.fetch_symbols()
         logger.debug(f"Fetched symbols: {symbols}")
 
-        df = await fetcher.fetch_kline_data(symbol=symbol, interval='15min')
-        df = calc_technical_indicators(df)
+        # モデルと戦略が使う指標だけを計算する
+        columns = model_feature_columns(required=strategy1.REQUIRED_COLUMNS)
+        # 指標の値が安定するのに必要な本数だけ取得する
+        df = fetcher.fetch_ohlcv(limit=plan_lookback(columns).fetch_bars())
+        df = calc_technical_indicators(df, columns=columns)
         prediction = predict_and_save(df)
 
         record_prediction(prediction)
@@ -11,12 +11,17 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # 必要なモジュールのインポート
 from calc_technical_indicators import calc_technical_indicators
+from streaming_indicators import StreamingIndicatorEngine
+from indicator_lookback import plan_lookback
 from infra.gmo.gmo_data_fetcher import GmoDataFetcher
-from data_procces_and_predict import predict_and_save
+from infra.gmo.gmo_candle_builder import GmoCandleBuilder
+from data_procces_and_predict import predict_and_save, model_feature_columns
 from strategies.strategy_gmo_v001 import Strategy 
 
 from infra.gmo.gmo_auth import GmoAuth
 from infra.gmo.gmo_order import GmoCoin
+from infra.gmo.gmo_async_client import AsyncGmoClient
+from infra.gmo.gmo_websocket_client import websocket_order_events
 
 
 # record_predictions.py から関数をインポート
@@ -38,21 +43,33 @@ symbol = 'BTC'
 gmo_coin = GmoCoin(proxies=proxies)  # TODO: 通常環境用にoptionalにする
 fetcher = GmoDataFetcher(proxy=proxy)
 strategy = Strategy(symbol=symbol, equity_fraction=0.7)
+# 注文・残高のリクエストはプロセスで共有する接続から非同期で発行する。
+# 銘柄情報・残高のキャッシュは戦略と共有する
+client = AsyncGmoClient(symbol_str=symbol, proxy=proxy, cache=strategy.cache)
+# スケジュール実行でも同じイベントループ（と接続）を使い回す
+loop = asyncio.new_event_loop()
 
 
-async def trade():
+async def trade(df=None, features=None):
     try:
-        symbols = auth.fetch_symbols()
+        # 銘柄情報は足の取得と同時に取得する
+        symbols_task = asyncio.ensure_future(client.fetch_symbols())
+
+        if features is None:
+            # モデルと戦略が使う指標だけを計算する
+            columns = model_feature_columns(required=strategy.REQUIRED_COLUMNS)
+            if df is None:
+                # 指標の値が安定するのに必要な本数だけ取得する
+                df = await fetcher.fetch_kline_data(symbol=symbol, interval='15min', bars=plan_lookback(columns).fetch_bars())
+            features = calc_technical_indicators(df, columns=columns)
+        symbols = await symbols_task
         logger.debug(f"Fetched symbols: {symbols}")
-
-        df = await fetcher.fetch_kline_data(symbol=symbol, interval='15min')
-        df = calc_technical_indicators(df)
-        prediction = predict_and_save(df)
+        prediction = predict_and_save(features)
 
         record_prediction(prediction)
 
         # Strategy1 のインスタンスを使用して execute メソッドを呼び出す
-        strategy.long_atr_strategy(df, prediction)
+        await strategy.long_atr_strategy_async(features, prediction, client)
 
     except Exception as e:
         logger.error(f"トレード中にエラーが発生しました: {e}")
@@ -61,7 +78,40 @@ async def execute_trade_async():
     await trade()
 
 def execute_trade():
-    asyncio.run(execute_trade_async())
+    loop.run_until_complete(execute_trade_async())
+
+async def run_stream():
+    """
+    WebSocketの約定から15分足を組み立て、足が確定した時点でトレードを実行する。
+    テクニカル指標は確定足ごとに差分だけ更新する。
+    """
+    # ストリーミングではすべての指標を更新するため、すべての指標が安定する本数を保持する
+    bars = plan_lookback().fetch_bars()
+    builder = GmoCandleBuilder(symbol=symbol, interval='15min', history_size=bars)
+    builder.seed(await fetcher.fetch_kline_data(symbol=symbol, interval='15min', bars=bars))
+    engine = StreamingIndicatorEngine()
+    engine.update_frame(builder.to_dataframe())
+    asyncio.create_task(builder.run())
+    # 約定のイベントを受け取ったら残高のキャッシュを消し、戦略が置いている注文の一覧を更新する
+    # （キャッシュは client と共有している）。イベントが届くため、操作が成功している間は有効な注文を取得し直さない。
+    # 再接続した場合は切断中のイベントが届いていないため、次の足で取得し直す
+    strategy.order_events = True
+    asyncio.create_task(websocket_order_events(on_event=strategy.on_order_event, on_connect=strategy.resync_orders))
+
+    while True:
+        bar = await builder.wait_closed_bar()
+        logger.info(f"確定足: {bar}")
+        if not bar['complete']:
+            # 接続前から始まっていた足は約定が欠けているため、従来どおりREST APIで取り直す
+            await asyncio.sleep(5)
+            builder.seed(await fetcher.fetch_kline_data(symbol=symbol, interval='15min', bars=bars))
+            # 取り直した足で指標の途中状態を作り直す
+            engine = StreamingIndicatorEngine()
+        features = engine.update_frame(builder.to_dataframe())
+        if features.empty:
+            logger.warning("テクニカル指標の計算に必要な本数が揃っていません。")
+            continue
+        await trade(features=features)
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description="GMOトレーディングスクリプト")
@@ -70,6 +120,11 @@ def parse_arguments():
         action='store_true',
         help='スケジュール開始前にトレードを即時実行します'
     )
+    parser.add_argument(
+        '-s', '--stream',
+        action='store_true',
+        help='WebSocketで組み立てた足が確定した時点でトレードを実行します'
+    )
     return parser.parse_args()
 
 # スケジュールの設定
@@ -84,6 +139,10 @@ if __name__ == "__main__":
         logger.info("即時実行オプションが指定されたため、トレードを即時実行します。")
         execute_trade()
 
+    if args.stream:
+        logger.info("WebSocketで足を組み立ててトレードを実行します。")
+        loop.run_until_complete(run_stream())
+
     logger.info("スケジューリングを開始します。")
     while True:
         schedule.run_pending()
@@ -0,0 +1,247 @@
+# feature_cache.py
+import os
+import shutil
+import logging
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from calc_technical_indicators import (
+    FEATURE_COLUMNS, INDICATORS, PRICE_COLUMNS, build_feature_matrix, indicator_config_hash,
+)
+from indicator_lookback import plan_lookback
+
+logger = logging.getLogger(__name__)
+
+# 追記する足の値と全期間で計算した値との相対誤差の許容値（warmup_bars を指定しない場合に使う）
+WARMUP_TOLERANCE = 1e-8
+TIMESTAMP_FILE = 'timestamp.bin'
+# キャッシュを計算したときの入力の最初の足の時刻（先頭の欠損値の行はキャッシュに含まれない）
+ORIGIN_FILE = 'origin.bin'
+TIMESTAMP_DTYPE = np.dtype('<i8')
+FEATURE_DTYPE = np.dtype('<f8')
+
+
+class FeatureCache:
+    """
+    テクニカル指標の計算結果を (symbol, timeframe, 足の時刻, 指標定義のハッシュ) ごとに保存するキャッシュ。
+    特徴量は列ごとのファイルに時刻順に追記するだけの列指向形式で、読み込み時はmemmapで必要な範囲だけを切り出す。
+    指標の定義やTA-Libのバージョンが変わるとハッシュが変わり、別のディレクトリのキャッシュを使う。
+
+    キャッシュの値は、キャッシュの最初の足から計算した場合の値になる。
+    新しい足はその直前の warmup_bars 本を含めて計算し、新しい足の分だけを追記する。
+    """
+    def __init__(self, root_dir: str = 'strage/features', warmup_bars: Optional[int] = None):
+        """
+        :param root_dir: キャッシュの保存先
+        :param warmup_bars: 新しい足を計算するときに含める直前の足の本数（再帰的な指標が収束するのに十分な本数）。
+                            Noneの場合は plan_lookback で WARMUP_TOLERANCE に収まる本数を求める。
+        """
+        self.root_dir = root_dir
+        self.warmup_bars = warmup_bars if warmup_bars is not None else plan_lookback(tolerance=WARMUP_TOLERANCE).stable_window
+        self.config_hash = indicator_config_hash()
+
+    def _dir(self, symbol: str, timeframe: str) -> str:
+        return os.path.join(self.root_dir, symbol.replace('/', '_'), timeframe, self.config_hash)
+
+    @staticmethod
+    def _to_ms(index: pd.DatetimeIndex) -> np.ndarray:
+        # tz付きはUTCのエポック、naiveはUTCとみなす
+        return index.as_unit('ms').asi8
+
+    @staticmethod
+    def _open(path: str, dtype: np.dtype, count: int) -> np.ndarray:
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+    def _timestamps(self, directory: str) -> np.ndarray:
+        """
+        キャッシュ済みの足の時刻を返す。時刻の列は最後に書き込むため、この本数までが確定済み。
+        """
+        path = os.path.join(directory, TIMESTAMP_FILE)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=TIMESTAMP_DTYPE)
+        return self._open(path, TIMESTAMP_DTYPE, os.path.getsize(path) // TIMESTAMP_DTYPE.itemsize)
+
+    def _origin(self, directory: str) -> Optional[int]:
+        path = os.path.join(directory, ORIGIN_FILE)
+        if not os.path.exists(path):
+            return None
+        return int(np.fromfile(path, dtype=TIMESTAMP_DTYPE, count=1)[0])
+
+    def _write(self, directory: str, timestamps: np.ndarray, features: pd.DataFrame, count: int) -> None:
+        """
+        count 本のキャッシュの後ろに追記する。特徴量の列を先に書き、時刻の列を最後に書く。
+        """
+        os.makedirs(directory, exist_ok=True)
+        for column in FEATURE_COLUMNS:
+            path = os.path.join(directory, f'{column}.bin')
+            # 前回の追記が途中で止まっていた場合の余分な行を削除する
+            with open(path, 'ab') as f:
+                f.truncate(count * FEATURE_DTYPE.itemsize)
+                features[column].to_numpy(dtype=FEATURE_DTYPE).tofile(f)
+        with open(os.path.join(directory, TIMESTAMP_FILE), 'ab') as f:
+            f.truncate(count * TIMESTAMP_DTYPE.itemsize)
+            timestamps.astype(TIMESTAMP_DTYPE).tofile(f)
+
+    def _rebuild(self, directory: str, ohlcv: pd.DataFrame) -> None:
+        """
+        ohlcv の先頭から計算し直してキャッシュを作り直す。
+        """
+        features = build_feature_matrix(ohlcv)
+        tmp_dir = directory + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        self._write(tmp_dir, self._to_ms(features.index), features, count=0)
+        self._to_ms(ohlcv.index[:1]).astype(TIMESTAMP_DTYPE).tofile(os.path.join(tmp_dir, ORIGIN_FILE))
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp_dir, directory)
+        logger.info(f"特徴量のキャッシュを作成しました: {directory} ({len(features)}本)")
+
+    def _append(self, directory: str, ohlcv: pd.DataFrame, cached: np.ndarray, first_new: int) -> None:
+        """
+        ohlcv の first_new 本目以降を、直前の warmup_bars 本を含めて計算して追記する。
+        """
+        start = max(0, first_new - self.warmup_bars)
+        if first_new - start < self.warmup_bars:
+            logger.warning(f"ウォームアップに使える足が{first_new - start}本しかありません（{self.warmup_bars}本を推奨）。")
+        window = build_feature_matrix(ohlcv.iloc[start:])
+        timestamps = self._to_ms(window.index)
+        last = int(cached[-1])
+        new = timestamps > last
+        if not new.any():
+            return
+
+        features = window.loc[new]
+        overlap = np.flatnonzero(timestamps == last)
+        if overlap.size:
+            features = self._stitch_cumulative(directory, window.iloc[overlap[0]], features, len(cached))
+        else:
+            logger.warning("累積型の指標をキャッシュの水準に合わせられませんでした。")
+        self._write(directory, timestamps[new], features, count=len(cached))
+
+    def _stitch_cumulative(self, directory: str, overlap_row: pd.Series, features: pd.DataFrame, count: int) -> pd.DataFrame:
+        """
+        AD, OBV などの累積型の指標は計算の開始位置で水準が変わるため、
+        キャッシュの最後の足と計算し直した同じ足の差を新しい足に加える。
+        """
+        features = features.copy()
+        close = features['Close'].to_numpy()
+        for spec in INDICATORS:
+            if not spec.cumulative:
+                continue
+            scale = overlap_row['Close'] if spec.normalize == 'close' else 1.0
+            for column in spec.columns:
+                cached_value = self._open(os.path.join(directory, f'{column}.bin'), FEATURE_DTYPE, count)[-1]
+                offset = (cached_value - overlap_row[column]) * scale
+                if spec.normalize == 'close':
+                    features[column] += offset / close
+                else:
+                    features[column] += offset
+        return features
+
+    def update(self, symbol: str, timeframe: str, ohlcv: pd.DataFrame) -> None:
+        """
+        ohlcv のうちキャッシュにない足の特徴量を計算して保存する。
+        ohlcv がキャッシュより前から始まる場合や、キャッシュにない足が途中に含まれる場合は作り直す。
+        """
+        if ohlcv.empty:
+            return
+        directory = self._dir(symbol, timeframe)
+        cached = self._timestamps(directory)
+        origin = self._origin(directory)
+        timestamps = self._to_ms(ohlcv.index)
+
+        if len(cached) == 0 or origin is None or timestamps[0] < origin:
+            self._rebuild(directory, ohlcv)
+            return
+
+        first_new = int(np.searchsorted(timestamps, cached[-1], side='right'))
+        # キャッシュ範囲内の足がすべてキャッシュ済みであること（キャッシュの最初の足より前のウォームアップ行は除く）
+        known = timestamps[:first_new]
+        known = known[known >= cached[0]]
+        positions = np.searchsorted(cached, known)
+        if (positions >= len(cached)).any() or (cached[np.minimum(positions, len(cached) - 1)] != known).any():
+            logger.info("キャッシュにない足が含まれるため作り直します。")
+            self._rebuild(directory, ohlcv)
+            return
+        if first_new < len(ohlcv):
+            self._append(directory, ohlcv, cached, first_new)
+
+    def get(self, symbol: str, timeframe: str, ohlcv: pd.DataFrame,
+            columns: Optional[Iterable[str]] = None, dtype=np.float64) -> pd.DataFrame:
+        """
+        ohlcv の各足の特徴量を calc_technical_indicators と同じ形式で返す。
+        キャッシュにない足だけを計算して追記する。
+
+        :param columns: 必要な特徴量の列。Noneの場合はすべての列。
+        """
+        self.update(symbol, timeframe, ohlcv)
+        return self.read(symbol, timeframe, ohlcv, columns=columns, dtype=dtype)
+
+    def read(self, symbol: str, timeframe: str, ohlcv: pd.DataFrame,
+             columns: Optional[Iterable[str]] = None, dtype=np.float64) -> pd.DataFrame:
+        """
+        ohlcv の足のうちキャッシュ済みのものについて、OHLCVとキャッシュした特徴量を1つの配列にまとめて返す。
+        """
+        feature_columns: List[str] = FEATURE_COLUMNS if columns is None else \
+            [column for column in FEATURE_COLUMNS if column in set(columns)]
+        directory = self._dir(symbol, timeframe)
+        cached = self._timestamps(directory)
+        timestamps = self._to_ms(ohlcv.index)
+        positions = np.searchsorted(cached, timestamps)
+        hit = (positions < len(cached)) & (cached[np.minimum(positions, max(len(cached) - 1, 0))] == timestamps) \
+            if len(cached) else np.zeros(len(timestamps), dtype=bool)
+        rows = positions[hit]
+
+        matrix = np.empty((len(rows), len(PRICE_COLUMNS) + len(feature_columns)), dtype=dtype, order='F')
+        for j, name in enumerate(PRICE_COLUMNS):
+            matrix[:, j] = ohlcv[name].to_numpy()[hit]
+        for j, column in enumerate(feature_columns, start=len(PRICE_COLUMNS)):
+            values = self._open(os.path.join(directory, f'{column}.bin'), FEATURE_DTYPE, len(cached))
+            matrix[:, j] = values[rows]
+        return pd.DataFrame(matrix, index=ohlcv.index[hit], columns=PRICE_COLUMNS + feature_columns, copy=False)
+
+
+# キャッシュの有無による計算時間の比較
+if __name__ == "__main__":
+    import sys
+    import time
+    import tempfile
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    rng = np.random.default_rng(0)
+    close = 4_000_000 + rng.normal(0, 5000, n).cumsum()
+    spread = np.abs(rng.normal(0, 3000, (n, 2)))
+    df = pd.DataFrame({
+        'Open': close + rng.normal(0, 1000, n),
+        'High': close + spread[:, 0],
+        'Low': close - spread[:, 1],
+        'Close': close,
+        'Volume': np.abs(rng.normal(1, 0.5, n)),
+    }, index=pd.date_range('2020-01-01', periods=n, freq='15min', name='timestamp'))
+
+    with tempfile.TemporaryDirectory() as root:
+        cache = FeatureCache(root_dir=root)
+        head = n - 1000
+        print(f"ウォームアップ {cache.warmup_bars}本")
+
+        start = time.perf_counter()
+        expected = build_feature_matrix(df)
+        print(f"キャッシュなし      {time.perf_counter() - start:8.3f}s")
+
+        start = time.perf_counter()
+        cache.get('BTC/USDT', '15m', df.iloc[:head])
+        print(f"初回（{head}本）   {time.perf_counter() - start:8.3f}s")
+
+        start = time.perf_counter()
+        result = cache.get('BTC/USDT', '15m', df)
+        print(f"1000本追加         {time.perf_counter() - start:8.3f}s")
+
+        start = time.perf_counter()
+        cache.get('BTC/USDT', '15m', df)
+        print(f"すべてキャッシュ済み {time.perf_counter() - start:8.3f}s")
+
+        errors = (result[FEATURE_COLUMNS] - expected[FEATURE_COLUMNS]).abs().max() / expected[FEATURE_COLUMNS].abs().max()
+        print(f"全期間で計算した値との最大相対誤差: {errors.max():.3e} ({errors.idxmax()})")
@@ -0,0 +1,257 @@
+# indicator_lookback.py
+import math
+import logging
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from talib import abstract
+
+from calc_technical_indicators import IndicatorSpec, PRICE_COLUMNS, compute_indicator, select_indicators
+
+logger = logging.getLogger(__name__)
+
+# 特徴量の値が全期間で計算した値から外れてよい範囲（各列の値の大きさに対する比）
+DEFAULT_TOLERANCE = 1e-6
+
+
+def _ema_decay(period: int) -> float:
+    # EMAの初期値の誤差は1本ごとに (1 - 2/(n+1)) 倍になる
+    return 1.0 - 2.0 / (period + 1)
+
+
+def _wilder_decay(period: int) -> float:
+    # Wilderの平滑化（RSI, ATR, DMなど）は1本ごとに (1 - 1/n) 倍になる
+    return 1.0 - 1.0 / period
+
+
+# 初期値の影響が指数的に減衰する指標: 関数名 -> パラメータから (1本あたりの減衰率, 平滑化を重ねた回数) を返す関数
+_DECAY: Dict[str, Callable[[Dict], Tuple[float, int]]] = {
+    'EMA': lambda p: (_ema_decay(p['timeperiod']), 1),
+    'DEMA': lambda p: (_ema_decay(p['timeperiod']), 2),
+    'TEMA': lambda p: (_ema_decay(p['timeperiod']), 3),
+    'TRIX': lambda p: (_ema_decay(p['timeperiod']), 3),
+    'T3': lambda p: (_ema_decay(p['timeperiod']), 6),
+    'MACD': lambda p: (_ema_decay(max(p['slowperiod'], p['signalperiod'])), 2),
+    'ADOSC': lambda p: (_ema_decay(p['slowperiod']), 1),
+    'RSI': lambda p: (_wilder_decay(p['timeperiod']), 1),
+    'STOCHRSI': lambda p: (_wilder_decay(p['timeperiod']), 1),
+    'ATR': lambda p: (_wilder_decay(p['timeperiod']), 1),
+    'NATR': lambda p: (_wilder_decay(p['timeperiod']), 1),
+    'PLUS_DM': lambda p: (_wilder_decay(p['timeperiod']), 1),
+    'MINUS_DM': lambda p: (_wilder_decay(p['timeperiod']), 1),
+    'PLUS_DI': lambda p: (_wilder_decay(p['timeperiod']), 1),
+    'MINUS_DI': lambda p: (_wilder_decay(p['timeperiod']), 1),
+    'DX': lambda p: (_wilder_decay(p['timeperiod']), 1),
+    'ADX': lambda p: (_wilder_decay(p['timeperiod']), 2),
+    'ADXR': lambda p: (_wilder_decay(p['timeperiod']), 2),
+}
+
+# 直近の一定本数だけで値が決まる指標（lookback の本数があれば全期間で計算した値と一致する）
+_WINDOW_FUNCTIONS = {
+    'SMA', 'MA', 'WMA', 'TRIMA', 'MIDPOINT', 'BBANDS', 'STDDEV', 'APO', 'MOM', 'TRANGE',
+    'LINEARREG', 'LINEARREG_INTERCEPT', 'LINEARREG_SLOPE', 'LINEARREG_ANGLE',
+    'AROON', 'AROONOSC', 'BOP', 'CCI', 'MFI', 'STOCH', 'STOCHF', 'ULTOSC', 'WILLR', 'BETA', 'CORREL',
+}
+
+
+class IndicatorLookback(NamedTuple):
+    """
+    1つの指標が安定した値を出すのに必要な足の本数。
+    """
+    function: str
+    lookback: int             # TA-Libが最初の値を出すまでに捨てる本数
+    unstable: Optional[int]   # 最初の値から、初期値の影響が許容誤差を下回るまでの本数。累積型はNone
+    method: str               # unstable の求め方（'window', 'decay', 'measured', 'cumulative'）
+
+    @property
+    def stable_window(self) -> Optional[int]:
+        """
+        最新の足の値が安定するのに必要な本数。累積型の指標はどれだけ遡っても開始位置に依存するためNone。
+        """
+        if self.unstable is None:
+            return None
+        return self.lookback + 1 + self.unstable
+
+
+class LookbackPlan(NamedTuple):
+    """
+    計算する指標全体で必要な足の本数。
+    """
+    indicators: List[IndicatorLookback]
+    tolerance: float
+
+    @property
+    def stable_window(self) -> int:
+        """
+        最新の足のすべての特徴量が安定するのに必要な最小の本数。
+        """
+        windows = [item.stable_window for item in self.indicators if item.stable_window is not None]
+        return max(windows, default=1)
+
+    @property
+    def cumulative(self) -> List[str]:
+        """
+        取得した本数によって水準が変わる累積型の指標（AD, OBVなど）。
+        """
+        return [item.function for item in self.indicators if item.unstable is None]
+
+    def fetch_bars(self, rows: int = 1) -> int:
+        """
+        安定した特徴量を最新の rows 行分得るために取得する足の本数。
+        """
+        return self.stable_window + rows - 1
+
+
+def _talib_params(spec: IndicatorSpec) -> Dict:
+    # abstract APIは引数の型を厳密に確認する（nbdevup=2 は 2.0 にする）
+    info = abstract.Function(spec.function).info['parameters']
+    return {name: type(info[name])(value) for name, value in spec.params.items()}
+
+
+def indicator_lookback(spec: IndicatorSpec) -> int:
+    """
+    TA-Libが最初の値を出すまでに捨てる本数を返す（talib.set_unstable_period の設定を含む）。
+    """
+    function = abstract.Function(spec.function)
+    if spec.params:
+        function.set_parameters(**_talib_params(spec))
+    return function.lookback
+
+
+def _decay_bars(decay: float, chain: int, tolerance: float) -> int:
+    """
+    初期値の誤差が k^(chain-1) * decay^k < tolerance となる最小の本数 k を返す。
+    平滑化を chain 回重ねると、誤差の減衰は多項式の係数がかかった分だけ遅くなる。
+    """
+    if decay <= 0.0:
+        return 0
+    bars = math.log(tolerance) / math.log(decay)
+    for _ in range(20):
+        bars = (math.log(tolerance) - (chain - 1) * math.log(max(bars, 1.0))) / math.log(decay)
+    return max(0, math.ceil(bars))
+
+
+def reference_prices(n: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    """
+    不安定期間の計測に使う、ランダムウォークの価格（小文字の価格名からfloat64配列への辞書）。
+    """
+    rng = np.random.default_rng(seed)
+    close = 4_000_000 + rng.normal(0, 5000, n).cumsum()
+    spread = np.abs(rng.normal(0, 3000, (n, 2)))
+    return {
+        'open': close + rng.normal(0, 1000, n),
+        'high': close + spread[:, 0],
+        'low': close - spread[:, 1],
+        'close': close,
+        'volume': np.abs(rng.normal(1, 0.5, n)),
+    }
+
+
+def _window_error(spec: IndicatorSpec, prices: Dict[str, np.ndarray], full: List[np.ndarray],
+                  window: int, ends: np.ndarray) -> float:
+    """
+    ends の各位置を最新の足として、直前の window 本だけで計算した値と全期間で計算した値の最大相対誤差を返す。
+    """
+    error = 0.0
+    for end in ends:
+        window_prices = {name: values[end - window:end] for name, values in prices.items()}
+        hilo = (window_prices['high'] + window_prices['low']) / 2
+        outputs = compute_indicator(spec, window_prices, hilo, window_prices['close'])
+        for values, reference in zip(outputs, full):
+            scale = np.nanmax(np.abs(reference[ends - 1])) or 1.0
+            error = max(error, abs(values[-1] - reference[end - 1]) / scale)
+    return error
+
+
+@lru_cache(maxsize=None)
+def _measured_unstable(function: str, params: Tuple, inputs: Tuple[str, ...], normalize: Optional[str],
+                       lookback: int, tolerance: float, n: int = 20_000, samples: int = 16) -> int:
+    """
+    初期値の影響の減衰がデータに依存する指標（KAMA, Hilbert変換など）の不安定期間を、
+    参照用の価格で計算した値と全期間の値を比べて求める。
+    本数を倍にしながら許容誤差を下回る本数を探し、二分探索で最小の本数に絞る。
+    """
+    spec = IndicatorSpec(function, tuple(f'_{i}' for i in range(len(abstract.Function(function).output_names))),
+                         inputs, dict(params), normalize)
+    prices = reference_prices(n)
+    hilo = (prices['high'] + prices['low']) / 2
+    full = compute_indicator(spec, prices, hilo, prices['close'])
+    # 最後の1/4の区間から、最新の足とみなす位置を等間隔に選ぶ
+    ends = np.linspace(n * 3 // 4, n, samples, dtype=np.int64)
+
+    low, high = lookback + 1, lookback + 2
+    while _window_error(spec, prices, full, high, ends) >= tolerance:
+        low, high = high, high * 2
+        if high > n * 3 // 4:
+            raise ValueError(f"{function}の値が{n * 3 // 4}本で許容誤差{tolerance}に収束しません。")
+    while low + 1 < high:
+        middle = (low + high) // 2
+        if _window_error(spec, prices, full, middle, ends) < tolerance:
+            high = middle
+        else:
+            low = middle
+    return high - lookback - 1
+
+
+def plan_indicator(spec: IndicatorSpec, tolerance: float = DEFAULT_TOLERANCE) -> IndicatorLookback:
+    """
+    1つの指標の lookback と不安定期間を求める。
+    """
+    lookback = indicator_lookback(spec)
+    if spec.cumulative:
+        return IndicatorLookback(spec.function, lookback, None, 'cumulative')
+    # matypeが単純移動平均以外の場合は、指数平滑化を含むため計測する
+    simple_ma = all(value == 0 for name, value in spec.params.items() if name.endswith('matype'))
+    if spec.function in _WINDOW_FUNCTIONS and simple_ma:
+        return IndicatorLookback(spec.function, lookback, 0, 'window')
+    if spec.function in _DECAY and simple_ma:
+        decay, chain = _DECAY[spec.function](spec.params)
+        return IndicatorLookback(spec.function, lookback, _decay_bars(decay, chain, tolerance), 'decay')
+    unstable = _measured_unstable(spec.function, tuple(sorted(spec.params.items())), spec.inputs,
+                                  spec.normalize, lookback, tolerance)
+    return IndicatorLookback(spec.function, lookback, unstable, 'measured')
+
+
+def plan_lookback(columns: Optional[Iterable[str]] = None, tolerance: float = DEFAULT_TOLERANCE) -> LookbackPlan:
+    """
+    指定した特徴量を計算する指標について、取得が必要な足の本数を求める。
+
+    :param columns: 必要な特徴量の列。Noneの場合はすべての列。
+    :param tolerance: 全期間で計算した値との相対誤差の許容値
+    """
+    plan = LookbackPlan([plan_indicator(spec, tolerance) for spec in select_indicators(columns)], tolerance)
+    if plan.cumulative:
+        logger.info(f"累積型の指標は取得した本数によって値が変わります: {plan.cumulative}")
+    return plan
+
+
+# 計画した本数で計算した特徴量と、全期間で計算した特徴量の比較
+if __name__ == "__main__":
+    import sys
+    import time
+    import pandas as pd
+
+    from calc_technical_indicators import CUMULATIVE_COLUMNS, FEATURE_COLUMNS, build_feature_matrix
+
+    tolerance = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_TOLERANCE
+    start = time.perf_counter()
+    plan = plan_lookback(tolerance=tolerance)
+    print(f"計画の作成 {time.perf_counter() - start:.3f}s  許容誤差 {tolerance:g}")
+    for item in sorted(plan.indicators, key=lambda item: -(item.stable_window or 0)):
+        print(f"  {item.function:<20} lookback {item.lookback:>4}  unstable {str(item.unstable):>5}  "
+              f"window {str(item.stable_window):>5}  ({item.method})")
+    print(f"必要な本数: {plan.stable_window}  累積型: {plan.cumulative}")
+
+    # 計測に使ったものとは別の価格で確認する
+    n = 30_000
+    df = pd.DataFrame({name: values for name, values in zip(PRICE_COLUMNS, reference_prices(n, seed=1).values())},
+                      index=pd.date_range('2020-01-01', periods=n, freq='15min'))
+    full = build_feature_matrix(df)
+    columns = [column for column in FEATURE_COLUMNS if column not in CUMULATIVE_COLUMNS]
+    scale = full[columns].abs().max()
+    error = pd.Series(0.0, index=columns)
+    for end in range(n - 2000, n + 1, 100):
+        window = build_feature_matrix(df.iloc[end - plan.stable_window:end])
+        error = np.maximum(error, (window[columns].iloc[-1] - full[columns].loc[window.index[-1]]).abs() / scale)
+    print(f"{plan.stable_window}本で計算した最新の足の最大相対誤差: {error.max():.3e} ({error.idxmax()})")
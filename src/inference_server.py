@@ -0,0 +1,332 @@
+# inference_server.py
+import os
+import json
+import time
+import socket
+import struct
+import asyncio
+import logging
+import argparse
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from model_registry import ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = '/tmp/tradebot_inference.sock'
+# メッセージは4バイトのビッグエンディアンの長さに続くJSON
+_HEADER = struct.Struct('>I')
+
+
+async def _read_message(reader: asyncio.StreamReader) -> Dict[str, Any]:
+    size, = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return json.loads(await reader.readexactly(size))
+
+
+def _encode_message(message: Dict[str, Any]) -> bytes:
+    payload = json.dumps(message).encode()
+    return _HEADER.pack(len(payload)) + payload
+
+
+class InferenceServer:
+    """
+    モデルを1回だけ読み込んで保持し、Unixソケットで複数のボットから特徴量の行を受け付けて予測を返すサーバー。
+    同時に届いたリクエストはモデルごとにまとめて1回のpredictで処理する（マイクロバッチ）。
+
+    リクエスト: {"model": モデル名, "features": {列名: 値}}
+    レスポンス: {"prediction": 予測値} または {"error": メッセージ}
+    モデルの情報: {"op": "describe", "model": モデル名} -> {"feature_names": [...], "feature_importances": [...]}
+    """
+    def __init__(self, registry: ModelRegistry, socket_path: str = DEFAULT_SOCKET_PATH,
+                 max_batch_size: int = 256, max_wait_ms: float = 2.0):
+        """
+        :param registry: モデル名からモデルを引くレジストリ（ファイルが更新されれば差し替わる）
+        :param max_batch_size: 1回のpredictにまとめる最大の行数
+        :param max_wait_ms: 最初のリクエストが届いてから、後続のリクエストを待つ最大の時間（ミリ秒）
+        """
+        self.registry = registry
+        self.socket_path = socket_path
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue: Optional[asyncio.Queue] = None
+        # 接続中のクライアント数（クライアントは応答を待ってから次を送るため、同時に届くのは接続数まで）
+        self._connections = 0
+        # バッチの大きさの集計（件数, 行数）
+        self.batches = 0
+        self.rows = 0
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        1つの接続からリクエストを順に読み、予測を返す。接続は切断されるまで使い回す。
+        """
+        loop = asyncio.get_running_loop()
+        self._connections += 1
+        try:
+            while True:
+                try:
+                    request = await _read_message(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                name = request.get('model', 'default')
+                try:
+                    if request.get('op') == 'describe':
+                        response = self._describe(name)
+                    else:
+                        features = request.get('features', {})
+                        # 重要度で除いた特徴量はクライアント（predict_and_save）が0を入れて送る。
+                        # ない特徴量を0で埋めると予測値が黙って変わるため、バッチに入れる前にエラーにする
+                        missing = [column for column in self.registry.get(name).feature_names_ if column not in features]
+                        if missing:
+                            raise KeyError(f"特徴量がありません: {missing}")
+                        future = loop.create_future()
+                        await self._queue.put((name, features, future))
+                        response = {'prediction': await future}
+                except Exception as e:
+                    response = {'error': f"{type(e).__name__}: {e}"}
+                writer.write(_encode_message(response))
+                await writer.drain()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            self._connections -= 1
+            writer.close()
+
+    async def _collect(self) -> List[Tuple[str, Dict[str, float], asyncio.Future]]:
+        """
+        最初のリクエストを待ち、max_wait_ms の間に届いたリクエストを max_batch_size 件までまとめる。
+        接続中のすべてのクライアントからリクエストが届いた時点で待つのをやめる。
+        """
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < min(self.max_batch_size, max(self._connections, 1)):
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _describe(self, name: str) -> Dict[str, Any]:
+        model = self.registry.get(name)
+        return {
+            'feature_names': list(model.feature_names_),
+            'feature_importances': [float(value) for value in model.get_feature_importance()],
+        }
+
+    def _predict(self, name: str, rows: List[Dict[str, float]]) -> np.ndarray:
+        """
+        同じモデルへのリクエストをモデルの特徴量の順に並べ、1回のpredictで予測する。
+        """
+        model = self.registry.get(name)
+        feature_names = model.feature_names_
+        # 特徴量がそろっていることは _handle で確かめている
+        X = np.array([[row[column] for column in feature_names] for row in rows], dtype=np.float32)
+        return model.predict(X, thread_count=1)
+
+    async def _batch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            self.batches += 1
+            self.rows += len(batch)
+            by_model: Dict[str, List[Tuple[Dict[str, float], asyncio.Future]]] = defaultdict(list)
+            for name, features, future in batch:
+                by_model[name].append((features, future))
+            for name, requests in by_model.items():
+                try:
+                    # 予測中も新しいリクエストを受け付けられるよう、別スレッドで実行する
+                    predictions = await loop.run_in_executor(None, self._predict, name, [r for r, _ in requests])
+                except Exception as e:
+                    logger.error(f"モデル {name} の予測に失敗しました: {e}")
+                    for _, future in requests:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), prediction in zip(requests, predictions):
+                    if not future.done():
+                        future.set_result(float(prediction))
+
+    async def serve(self, ready: Optional[threading.Event] = None) -> None:
+        """
+        ソケットを開いてリクエストを待ち受ける。登録済みのモデルは起動時に読み込む。
+        """
+        for name in self.registry.names():
+            self.registry.get(name)
+        self._queue = asyncio.Queue()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        batch_task = asyncio.create_task(self._batch_loop())
+        logger.info(f"=== 推論サーバーを開始しました: {self.socket_path} モデル: {self.registry.names()} ===")
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batch_task.cancel()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+class RemoteModelInfo(NamedTuple):
+    """
+    推論サーバーが保持するモデルの特徴量の情報。
+    select_feature_columns にモデルの代わりに渡せるよう、CatBoostRegressorと同じ名前で参照できる。
+    """
+    feature_names_: List[str]
+    feature_importances: List[float]
+
+    def get_feature_importance(self) -> List[float]:
+        return self.feature_importances
+
+
+class InferenceClient:
+    """
+    InferenceServer に特徴量の行を送って予測値を受け取る同期クライアント。
+    接続は使い回し、切断された場合は次のリクエストで接続し直す。スレッドごとに1つ作って使う。
+    """
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, timeout: float = 5.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+
+    def _connect(self) -> socket.socket:
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._sock = sock
+        return self._sock
+
+    def _recv_exactly(self, size: int) -> bytes:
+        buffer = bytearray()
+        while len(buffer) < size:
+            chunk = self._sock.recv(size - len(buffer))
+            if not chunk:
+                raise ConnectionError("推論サーバーとの接続が切断されました。")
+            buffer.extend(chunk)
+        return bytes(buffer)
+
+    def _request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            self._connect().sendall(_encode_message(message))
+            size, = _HEADER.unpack(self._recv_exactly(_HEADER.size))
+            response = json.loads(self._recv_exactly(size))
+        except OSError:
+            self.close()
+            raise
+        if 'error' in response:
+            raise RuntimeError(f"推論サーバーでエラーが発生しました: {response['error']}")
+        return response
+
+    def predict(self, features: Dict[str, float], model: str = 'default') -> float:
+        """
+        1行の特徴量（列名から値への辞書）を送り、予測値を返す。
+        """
+        return self._request({'model': model, 'features': features})['prediction']
+
+    def describe(self, model: str = 'default') -> RemoteModelInfo:
+        """
+        モデルの特徴量の名前と重要度を返す。
+        """
+        response = self._request({'op': 'describe', 'model': model})
+        return RemoteModelInfo(response['feature_names'], response['feature_importances'])
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="推論サーバー")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help='Unixソケットのパス')
+    parser.add_argument('--model', action='append', default=[], metavar='NAME=PATH',
+                        help='読み込むモデル（複数指定可）。省略時は default=models/simple_catboost_model.cbm')
+    parser.add_argument('--evaluator', choices=('catboost', 'numpy'), default='catboost',
+                        help='numpyの場合はCatBoostの対称木をNumPyで評価する（tree_evaluator.py）')
+    parser.add_argument('--max-batch-size', type=int, default=256, help='1回の予測にまとめる最大の行数')
+    parser.add_argument('--max-wait-ms', type=float, default=2.0, help='後続のリクエストを待つ最大の時間（ミリ秒）')
+    parser.add_argument('--benchmark', action='store_true', help='学習したダミーモデルで同時リクエストの遅延を計測する')
+    return parser.parse_args()
+
+
+def _registry(evaluator: str) -> ModelRegistry:
+    if evaluator == 'numpy':
+        from tree_evaluator import ObliviousTreeModel
+        return ModelRegistry(loader=ObliviousTreeModel.from_cbm_bytes)
+    return ModelRegistry()
+
+
+def _benchmark(args) -> None:
+    """
+    ダミーモデルを読み込んだサーバーを別スレッドで起動し、複数のクライアントから同時に予測を要求する。
+    """
+    import tempfile
+    import pandas as pd
+    from concurrent.futures import ThreadPoolExecutor
+    from catboost import CatBoostRegressor
+
+    root = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+    columns = [f'f{i}' for i in range(60)]
+    X = rng.normal(size=(5000, len(columns)))
+    model = CatBoostRegressor(iterations=500, depth=6, verbose=False, allow_writing_files=False)
+    model.fit(pd.DataFrame(X, columns=columns), X[:, 0] + rng.normal(size=5000))
+    path = os.path.join(root, 'model.cbm')
+    model.save_model(path)
+
+    registry = _registry(args.evaluator)
+    registry.register('default', path)
+    server = InferenceServer(registry, os.path.join(root, 'inference.sock'),
+                             max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    ready = threading.Event()
+    threading.Thread(target=lambda: asyncio.run(server.serve(ready)), daemon=True).start()
+    ready.wait()
+
+    rows = [dict(zip(columns, map(float, x))) for x in X[:200]]
+    expected = model.predict(X[:200].astype(np.float32))
+
+    def run_client(offset: int) -> Tuple[List[float], float]:
+        client = InferenceClient(server.socket_path)
+        latencies, error = [], 0.0
+        for i in range(100):
+            row = (offset + i) % len(rows)
+            start = time.perf_counter()
+            prediction = client.predict(rows[row])
+            latencies.append(time.perf_counter() - start)
+            error = max(error, abs(prediction - expected[row]))
+        client.close()
+        return latencies, error
+
+    for clients in (1, 8, 32):
+        server.batches = server.rows = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(clients) as pool:
+            results = list(pool.map(run_client, range(clients)))
+        elapsed = time.perf_counter() - start
+        latencies = np.concatenate([latency for latency, _ in results]) * 1000
+        print(f"クライアント{clients:>3}  {clients * 100 / elapsed:8.0f} 件/s  "
+              f"遅延 p50 {np.percentile(latencies, 50):6.2f} ms  p99 {np.percentile(latencies, 99):6.2f} ms  "
+              f"平均バッチ {server.rows / max(server.batches, 1):5.1f}行  最大差 {max(e for _, e in results):.1e}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_arguments()
+    if args.benchmark:
+        _benchmark(args)
+    else:
+        registry = _registry(args.evaluator)
+        models = args.model or [f"default={os.path.join('models', 'simple_catboost_model.cbm')}"]
+        for spec in models:
+            name, _, path = spec.partition('=')
+            registry.register(name, path)
+        asyncio.run(InferenceServer(registry, args.socket, args.max_batch_size, args.max_wait_ms).serve())
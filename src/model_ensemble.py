@@ -0,0 +1,211 @@
+# model_ensemble.py
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from model_registry import ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class EnsembleMember(NamedTuple):
+    """
+    アンサンブルに含めるモデル。name は ModelRegistry に登録した名前。
+    """
+    name: str
+    weight: float = 1.0
+
+
+class EnsemblePrediction(NamedTuple):
+    """
+    アンサンブルの予測値と、各モデルの予測値・所要時間。
+    """
+    value: float
+    predictions: Dict[str, float]
+    latencies_ms: Dict[str, float]   # 各モデルの予測にかかった時間（CPUの空き待ちを含む）
+    cpu_ms: Dict[str, float]         # 各モデルの予測で使ったCPU時間
+    total_ms: float
+
+
+class ModelEnsemble:
+    """
+    同じ特徴量の行に対して複数のモデルをスレッドプールで同時に予測し、1つの値にまとめるクラス。
+    CatBoostは予測中にGILを解放するため、モデルを増やしても判断までの時間はほぼ最も遅いモデルの時間で済む。
+
+    まとめ方は重みつき平均（デフォルト）、任意の関数、またはスタッキング（各モデルの予測値を特徴量とする
+    レジストリのモデル）から選べる。
+    """
+    def __init__(self, registry: ModelRegistry, members: List[EnsembleMember],
+                 combine: Optional[Callable[[Dict[str, float]], float]] = None,
+                 stacker: Optional[str] = None, max_workers: Optional[int] = None, latency_window: int = 1000,
+                 fill_columns: Optional[Callable[[Any], Iterable[str]]] = None):
+        """
+        :param combine: 各モデルの予測値（モデル名 -> 値）から最終的な値を返す関数
+        :param stacker: スタッキングに使うモデルのレジストリでの名前（特徴量名はメンバーのモデル名）
+        :param max_workers: 同時に予測するスレッド数（デフォルトはメンバーの数）
+        :param latency_window: 所要時間の集計に使う直近の回数
+        :param fill_columns: モデルを受け取り、行になくても0で埋めてよい特徴量（重要度で除いた特徴量）を返す関数。
+                             それ以外の特徴量が行にない場合は KeyError にする。
+        """
+        if not members:
+            raise ValueError("アンサンブルのモデルが指定されていません。")
+        if combine is not None and stacker is not None:
+            raise ValueError("combine と stacker は同時に指定できません。")
+        self.registry = registry
+        self.members = list(members)
+        self.combine = combine
+        self.stacker = stacker
+        self.fill_columns = fill_columns
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or len(self.members),
+                                            thread_name_prefix='ensemble')
+        self._latencies: Dict[str, Deque[float]] = {
+            name: deque(maxlen=latency_window) for name in [member.name for member in self.members] + ['total']
+        }
+        self._cpu: Dict[str, Deque[float]] = {member.name: deque(maxlen=latency_window) for member in self.members}
+        # (行の列の並び, モデルの特徴量) -> 行の中での位置
+        self._positions: Dict[Tuple, np.ndarray] = {}
+
+    def feature_names(self) -> List[str]:
+        """
+        メンバーのモデルが使う特徴量の和集合（最初に現れた順）。
+        """
+        names: List[str] = []
+        for member in self.members:
+            names.extend(name for name in self.registry.get(member.name).feature_names_ if name not in names)
+        return names
+
+    def _member_features(self, columns: pd.Index, values: np.ndarray, model: Any) -> np.ndarray:
+        """
+        行の値をモデルの特徴量の順に並べる。重要度で除いて計算しなかった特徴量は0で埋める（predict_and_save と同じ）。
+        DataFrameのまま渡すとCatBoostの変換がGILを持ったまま行われ、並列にならない。
+        """
+        feature_names = list(model.feature_names_)
+        # 読み込み直したモデルは重要度が変わるため、モデルごとに位置を確かめる
+        key = (tuple(columns), tuple(feature_names), id(model))
+        positions = self._positions.get(key)
+        if positions is None:
+            positions = columns.get_indexer(feature_names)
+            missing = {feature_names[i] for i in np.flatnonzero(positions < 0)}
+            unexpected = sorted(missing - set(self.fill_columns(model) if self.fill_columns is not None else ()))
+            if unexpected:
+                raise KeyError(f"モデルの特徴量が計算されていません: {unexpected}")
+            self._positions[key] = positions
+        X = values[:, positions]
+        X[:, positions < 0] = 0.0
+        return X
+
+    def _predict_member(self, name: str, columns: pd.Index, values: np.ndarray) -> Tuple[float, float, float]:
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        model = self.registry.get(name)
+        # モデルごとに1スレッドで予測し、モデル間で並列にする
+        X = self._member_features(columns, values, model)
+        value = float(model.predict(X, thread_count=1)[0])
+        return value, (time.perf_counter() - start) * 1000, (time.thread_time() - cpu_start) * 1000
+
+    def _combine(self, predictions: Dict[str, float]) -> float:
+        if self.combine is not None:
+            return float(self.combine(predictions))
+        if self.stacker is not None:
+            model = self.registry.get(self.stacker)
+            X = pd.DataFrame([predictions]).reindex(columns=model.feature_names_, fill_value=0.0)
+            return float(model.predict(X)[0])
+        weights = np.array([member.weight for member in self.members], dtype=np.float64)
+        values = np.array([predictions[member.name] for member in self.members], dtype=np.float64)
+        return float(np.dot(weights, values) / weights.sum())
+
+    def predict(self, row: pd.DataFrame) -> EnsemblePrediction:
+        """
+        1行の特徴量を全モデルで同時に予測し、まとめた値を返す。
+        """
+        start = time.perf_counter()
+        values = row.iloc[[-1]].to_numpy(dtype=np.float32)
+        futures = {member.name: self._executor.submit(self._predict_member, member.name, row.columns, values)
+                   for member in self.members}
+        predictions, latencies, cpu = {}, {}, {}
+        for name, future in futures.items():
+            predictions[name], latencies[name], cpu[name] = future.result()
+        value = self._combine(predictions)
+        total = (time.perf_counter() - start) * 1000
+
+        for name in predictions:
+            self._latencies[name].append(latencies[name])
+            self._cpu[name].append(cpu[name])
+        self._latencies['total'].append(total)
+        logger.debug(f"アンサンブルの予測 {value} (各モデル {predictions}, 所要時間 {latencies} ms, 合計 {total:.2f} ms)")
+        return EnsemblePrediction(value, predictions, latencies, cpu, total)
+
+    def latency_report(self) -> pd.DataFrame:
+        """
+        モデルごと（と全体）の直近の所要時間の統計（ミリ秒）を返す。cpu_mean はモデル自体の計算時間の平均。
+        """
+        rows = {}
+        for name, values in self._latencies.items():
+            if values:
+                array = np.fromiter(values, dtype=np.float64)
+                rows[name] = {'count': len(array), 'mean': array.mean(), 'p50': np.percentile(array, 50),
+                              'p95': np.percentile(array, 95), 'max': array.max(),
+                              'cpu_mean': np.mean(self._cpu[name]) if name in self._cpu else np.nan}
+        return pd.DataFrame.from_dict(rows, orient='index')
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+# 逐次に予測する場合との比較
+if __name__ == "__main__":
+    import os
+    import shutil
+    import tempfile
+    from catboost import CatBoostRegressor
+
+    rng = np.random.default_rng(0)
+    columns = [f'f{i}' for i in range(60)]
+    X = pd.DataFrame(rng.normal(size=(5000, len(columns))), columns=columns)
+    root = tempfile.mkdtemp()
+    try:
+        registry = ModelRegistry()
+        members = []
+        # 予測期間や目的変数の違うモデルを想定し、木の数と特徴量を変える
+        for i, iterations in enumerate((300, 1000, 2000, 500)):
+            used = columns[i * 10:i * 10 + 30]
+            model = CatBoostRegressor(iterations=iterations, depth=6, verbose=False, allow_writing_files=False)
+            model.fit(X[used], X[used[0]] + rng.normal(size=len(X)))
+            path = os.path.join(root, f'model_{i}.cbm')
+            model.save_model(path)
+            registry.register(f'model_{i}', path)
+            members.append(EnsembleMember(f'model_{i}', weight=1.0 + i))
+
+        ensemble = ModelEnsemble(registry, members)
+        row = X.iloc[[0]]
+        ensemble.predict(row)
+
+        repeat = 200
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for member in members:
+                model = registry.get(member.name)
+                expected = model.predict(row.reindex(columns=model.feature_names_, fill_value=0.0), thread_count=1)
+        sequential = (time.perf_counter() - start) / repeat * 1000
+        # 変換の差を除くため、配列で逐次に予測する場合とも比べる
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for member in members:
+                model = registry.get(member.name)
+                model.predict(row.reindex(columns=model.feature_names_, fill_value=0.0).to_numpy(np.float32),
+                              thread_count=1)
+        sequential_array = (time.perf_counter() - start) / repeat * 1000
+
+        for _ in range(repeat):
+            result = ensemble.predict(row)
+        print(f"CPU {os.cpu_count()}個  逐次 {sequential:.2f} ms  逐次(配列) {sequential_array:.2f} ms  並列 {ensemble.latency_report().loc['total', 'mean']:.2f} ms")
+        print(ensemble.latency_report().round(3))
+        print(f"予測値 {result.value:.6f}  各モデル {result.predictions}")
+        print(f"最後のモデルの逐次の予測との一致: {result.predictions[members[-1].name] == expected[0]}")
+        ensemble.close()
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,188 @@
+# model_registry.py
+import os
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from catboost import CatBoostRegressor
+
+logger = logging.getLogger(__name__)
+
+
+class ModelVersion(NamedTuple):
+    """
+    メモリ上に読み込んだモデルと、その元になったファイルの状態。
+    """
+    model: Any
+    path: str
+    mtime_ns: int
+    size: int
+    digest: str         # ファイルのsha256
+    loaded_at: float    # 読み込んだ時刻（UNIX時間）
+
+
+def load_catboost_model(blob: bytes) -> CatBoostRegressor:
+    """
+    .cbmファイルの内容からCatBoostRegressorを作る。
+    """
+    model = CatBoostRegressor()
+    model.load_model(blob=blob)
+    return model
+
+
+class ModelRegistry:
+    """
+    名前をつけた複数のモデルを1回だけ読み込んでメモリに保持するクラス。
+    get のたびに（check_interval 秒に1回まで）ファイルの更新時刻とサイズを確認し、
+    内容が変わっていれば新しいモデルを読み込んでから差し替える。読み込み中も古いモデルを返し続けるため、
+    トレードのループを止めずに再学習したモデルに切り替えられる。
+    """
+    def __init__(self, check_interval: float = 1.0, loader: Callable[[bytes], Any] = load_catboost_model):
+        """
+        :param check_interval: ファイルの更新を確認する間隔（秒）。0の場合は毎回確認する。
+        :param loader: ファイルの内容からモデルを作る関数
+        """
+        self.check_interval = check_interval
+        self.loader = loader
+        self._paths: Dict[str, str] = {}
+        self._loaders: Dict[str, Callable[[bytes], Any]] = {}
+        self._versions: Dict[str, ModelVersion] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, path: str, loader: Optional[Callable[[bytes], Any]] = None) -> None:
+        """
+        モデルのファイルを名前で登録する。読み込みは最初に get したときに行う。
+        登録済みの名前のパスや loader を変えた場合は、次の get で読み込み直す。
+        """
+        loader = loader or self.loader
+        with self._lock:
+            if self._paths.get(name) != path:
+                self._checked_at.pop(name, None)
+            if name in self._loaders and self._loaders[name] != loader:
+                # 読み込み方法が変わった場合は、ファイルが同じでも読み込み直す
+                self._versions.pop(name, None)
+            self._paths[name] = path
+            self._loaders[name] = loader
+
+    def names(self) -> List[str]:
+        return list(self._paths)
+
+    def get(self, name: str) -> Any:
+        """
+        登録したモデルを返す。ファイルが更新されていれば読み込み直す。
+        """
+        return self.version(name).model
+
+    def version(self, name: str) -> ModelVersion:
+        """
+        登録したモデルと、そのファイルの状態を返す。
+        """
+        if name not in self._paths:
+            raise KeyError(f"登録されていないモデルです: {name}")
+        current = self._versions.get(name)
+        checked_at = self._checked_at.get(name)
+        if current is None or checked_at is None or time.monotonic() - checked_at >= self.check_interval:
+            self.reload(name)
+            current = self._versions.get(name)
+        if current is None:
+            raise FileNotFoundError(f"モデルファイルが存在しません: {self._paths[name]}")
+        return current
+
+    def reload(self, name: str, force: bool = False) -> bool:
+        """
+        ファイルが変わっていればモデルを読み込み直して差し替える。差し替えた場合はTrueを返す。
+        読み込みに失敗した場合（書き込み途中のファイルなど）は古いモデルを使い続け、次の確認で再び試す。
+
+        :param force: ファイルが変わっていなくても読み込み直す
+        """
+        with self._lock:
+            path = self._paths[name]
+            current = self._versions.get(name)
+            self._checked_at[name] = time.monotonic()
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                if current is None:
+                    logger.error(f"モデルファイルが存在しません: {path}")
+                    raise FileNotFoundError(f"モデルファイルが存在しません: {path}")
+                logger.warning(f"モデルファイルが見つからないため、読み込み済みのモデルを使い続けます: {path}")
+                return False
+
+            if not force and current is not None and current.path == path \
+                    and (current.mtime_ns, current.size) == (stat.st_mtime_ns, stat.st_size):
+                return False
+
+            # ハッシュと読み込みに同じ内容を使い、確認と読み込みの間にファイルが変わっても食い違わないようにする
+            with open(path, 'rb') as f:
+                blob = f.read()
+            digest = hashlib.sha256(blob).hexdigest()
+            if not force and current is not None and current.path == path and current.digest == digest:
+                # 更新時刻だけが変わった場合は読み込み直さない
+                self._versions[name] = current._replace(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                return False
+
+            start = time.perf_counter()
+            try:
+                model = self._loaders[name](blob)
+            except Exception as e:
+                if current is None:
+                    raise
+                logger.warning(f"モデルの読み込みに失敗したため、読み込み済みのモデルを使い続けます: {path} {e}")
+                # 次の確認で再び読み込みを試す
+                self._versions[name] = current._replace(mtime_ns=-1)
+                return False
+            self._versions[name] = ModelVersion(model, path, stat.st_mtime_ns, stat.st_size, digest, time.time())
+            logger.info(f"モデル {name} を読み込みました: {path} (sha256 {digest[:12]}, "
+                        f"{(time.perf_counter() - start) * 1000:.1f} ms)")
+            return True
+
+
+# 毎回ファイルから読み込む場合との比較と、ファイルを更新したときの差し替えの確認
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+    import numpy as np
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    def train(path: str, seed: int) -> None:
+        rng = np.random.default_rng(seed)
+        X = rng.normal(size=(5000, 50))
+        y = X[:, 0] + rng.normal(size=5000)
+        model = CatBoostRegressor(iterations=1000, depth=6, random_seed=seed, verbose=False, allow_writing_files=False)
+        model.fit(X, y)
+        model.save_model(path)
+
+    root = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root, 'model.cbm')
+        train(path, seed=0)
+        row = np.zeros((1, 50))
+
+        repeat = 50
+        start = time.perf_counter()
+        for _ in range(repeat):
+            model = CatBoostRegressor()
+            model.load_model(path)
+            model.predict(row)
+        print(f"毎回読み込む場合     {(time.perf_counter() - start) / repeat * 1000:8.3f} ms/回")
+
+        registry = ModelRegistry(check_interval=0)
+        registry.register('default', path)
+        registry.get('default')
+        start = time.perf_counter()
+        for _ in range(repeat):
+            registry.get('default').predict(row)
+        print(f"レジストリを使う場合 {(time.perf_counter() - start) / repeat * 1000:8.3f} ms/回")
+
+        before = registry.version('default').digest
+        # 再学習したモデルを一時ファイルに書いてから置き換える
+        train(path + '.tmp', seed=1)
+        os.replace(path + '.tmp', path)
+        after = registry.version('default').digest
+        print(f"差し替え: {before[:12]} -> {after[:12]}")
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,258 @@
+# parameter_sweep.py
+import os
+import time
+import sqlite3
+import logging
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from backtest import BACKTEST_COLUMNS, GMO_CONFIG, BacktestConfig, backtest_arrays, run_strategy_backtest
+
+logger = logging.getLogger(__name__)
+
+# 探索するパラメータ（BacktestConfig のフィールド名）
+SWEEP_PARAMETERS = ('long_threshold', 'atr_ratio', 'equity_fraction')
+RESULTS_TABLE = 'sweep_results'
+# evaluator='event' で Strategy を動かすために共有する列（BACKTEST_COLUMNS と prediction に加える）
+EVENT_COLUMNS = ('Volume', 'RSI')
+# Strategy が固定で持つため、evaluator='event' では変えられないパラメータ
+STRATEGY_FIXED_PARAMETERS = ('long_threshold', 'atr_ratio', 'close_position', 'size_at_limit_price')
+
+
+def grid_space(**values: Sequence[float]) -> List[Dict[str, float]]:
+    """
+    パラメータごとの候補のすべての組み合わせを返す。
+    例: grid_space(long_threshold=[0.005, 0.01], atr_ratio=[0.2, 0.3])
+    """
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*values.values())]
+
+
+def random_space(ranges: Dict[str, Tuple[float, float]], n: int, seed: int = 0) -> List[Dict[str, float]]:
+    """
+    パラメータごとの [下限, 上限) から一様に n 組を選ぶ。
+    """
+    rng = np.random.default_rng(seed)
+    samples = {name: rng.uniform(low, high, size=n) for name, (low, high) in ranges.items()}
+    return [{name: float(samples[name][i]) for name in ranges} for i in range(n)]
+
+
+class SharedArraysSpec(NamedTuple):
+    """
+    ワーカーが共有メモリの配列を開くための情報。
+    """
+    name: str
+    columns: Tuple[str, ...]
+    length: int
+
+
+class SharedArrays:
+    """
+    同じ長さのfloat64の配列を1つの共有メモリに列ごとに並べて置くクラス。
+    ワーカーは spec から同じメモリを参照する配列を作るため、配列をコピーもpickleもしない。
+    """
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        lengths = {len(values) for values in arrays.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"配列の長さが揃っていません: {lengths}")
+        length = lengths.pop()
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, len(arrays) * length * 8))
+        self.spec = SharedArraysSpec(self._shm.name, tuple(arrays), length)
+        matrix = np.ndarray((len(arrays), length), dtype=np.float64, buffer=self._shm.buf)
+        for i, values in enumerate(arrays.values()):
+            matrix[i] = values
+        del matrix
+
+    @staticmethod
+    def attach(spec: SharedArraysSpec) -> Tuple[shared_memory.SharedMemory, Dict[str, np.ndarray]]:
+        """
+        spec の共有メモリを開き、列名 -> 配列（読み取り専用）を返す。共有メモリのオブジェクトは配列を使う間保持する。
+        """
+        shm = shared_memory.SharedMemory(name=spec.name)
+        matrix = np.ndarray((len(spec.columns), spec.length), dtype=np.float64, buffer=shm.buf)
+        matrix.flags.writeable = False
+        return shm, {name: matrix[i] for i, name in enumerate(spec.columns)}
+
+    def close(self) -> None:
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self) -> 'SharedArrays':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# ワーカーのプロセスで開いた共有メモリの配列
+_shared: Dict[str, np.ndarray] = {}
+_shm: Optional[shared_memory.SharedMemory] = None
+
+
+def _init_worker(spec: SharedArraysSpec) -> None:
+    global _shm, _shared
+    _shm, _shared = SharedArrays.attach(spec)
+
+
+def _strategy_frame() -> pd.DataFrame:
+    """
+    共有メモリの配列から run_strategy_backtest に渡す特徴量のDataFrameを作る。
+    """
+    index = pd.DatetimeIndex(_shared['timestamp'].astype(np.int64).astype('datetime64[ms]'), name='timestamp')
+    return pd.DataFrame({name: _shared[name] for name in (*BACKTEST_COLUMNS, *EVENT_COLUMNS)}, index=index)
+
+
+def _evaluate(params: Dict[str, float], base_config: BacktestConfig, evaluator: str = 'arrays') -> Dict[str, float]:
+    """
+    1組のパラメータでバックテストし、設定と結果を1行の辞書で返す。
+    """
+    config = base_config._replace(**params)
+    if evaluator == 'event':
+        result = run_strategy_backtest(_strategy_frame(), _shared['prediction'], config=config)
+        # イベント駆動のバックテストは売買の組を作らないため勝率はない
+        win_rate, trade_count = float('nan'), len(result.executions)
+    else:
+        result = backtest_arrays(*(_shared[name] for name in BACKTEST_COLUMNS), _shared['prediction'], config=config)
+        win_rate, trade_count = result.win_rate, len(result.trades)
+    pnl = float(result.equity.iloc[-1] - config.initial_balance) if len(result.equity) else 0.0
+    return {**config._asdict(), 'total_return': result.total_return, 'max_drawdown': result.max_drawdown,
+            'win_rate': win_rate, 'trade_count': trade_count, 'pnl': pnl}
+
+
+def run_sweep(frame: pd.DataFrame, space: Iterable[Dict[str, float]], base_config: BacktestConfig = GMO_CONFIG,
+              predictions: Optional[np.ndarray] = None, max_workers: Optional[int] = None,
+              db_path: Optional[str] = None, run_id: Optional[str] = None, batch_size: int = 100,
+              evaluator: str = 'arrays') -> pd.DataFrame:
+    """
+    space の各パラメータの組でバックテストをプロセスプールで並列に実行し、結果のDataFrameを返す。
+    価格・ATR・予測値は共有メモリに1回だけ置き、ワーカーはそれを参照する（特徴量も予測値も計算し直さない）。
+
+    :param frame: Open, High, Low, Close, ATR の列を持つ特徴量のDataFrame（load_backtest_frame の結果など）。
+                  evaluator='event' の場合は Volume と RSI の列も必要
+    :param space: BacktestConfig のフィールド名 -> 値 の辞書の列（grid_space, random_space）
+    :param predictions: 各足の予測値。Noneの場合は frame の 'prediction' 列
+    :param max_workers: プロセス数（デフォルトはCPUのコア数）
+    :param db_path: 指定した場合は結果をSQLiteの sweep_results テーブルに batch_size 行ずつ追記する
+    :param run_id: 結果を区別するためのID（デフォルトは開始時刻）
+    :param evaluator: 'arrays' は backtest_arrays（戦略の規則を配列で再現する）、'event' は run_strategy_backtest
+                      （Strategy のコードを MatchingEngine で動かす。遅く、閾値と atr_ratio は探索できない）で評価する
+    """
+    if evaluator not in ('arrays', 'event'):
+        raise ValueError(f"evaluator には 'arrays' または 'event' を指定してください: {evaluator}")
+    space = list(space)
+    unknown = {name for params in space for name in params} - set(BacktestConfig._fields)
+    if unknown:
+        raise ValueError(f"BacktestConfig にないパラメータです: {sorted(unknown)}")
+    if evaluator == 'event':
+        fixed = {name for params in space for name in params if name in STRATEGY_FIXED_PARAMETERS}
+        if fixed:
+            raise ValueError(f"evaluator='event' では Strategy が固定で持つパラメータは探索できません: {sorted(fixed)}")
+    if predictions is None:
+        predictions = frame['prediction'].to_numpy()
+    arrays = {name: frame[name].to_numpy(dtype=np.float64) for name in BACKTEST_COLUMNS}
+    arrays['prediction'] = np.asarray(predictions, dtype=np.float64)
+    if evaluator == 'event':
+        arrays.update({name: frame[name].to_numpy(dtype=np.float64) for name in EVENT_COLUMNS})
+        arrays['timestamp'] = frame.index.as_unit('ms').asi8.astype(np.float64)
+    run_id = run_id or time.strftime('%Y%m%d-%H%M%S')
+    max_workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(space) // (max_workers * 4))
+
+    rows: List[Dict[str, float]] = []
+    start = time.perf_counter()
+    with SharedArrays(arrays) as shared, \
+            ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(shared.spec,)) as pool:
+        pending = []
+        evaluate = partial(_evaluate, base_config=base_config, evaluator=evaluator)
+        for row in pool.map(evaluate, space, chunksize=chunksize):
+            rows.append(row)
+            pending.append(row)
+            if db_path is not None and len(pending) >= batch_size:
+                save_results(db_path, pd.DataFrame(pending), run_id)
+                pending = []
+        if db_path is not None and pending:
+            save_results(db_path, pd.DataFrame(pending), run_id)
+    logger.info(f"{len(space)}組のパラメータを{max_workers}プロセスで評価しました ({time.perf_counter() - start:.2f}s)")
+    return pd.DataFrame(rows, columns=list(BacktestConfig._fields) + ['total_return', 'max_drawdown', 'win_rate',
+                                                                      'trade_count', 'pnl'])
+
+
+def save_results(db_path: str, results: pd.DataFrame, run_id: str) -> None:
+    """
+    結果をSQLiteの sweep_results テーブルに追記する。
+    """
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with sqlite3.connect(db_path) as connection:
+        results.assign(run_id=run_id, created_at=time.strftime('%Y-%m-%d %H:%M:%S')) \
+            .to_sql(RESULTS_TABLE, connection, if_exists='append', index=False)
+
+
+def load_results(db_path: str, query: str = f'SELECT * FROM {RESULTS_TABLE}', params: Sequence = ()) -> pd.DataFrame:
+    """
+    SQLで結果を読み出す。
+    例: load_results(path, 'SELECT * FROM sweep_results WHERE max_drawdown < ? ORDER BY pnl DESC LIMIT 10', (0.2,))
+    """
+    with sqlite3.connect(db_path) as connection:
+        return pd.read_sql_query(query, connection, params=params)
+
+
+# 1つずつ評価する場合との比較
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    from catboost import CatBoostRegressor
+
+    from batch_predict import predict_frame
+    from calc_technical_indicators import calc_technical_indicators
+    from indicator_lookback import reference_prices
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 365 * 96
+    df = pd.DataFrame({name.capitalize(): values for name, values in reference_prices(n).items()},
+                      index=pd.date_range('2023-01-01', periods=n, freq='15min', name='timestamp'))
+    features = calc_technical_indicators(df)
+    target = features['Close'].pct_change(4).shift(-4).fillna(0.0) * 100
+    model = CatBoostRegressor(iterations=300, depth=6, verbose=False, allow_writing_files=False)
+    model.fit(features.iloc[:n // 4], target.iloc[:n // 4])
+    features['prediction'] = predict_frame(features, model=model)
+
+    space = grid_space(long_threshold=[0.0, 0.005, 0.01, 0.02, 0.05, 0.1],
+                       atr_ratio=[0.1, 0.2, 0.3, 0.5, 0.75, 0.95],
+                       equity_fraction=[0.3, 0.5, 0.7, 0.9, 1.0])
+
+    start = time.perf_counter()
+    columns = [features[name].to_numpy() for name in BACKTEST_COLUMNS]
+    sequential = [backtest_arrays(*columns, features['prediction'].to_numpy(), config=GMO_CONFIG._replace(**params))
+                  for params in space]
+    sequential_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as root:
+        db_path = os.path.join(root, 'sweep.sqlite')
+        start = time.perf_counter()
+        results = run_sweep(features, space, db_path=db_path)
+        parallel_time = time.perf_counter() - start
+        same = np.allclose(results['total_return'], [result.total_return for result in sequential])
+        print(f"{len(space)}組 × {len(features)}足  1つずつ {sequential_time:.2f}s  "
+              f"並列（{os.cpu_count()}コア） {parallel_time:.2f}s  結果の一致: {same}")
+        print(load_results(db_path, f'SELECT long_threshold, atr_ratio, equity_fraction, total_return, max_drawdown, '
+                                    f'trade_count FROM {RESULTS_TABLE} WHERE max_drawdown < ? '
+                                    f'ORDER BY total_return DESC LIMIT 5', (0.2,)))
+
+    # Strategy のコードを動かす評価との比較（1か月分）
+    month = features.iloc[:30 * 96]
+    event_space = grid_space(equity_fraction=[0.3, 0.7, 1.0])
+    start = time.perf_counter()
+    event_results = run_sweep(month, event_space, evaluator='event')
+    event_time = time.perf_counter() - start
+    array_results = run_sweep(month, event_space)
+    np.testing.assert_allclose(event_results['total_return'], array_results['total_return'], rtol=1e-9)
+    print(f"evaluator='event' {len(event_space)}組 × {len(month)}足 {event_time:.2f}s  evaluator='arrays' と一致しました")
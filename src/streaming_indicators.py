@@ -0,0 +1,1359 @@
+# streaming_indicators.py
+import math
+from collections import deque
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+NAN = float('nan')
+RAD2DEG = 180.0 / (4.0 * math.atan(1))
+DEG2RAD = 1.0 / RAD2DEG
+CONST_DEG2RAD_BY_360 = 8.0 * math.atan(1)
+
+# calc_technical_indicators と同じ列順
+FEATURE_COLUMNS = [
+    'BBANDS_upperband', 'BBANDS_middleband', 'BBANDS_lowerband', 'DEMA', 'EMA', 'HT_TRENDLINE', 'KAMA', 'MA',
+    'MIDPOINT', 'SMA', 'T3', 'TEMA', 'TRIMA', 'WMA', 'LINEARREG', 'LINEARREG_INTERCEPT',
+    'AD', 'ADOSC', 'APO', 'HT_PHASOR_inphase', 'HT_PHASOR_quadrature', 'LINEARREG_SLOPE',
+    'MACD_macd', 'MACD_macdsignal', 'MACD_macdhist', 'MINUS_DM', 'MOM', 'OBV', 'PLUS_DM', 'STDDEV', 'TRANGE',
+    'ADX', 'ADXR', 'AROON_aroondown', 'AROON_aroonup', 'AROONOSC', 'BOP', 'CCI', 'DX', 'MFI', 'MINUS_DI',
+    'PLUS_DI', 'RSI', 'STOCH_slowk', 'STOCH_slowd', 'STOCHF_fastk', 'STOCHF_fastd', 'STOCHRSI_fastk',
+    'STOCHRSI_fastd', 'TRIX', 'ULTOSC', 'WILLR', 'ATR', 'NATR', 'HT_DCPERIOD', 'HT_DCPHASE', 'HT_SINE_sine',
+    'HT_SINE_leadsine', 'HT_TRENDMODE', 'BETA', 'CORREL', 'LINEARREG_ANGLE',
+]
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+def _is_zero(value: float) -> bool:
+    return -0.00000001 < value < 0.00000001
+
+
+def _is_zero_or_neg(value: float) -> bool:
+    return value < 0.00000001
+
+
+# 以下の各クラスはTA-Libの計算手順を1本ずつの更新に置き換えたもの。
+# 先頭から同じ系列を与えれば、TA-Libを全期間に適用した結果と丸め誤差の範囲で同じ値になる。
+
+class _SMA:
+    def __init__(self, period: int):
+        self.period = period
+        self.window = deque(maxlen=period)
+        self.total = 0.0
+
+    def update(self, x: float) -> float:
+        self.total += x
+        self.window.append(x)
+        if len(self.window) < self.period:
+            return NAN
+        value = self.total / self.period
+        self.total -= self.window[0]
+        return value
+
+
+class _EMA:
+    """
+    最初のperiod本の単純平均を初期値とするEMA。最初のskip本の入力は無視する。
+    """
+    def __init__(self, period: int, skip: int = 0, t3_form: bool = False):
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self.skip = skip
+        self.t3_form = t3_form
+        self.count = 0
+        self.seed_total = 0.0
+        self.value: Optional[float] = None
+
+    def update(self, x: float) -> float:
+        if self.value is not None:
+            if self.t3_form:
+                self.value = (self.k * x) + ((1.0 - self.k) * self.value)
+            else:
+                self.value = ((x - self.value) * self.k) + self.value
+            return self.value
+        if self.skip > 0:
+            self.skip -= 1
+            return NAN
+        self.seed_total += x
+        self.count += 1
+        if self.count < self.period:
+            return NAN
+        self.value = self.seed_total / self.period
+        return self.value
+
+
+class _EMAChain:
+    """
+    EMAを多段に重ねたもの（DEMA, TEMA, T3, TRIX用）。各段の出力を返す。
+    """
+    def __init__(self, period: int, depth: int, t3_form: bool = False):
+        self.stages = [_EMA(period, t3_form=t3_form) for _ in range(depth)]
+
+    def update(self, x: float) -> List[float]:
+        values = []
+        for stage in self.stages:
+            if math.isnan(x):
+                values.append(NAN)
+                continue
+            x = stage.update(x)
+            values.append(x)
+        return values
+
+
+class _DEMA:
+    def __init__(self, period: int):
+        self.chain = _EMAChain(period, 2)
+
+    def update(self, x: float) -> float:
+        e1, e2 = self.chain.update(x)
+        return NAN if math.isnan(e2) else (2.0 * e1) - e2
+
+
+class _TEMA:
+    def __init__(self, period: int):
+        self.chain = _EMAChain(period, 3)
+
+    def update(self, x: float) -> float:
+        e1, e2, e3 = self.chain.update(x)
+        return NAN if math.isnan(e3) else e3 + ((3.0 * e1) - (3.0 * e2))
+
+
+class _T3:
+    def __init__(self, period: int, vfactor: float):
+        self.chain = _EMAChain(period, 6, t3_form=True)
+        temp = vfactor * vfactor
+        self.c1 = -temp * vfactor
+        self.c2 = 3.0 * (temp - self.c1)
+        self.c3 = -6.0 * temp - 3.0 * (vfactor - self.c1)
+        self.c4 = 1.0 + 3.0 * vfactor - self.c1 + 3.0 * temp
+
+    def update(self, x: float) -> float:
+        _, _, e3, e4, e5, e6 = self.chain.update(x)
+        if math.isnan(e6):
+            return NAN
+        return self.c1 * e6 + self.c2 * e5 + self.c3 * e4 + self.c4 * e3
+
+
+class _TRIX:
+    def __init__(self, period: int):
+        self.chain = _EMAChain(period, 3)
+        self.prev = NAN
+
+    def update(self, x: float) -> float:
+        e3 = self.chain.update(x)[-1]
+        prev, self.prev = self.prev, e3
+        if math.isnan(prev) or math.isnan(e3):
+            return NAN
+        return ((e3 / prev) - 1.0) * 100.0 if prev != 0.0 else 0.0
+
+
+class _WMA:
+    def __init__(self, period: int):
+        self.period = period
+        self.divider = (period * (period + 1)) >> 1
+        self.window = deque(maxlen=period)
+        self.period_sub = 0.0
+        self.period_sum = 0.0
+        self.trailing = 0.0
+
+    def update(self, x: float) -> float:
+        self.window.append(x)
+        n = len(self.window)
+        if n < self.period:
+            self.period_sub += x
+            self.period_sum += x * n
+            return NAN
+        self.period_sub += x
+        self.period_sub -= self.trailing
+        self.period_sum += x * self.period
+        self.trailing = self.window[0]
+        value = self.period_sum / self.divider
+        self.period_sum -= self.period_sub
+        return value
+
+
+class _TRIMA:
+    def __init__(self, period: int):
+        self.period = period
+        half = period // 2
+        if period % 2:
+            weights = list(range(1, half + 2)) + list(range(half, 0, -1))
+        else:
+            weights = list(range(1, half + 1)) + list(range(half, 0, -1))
+        self.weights = np.asarray(weights, dtype=np.float64) / sum(weights)
+        self.window = deque(maxlen=period)
+
+    def update(self, x: float) -> float:
+        self.window.append(x)
+        if len(self.window) < self.period:
+            return NAN
+        return float(np.dot(self.weights, self.window))
+
+
+class _KAMA:
+    def __init__(self, period: int):
+        self.period = period
+        self.const_max = 2.0 / (30.0 + 1.0)
+        self.const_diff = 2.0 / (2.0 + 1.0) - self.const_max
+        self.window = deque(maxlen=period + 1)
+        self.sum_roc = 0.0
+        self.prev_kama: Optional[float] = None
+
+    def update(self, x: float) -> float:
+        window = self.window
+        if len(window) < self.period:
+            if window:
+                self.sum_roc += abs(window[-1] - x)
+            window.append(x)
+            return NAN
+
+        if self.prev_kama is None:
+            self.sum_roc += abs(window[-1] - x)
+            self.prev_kama = window[-1]
+        else:
+            # 追加前の window は [x(t-period-1), ..., x(t-1)]
+            self.sum_roc -= abs(window[0] - window[1])
+            self.sum_roc += abs(x - window[-1])
+        trailing = window[0] if len(window) == self.period else window[1]
+        period_roc = x - trailing
+        window.append(x)
+
+        if (self.sum_roc <= period_roc) or _is_zero(self.sum_roc):
+            temp = 1.0
+        else:
+            temp = abs(period_roc / self.sum_roc)
+        temp = (temp * self.const_diff) + self.const_max
+        temp *= temp
+        self.prev_kama = ((x - self.prev_kama) * temp) + self.prev_kama
+        return self.prev_kama
+
+
+class _MIDPOINT:
+    def __init__(self, period: int):
+        self.period = period
+        self.window = deque(maxlen=period)
+
+    def update(self, x: float) -> float:
+        self.window.append(x)
+        if len(self.window) < self.period:
+            return NAN
+        return (max(self.window) + min(self.window)) / 2.0
+
+
+class _LINEARREG:
+    """
+    LINEARREG, LINEARREG_INTERCEPT, LINEARREG_SLOPE, LINEARREG_ANGLE をまとめて計算する。
+    """
+    def __init__(self, period: int):
+        self.period = period
+        self.sum_x = period * (period - 1) * 0.5
+        self.sum_x_sqr = period * (period - 1) * (2 * period - 1) // 6
+        self.divisor = self.sum_x * self.sum_x - period * self.sum_x_sqr
+        self.window = deque(maxlen=period)
+
+    def update(self, x: float) -> Dict[str, float]:
+        self.window.append(x)
+        if len(self.window) < self.period:
+            return {'value': NAN, 'intercept': NAN, 'slope': NAN, 'angle': NAN}
+        sum_xy = 0.0
+        sum_y = 0.0
+        for i, value in zip(range(self.period - 1, -1, -1), self.window):
+            sum_y += value
+            sum_xy += float(i) * value
+        m = (self.period * sum_xy - self.sum_x * sum_y) / self.divisor
+        b = (sum_y - m * self.sum_x) / float(self.period)
+        return {
+            'value': b + m * float(self.period - 1),
+            'intercept': b,
+            'slope': m,
+            'angle': math.atan(m) * (180.0 / 3.14159265358979323846),
+        }
+
+
+class _STDDEV:
+    """
+    分散は窓ごとに平均を引いてから計算する（価格の2乗の累積和は桁落ちするため）。
+    """
+    def __init__(self, period: int, nbdev: float):
+        self.period = period
+        self.window = deque(maxlen=period)
+        self.nbdev = nbdev
+
+    def update(self, x: float) -> float:
+        self.window.append(x)
+        if len(self.window) < self.period:
+            return NAN
+        return _window_stddev(self.window, math.fsum(self.window) / self.period) * self.nbdev
+
+
+def _window_stddev(window: deque, mean: float) -> float:
+    var = 0.0
+    for value in window:
+        var += (value - mean) * (value - mean)
+    var /= len(window)
+    return math.sqrt(var) if not _is_zero_or_neg(var) else 0.0
+
+
+class _BBANDS:
+    def __init__(self, period: int, nbdevup: float, nbdevdn: float):
+        self.sma = _SMA(period)
+        self.window = deque(maxlen=period)
+        self.nbdevup = nbdevup
+        self.nbdevdn = nbdevdn
+
+    def update(self, x: float):
+        middle = self.sma.update(x)
+        self.window.append(x)
+        if math.isnan(middle):
+            return NAN, NAN, NAN
+        stddev = _window_stddev(self.window, middle)
+        return middle + stddev * self.nbdevup, middle, middle - stddev * self.nbdevdn
+
+
+class _MACD:
+    def __init__(self, fast: int, slow: int, signal: int):
+        if slow < fast:
+            fast, slow = slow, fast
+        self.slow = _EMA(slow)
+        self.fast = _EMA(fast, skip=slow - fast)
+        self.signal = _EMA(signal)
+
+    def update(self, x: float):
+        slow = self.slow.update(x)
+        fast = self.fast.update(x)
+        if math.isnan(slow):
+            return NAN, NAN, NAN
+        macd = fast - slow
+        signal = self.signal.update(macd)
+        if math.isnan(signal):
+            return NAN, NAN, NAN
+        return macd, signal, macd - signal
+
+
+class _APO:
+    def __init__(self, fast: int, slow: int):
+        if slow < fast:
+            fast, slow = slow, fast
+        self.skip = slow - fast
+        self.fast = _SMA(fast)
+        self.slow = _SMA(slow)
+
+    def update(self, x: float) -> float:
+        slow = self.slow.update(x)
+        if self.skip > 0:
+            self.skip -= 1
+            return NAN
+        fast = self.fast.update(x)
+        return NAN if math.isnan(slow) else fast - slow
+
+
+class _MOM:
+    def __init__(self, period: int):
+        self.window = deque(maxlen=period + 1)
+
+    def update(self, x: float) -> float:
+        self.window.append(x)
+        if len(self.window) < self.window.maxlen:
+            return NAN
+        return x - self.window[0]
+
+
+class _AD:
+    def __init__(self):
+        self.ad = 0.0
+
+    def update(self, high: float, low: float, close: float, volume: float) -> float:
+        temp = high - low
+        if temp > 0.0:
+            self.ad += (((close - low) - (high - close)) / temp) * volume
+        return self.ad
+
+
+class _ADOSC:
+    def __init__(self, fast: int, slow: int):
+        self.fast_k = 2.0 / (fast + 1)
+        self.slow_k = 2.0 / (slow + 1)
+        self.lookback = max(fast, slow) - 1
+        self.ad = _AD()
+        self.fast_ema: Optional[float] = None
+        self.slow_ema: Optional[float] = None
+        self.count = 0
+
+    def update(self, high: float, low: float, close: float, volume: float) -> float:
+        ad = self.ad.update(high, low, close, volume)
+        self.count += 1
+        if self.fast_ema is None:
+            self.fast_ema = ad
+            self.slow_ema = ad
+        else:
+            self.fast_ema = (self.fast_k * ad) + ((1.0 - self.fast_k) * self.fast_ema)
+            self.slow_ema = (self.slow_k * ad) + ((1.0 - self.slow_k) * self.slow_ema)
+        if self.count <= self.lookback:
+            return NAN
+        return self.fast_ema - self.slow_ema
+
+
+class _OBV:
+    def __init__(self):
+        self.obv: Optional[float] = None
+        self.prev_close = 0.0
+
+    def update(self, close: float, volume: float) -> float:
+        if self.obv is None:
+            self.obv = volume
+        elif close > self.prev_close:
+            self.obv += volume
+        elif close < self.prev_close:
+            self.obv -= volume
+        self.prev_close = close
+        return self.obv
+
+
+def _true_range(high: float, low: float, prev_close: float) -> float:
+    greatest = high - low
+    val2 = abs(prev_close - high)
+    if val2 > greatest:
+        greatest = val2
+    val3 = abs(prev_close - low)
+    if val3 > greatest:
+        greatest = val3
+    return greatest
+
+
+class _TRANGE:
+    def __init__(self):
+        self.prev_close: Optional[float] = None
+
+    def update(self, high: float, low: float, close: float) -> float:
+        prev_close, self.prev_close = self.prev_close, close
+        if prev_close is None:
+            return NAN
+        return _true_range(high, low, prev_close)
+
+
+class _ATR:
+    """
+    ATRとNATRを計算する。
+    """
+    def __init__(self, period: int):
+        self.period = period
+        self.trange = _TRANGE()
+        self.seed = _SMA(period)
+        self.atr: Optional[float] = None
+
+    def update(self, high: float, low: float, close: float):
+        tr = self.trange.update(high, low, close)
+        if math.isnan(tr):
+            return NAN, NAN
+        if self.atr is None:
+            self.atr = self.seed.update(tr)
+            if math.isnan(self.atr):
+                self.atr = None
+                return NAN, NAN
+        else:
+            self.atr *= self.period - 1
+            self.atr += tr
+            self.atr /= self.period
+        natr = (self.atr / close) * 100.0 if not _is_zero(close) else 0.0
+        return self.atr, natr
+
+
+class _RSI:
+    def __init__(self, period: int):
+        self.period = period
+        self.prev_value: Optional[float] = None
+        self.prev_gain = 0.0
+        self.prev_loss = 0.0
+        self.count = 0
+
+    def update(self, x: float) -> float:
+        if self.prev_value is None:
+            self.prev_value = x
+            return NAN
+        diff = x - self.prev_value
+        self.prev_value = x
+        self.count += 1
+        if self.count > self.period:
+            self.prev_loss *= (self.period - 1)
+            self.prev_gain *= (self.period - 1)
+        if diff < 0:
+            self.prev_loss -= diff
+        else:
+            self.prev_gain += diff
+        if self.count < self.period:
+            return NAN
+        # period本目までは単純平均、以降はWilderの平滑化
+        self.prev_loss /= self.period
+        self.prev_gain /= self.period
+        total = self.prev_gain + self.prev_loss
+        return 100.0 * (self.prev_gain / total) if not _is_zero(total) else 0.0
+
+
+class _DM:
+    """
+    PLUS_DM, MINUS_DM を計算する。
+    """
+    def __init__(self, period: int):
+        self.period = period
+        self.prev_high: Optional[float] = None
+        self.prev_low = 0.0
+        self.plus_dm = 0.0
+        self.minus_dm = 0.0
+        self.count = 0
+
+    def update(self, high: float, low: float):
+        if self.prev_high is None:
+            self.prev_high, self.prev_low = high, low
+            return NAN, NAN
+        diff_p = high - self.prev_high
+        self.prev_high = high
+        diff_m = self.prev_low - low
+        self.prev_low = low
+        self.count += 1
+        if self.count < self.period:
+            if (diff_p > 0) and (diff_p > diff_m):
+                self.plus_dm += diff_p
+            if (diff_m > 0) and (diff_p < diff_m):
+                self.minus_dm += diff_m
+            if self.count < self.period - 1:
+                return NAN, NAN
+            return self.plus_dm, self.minus_dm
+        if (diff_p > 0) and (diff_p > diff_m):
+            self.plus_dm = self.plus_dm - (self.plus_dm / self.period) + diff_p
+        else:
+            self.plus_dm = self.plus_dm - (self.plus_dm / self.period)
+        if (diff_m > 0) and (diff_p < diff_m):
+            self.minus_dm = self.minus_dm - (self.minus_dm / self.period) + diff_m
+        else:
+            self.minus_dm = self.minus_dm - (self.minus_dm / self.period)
+        return self.plus_dm, self.minus_dm
+
+
+class _DirectionalMovement:
+    """
+    PLUS_DI, MINUS_DI, DX, ADX, ADXR をまとめて計算する。
+    """
+    def __init__(self, period: int):
+        self.period = period
+        self.prev_high: Optional[float] = None
+        self.prev_low = 0.0
+        self.prev_close = 0.0
+        self.plus_dm = 0.0
+        self.minus_dm = 0.0
+        self.tr = 0.0
+        self.count = 0
+        self.sum_dx = 0.0
+        self.adx: Optional[float] = None
+        self.prev_dx = 0.0
+        self.adx_history = deque(maxlen=period)
+
+    def update(self, high: float, low: float, close: float) -> Dict[str, float]:
+        result = {'PLUS_DI': NAN, 'MINUS_DI': NAN, 'DX': NAN, 'ADX': NAN, 'ADXR': NAN}
+        if self.prev_high is None:
+            self.prev_high, self.prev_low, self.prev_close = high, low, close
+            return result
+
+        diff_p = high - self.prev_high
+        self.prev_high = high
+        diff_m = self.prev_low - low
+        self.prev_low = low
+        self.count += 1
+        period = self.period
+
+        if self.count < period:
+            if (diff_m > 0) and (diff_p < diff_m):
+                self.minus_dm += diff_m
+            elif (diff_p > 0) and (diff_p > diff_m):
+                self.plus_dm += diff_p
+            self.tr += _true_range(high, low, self.prev_close)
+            self.prev_close = close
+            return result
+
+        self.minus_dm -= self.minus_dm / period
+        self.plus_dm -= self.plus_dm / period
+        if (diff_m > 0) and (diff_p < diff_m):
+            self.minus_dm += diff_m
+        elif (diff_p > 0) and (diff_p > diff_m):
+            self.plus_dm += diff_p
+        self.tr = self.tr - (self.tr / period) + _true_range(high, low, self.prev_close)
+        self.prev_close = close
+
+        # PLUS_DI / MINUS_DI
+        if _is_zero(self.tr):
+            plus_di = minus_di = 0.0
+        else:
+            minus_di = 100.0 * (self.minus_dm / self.tr)
+            plus_di = 100.0 * (self.plus_dm / self.tr)
+        result['PLUS_DI'], result['MINUS_DI'] = plus_di, minus_di
+
+        # DX
+        dx = None
+        if not _is_zero(self.tr):
+            temp = minus_di + plus_di
+            if not _is_zero(temp):
+                dx = 100.0 * (abs(minus_di - plus_di) / temp)
+        result['DX'] = dx if dx is not None else self.prev_dx
+        self.prev_dx = result['DX']
+
+        # ADX
+        n = self.count - period + 1
+        if n <= period:
+            if dx is not None:
+                self.sum_dx += dx
+            if n < period:
+                return result
+            self.adx = self.sum_dx / period
+        elif dx is not None:
+            self.adx = ((self.adx * (period - 1)) + dx) / period
+        result['ADX'] = self.adx
+
+        # ADXR
+        self.adx_history.append(self.adx)
+        if len(self.adx_history) == period:
+            result['ADXR'] = (self.adx + self.adx_history[0]) / 2.0
+        return result
+
+
+class _AROON:
+    def __init__(self, period: int):
+        self.period = period
+        self.factor = 100.0 / period
+        self.highs = deque(maxlen=period + 1)
+        self.lows = deque(maxlen=period + 1)
+
+    def update(self, high: float, low: float):
+        self.highs.append(high)
+        self.lows.append(low)
+        if len(self.highs) <= self.period:
+            return NAN, NAN, NAN
+        # 同値の場合は新しい方を採用する（TA-Libと同じ）
+        highest_idx = lowest_idx = 0
+        highest, lowest = self.highs[0], self.lows[0]
+        for i in range(1, self.period + 1):
+            if self.highs[i] >= highest:
+                highest, highest_idx = self.highs[i], i
+            if self.lows[i] <= lowest:
+                lowest, lowest_idx = self.lows[i], i
+        # 窓の先頭からの位置がそのまま (period - 経過本数) になる
+        down = self.factor * lowest_idx
+        up = self.factor * highest_idx
+        return down, up, self.factor * (highest_idx - lowest_idx)
+
+
+class _CCI:
+    def __init__(self, period: int):
+        self.period = period
+        self.buffer = [0.0] * period
+        self.index = 0
+        self.count = 0
+
+    def update(self, high: float, low: float, close: float) -> float:
+        last_value = (high + low + close) / 3
+        self.buffer[self.index] = last_value
+        self.index = (self.index + 1) % self.period
+        self.count += 1
+        if self.count < self.period:
+            return NAN
+        average = 0.0
+        for value in self.buffer:
+            average += value
+        average /= self.period
+        temp2 = 0.0
+        for value in self.buffer:
+            temp2 += abs(value - average)
+        temp = last_value - average
+        if (temp != 0.0) and (temp2 != 0.0):
+            return temp / (0.015 * (temp2 / self.period))
+        return 0.0
+
+
+class _MFI:
+    def __init__(self, period: int):
+        self.period = period
+        self.flows = deque(maxlen=period)
+        self.prev_value: Optional[float] = None
+        self.pos_sum = 0.0
+        self.neg_sum = 0.0
+
+    def update(self, high: float, low: float, close: float, volume: float) -> float:
+        typical = (high + low + close) / 3.0
+        if self.prev_value is None:
+            self.prev_value = typical
+            return NAN
+        if len(self.flows) == self.period:
+            positive, negative = self.flows[0]
+            self.pos_sum -= positive
+            self.neg_sum -= negative
+        diff = typical - self.prev_value
+        self.prev_value = typical
+        flow = typical * volume
+        if diff < 0:
+            self.flows.append((0.0, flow))
+            self.neg_sum += flow
+        elif diff > 0:
+            self.flows.append((flow, 0.0))
+            self.pos_sum += flow
+        else:
+            self.flows.append((0.0, 0.0))
+        if len(self.flows) < self.period:
+            return NAN
+        total = self.pos_sum + self.neg_sum
+        if total < 1.0:
+            return 0.0
+        return 100.0 * (self.pos_sum / total)
+
+
+class _FastK:
+    def __init__(self, period: int, flat_tolerance: float = 0.0):
+        self.period = period
+        self.flat_tolerance = flat_tolerance
+        self.highs = deque(maxlen=period)
+        self.lows = deque(maxlen=period)
+
+    def update(self, high: float, low: float, close: float) -> float:
+        self.highs.append(high)
+        self.lows.append(low)
+        if len(self.highs) < self.period:
+            return NAN
+        lowest = min(self.lows)
+        diff = (max(self.highs) - lowest) / 100.0
+        return (close - lowest) / diff if abs(diff) > self.flat_tolerance else 0.0
+
+
+class _STOCH:
+    def __init__(self, fastk_period: int, slowk_period: int, slowd_period: int):
+        self.fastk = _FastK(fastk_period)
+        self.slowk = _SMA(slowk_period)
+        self.slowd = _SMA(slowd_period)
+
+    def update(self, high: float, low: float, close: float):
+        fastk = self.fastk.update(high, low, close)
+        if math.isnan(fastk):
+            return NAN, NAN
+        slowk = self.slowk.update(fastk)
+        if math.isnan(slowk):
+            return NAN, NAN
+        slowd = self.slowd.update(slowk)
+        return (NAN, NAN) if math.isnan(slowd) else (slowk, slowd)
+
+
+class _STOCHF:
+    def __init__(self, fastk_period: int, fastd_period: int, flat_tolerance: float = 0.0):
+        self.fastk = _FastK(fastk_period, flat_tolerance)
+        self.fastd = _SMA(fastd_period)
+
+    def update(self, high: float, low: float, close: float):
+        fastk = self.fastk.update(high, low, close)
+        if math.isnan(fastk):
+            return NAN, NAN
+        fastd = self.fastd.update(fastk)
+        return (NAN, NAN) if math.isnan(fastd) else (fastk, fastd)
+
+
+class _STOCHRSI:
+    """
+    価格が横ばいの間はRSIが丸め誤差の範囲でしか動かず、TA-Libでも0と100のどちらになるかが
+    丸め方次第になる。RSIの振れ幅が1e-9未満の場合は横ばいとみなして0を返す。
+    """
+    def __init__(self, period: int, fastk_period: int, fastd_period: int):
+        self.rsi = _RSI(period)
+        self.stochf = _STOCHF(fastk_period, fastd_period, flat_tolerance=1e-11)
+
+    def update(self, x: float):
+        rsi = self.rsi.update(x)
+        if math.isnan(rsi):
+            return NAN, NAN
+        return self.stochf.update(rsi, rsi, rsi)
+
+
+class _ULTOSC:
+    def __init__(self, period1: int, period2: int, period3: int):
+        self.periods = sorted((period1, period2, period3))
+        self.prev_close: Optional[float] = None
+        self.window = deque(maxlen=self.periods[-1])
+        self.sums = [[0.0, 0.0] for _ in self.periods]
+        self.count = 0
+
+    def update(self, high: float, low: float, close: float) -> float:
+        prev_close, self.prev_close = self.prev_close, close
+        if prev_close is None:
+            return NAN
+        true_low = low if low < prev_close else prev_close
+        true_high = high if high > prev_close else prev_close
+        bp = close - true_low
+        tr = true_high - true_low
+        self.window.append((bp, tr))
+        self.count += 1
+        longest = self.periods[-1]
+        for sums, period in zip(self.sums, self.periods):
+            # 各期間の合計は最初の出力の窓から積み上げる
+            if self.count > longest - period:
+                sums[0] += bp
+                sums[1] += tr
+        if self.count < longest:
+            return NAN
+        output = 0.0
+        for weight, sums, period in zip((4.0, 2.0, 1.0), self.sums, self.periods):
+            if not _is_zero(sums[1]):
+                output += weight * (sums[0] / sums[1])
+            old_bp, old_tr = self.window[longest - period]
+            sums[0] -= old_bp
+            sums[1] -= old_tr
+        return 100.0 * (output / 7.0)
+
+
+class _WILLR:
+    def __init__(self, period: int):
+        self.period = period
+        self.highs = deque(maxlen=period)
+        self.lows = deque(maxlen=period)
+
+    def update(self, high: float, low: float, close: float) -> float:
+        self.highs.append(high)
+        self.lows.append(low)
+        if len(self.highs) < self.period:
+            return NAN
+        highest = max(self.highs)
+        diff = (highest - min(self.lows)) / (-100.0)
+        return (highest - close) / diff if diff != 0.0 else 0.0
+
+
+class _BOP:
+    @staticmethod
+    def update(open_: float, high: float, low: float, close: float) -> float:
+        temp = high - low
+        return 0.0 if _is_zero_or_neg(temp) else (close - open_) / temp
+
+
+class _BETA:
+    def __init__(self, period: int):
+        self.period = period
+        self.last_x: Optional[float] = None
+        self.last_y = 0.0
+        self.returns = deque(maxlen=period)
+        self.s_xx = self.s_x = self.s_xy = self.s_y = 0.0
+
+    def update(self, x_price: float, y_price: float) -> float:
+        if self.last_x is None:
+            self.last_x, self.last_y = x_price, y_price
+            return NAN
+        x = (x_price - self.last_x) / self.last_x if not _is_zero(self.last_x) else 0.0
+        self.last_x = x_price
+        y = (y_price - self.last_y) / self.last_y if not _is_zero(self.last_y) else 0.0
+        self.last_y = y_price
+        self.s_xx += x * x
+        self.s_x += x
+        self.s_xy += x * y
+        self.s_y += y
+        self.returns.append((x, y))
+        if len(self.returns) < self.period:
+            return NAN
+        n = float(self.period)
+        temp = (n * self.s_xx) - (self.s_x * self.s_x)
+        value = ((n * self.s_xy) - (self.s_x * self.s_y)) / temp if not _is_zero(temp) else 0.0
+        old_x, old_y = self.returns[0]
+        self.s_xx -= old_x * old_x
+        self.s_x -= old_x
+        self.s_xy -= old_x * old_y
+        self.s_y -= old_y
+        return value
+
+
+class _CORREL:
+    def __init__(self, period: int):
+        self.period = period
+        self.window = deque(maxlen=period)
+
+    def update(self, x: float, y: float) -> float:
+        self.window.append((x, y))
+        if len(self.window) < self.period:
+            return NAN
+        mean_x = math.fsum(v[0] for v in self.window) / self.period
+        mean_y = math.fsum(v[1] for v in self.window) / self.period
+        sxy = sxx = syy = 0.0
+        for vx, vy in self.window:
+            dx, dy = vx - mean_x, vy - mean_y
+            sxy += dx * dy
+            sxx += dx * dx
+            syy += dy * dy
+        temp = sxx * syy
+        if _is_zero_or_neg(temp):
+            return 0.0
+        return sxy / math.sqrt(temp)
+
+
+class _Hilbert:
+    """
+    TA-LibのHT_*で共通のヒルベルト変換。warm_up はTA-Lib内部の価格平滑化の初期ループ回数
+    （HT_DCPERIOD/HT_PHASOR は9、それ以外は34）。
+    """
+    A = 0.0962
+    B = 0.5769
+
+    def __init__(self, warm_up: int):
+        self.warm_up = warm_up
+        self.today = 0
+        self.prices = deque(maxlen=50)
+        self.wma_sub = 0.0
+        self.wma_sum = 0.0
+        self.trailing_wma = 0.0
+        self.hilbert_idx = 0
+        self.state = {name: {'Odd': [0.0, 0.0, 0.0], 'Even': [0.0, 0.0, 0.0],
+                             'prev_Odd': 0.0, 'prev_Even': 0.0,
+                             'prev_input_Odd': 0.0, 'prev_input_Even': 0.0}
+                      for name in ('detrender', 'Q1', 'jI', 'jQ')}
+        self.period = 0.0
+        self.smooth_period = 0.0
+        self.prev_i2 = self.prev_q2 = 0.0
+        self.re = self.im = 0.0
+        self.i1_for_odd_prev3 = self.i1_for_even_prev3 = 0.0
+        self.i1_for_odd_prev2 = self.i1_for_even_prev2 = 0.0
+        self.smooth_price = [0.0] * 50
+        self.smooth_price_idx = 0
+        self.in_phase = NAN
+        self.quadrature = NAN
+
+    def _price_wma(self, price: float) -> float:
+        self.wma_sub += price
+        self.wma_sub -= self.trailing_wma
+        self.wma_sum += price * 4.0
+        self.trailing_wma = self.prices[-4]
+        smoothed = self.wma_sum * 0.1
+        self.wma_sum -= self.wma_sub
+        return smoothed
+
+    def _transform(self, name: str, value: float, parity: str, adjusted_prev_period: float) -> float:
+        s = self.state[name]
+        temp = self.A * value
+        out = -s[parity][self.hilbert_idx]
+        s[parity][self.hilbert_idx] = temp
+        out += temp
+        out -= s['prev_' + parity]
+        s['prev_' + parity] = self.B * s['prev_input_' + parity]
+        out += s['prev_' + parity]
+        s['prev_input_' + parity] = value
+        out *= adjusted_prev_period
+        return out
+
+    def update(self, price: float) -> bool:
+        """
+        1本分を更新する。メインループに入っていればTrueを返す。
+        """
+        today = self.today
+        self.today += 1
+        self.prices.append(price)
+        if today < 3:
+            self.wma_sub += price
+            self.wma_sum += price * (today + 1)
+            return False
+        if today < 3 + self.warm_up:
+            self._price_wma(price)
+            return False
+
+        adjusted_prev_period = (0.075 * self.period) + 0.54
+        smoothed = self._price_wma(price)
+        self.smooth_price[self.smooth_price_idx] = smoothed
+
+        if today % 2 == 0:
+            detrender = self._transform('detrender', smoothed, 'Even', adjusted_prev_period)
+            q1 = self._transform('Q1', detrender, 'Even', adjusted_prev_period)
+            self.quadrature, self.in_phase = q1, self.i1_for_even_prev3
+            ji = self._transform('jI', self.i1_for_even_prev3, 'Even', adjusted_prev_period)
+            jq = self._transform('jQ', q1, 'Even', adjusted_prev_period)
+            self.hilbert_idx += 1
+            if self.hilbert_idx == 3:
+                self.hilbert_idx = 0
+            q2 = (0.2 * (q1 + ji)) + (0.8 * self.prev_q2)
+            i2 = (0.2 * (self.i1_for_even_prev3 - jq)) + (0.8 * self.prev_i2)
+            self.i1_for_odd_prev3 = self.i1_for_odd_prev2
+            self.i1_for_odd_prev2 = detrender
+        else:
+            detrender = self._transform('detrender', smoothed, 'Odd', adjusted_prev_period)
+            q1 = self._transform('Q1', detrender, 'Odd', adjusted_prev_period)
+            self.quadrature, self.in_phase = q1, self.i1_for_odd_prev3
+            ji = self._transform('jI', self.i1_for_odd_prev3, 'Odd', adjusted_prev_period)
+            jq = self._transform('jQ', q1, 'Odd', adjusted_prev_period)
+            q2 = (0.2 * (q1 + ji)) + (0.8 * self.prev_q2)
+            i2 = (0.2 * (self.i1_for_odd_prev3 - jq)) + (0.8 * self.prev_i2)
+            self.i1_for_even_prev3 = self.i1_for_even_prev2
+            self.i1_for_even_prev2 = detrender
+
+        self.re = (0.2 * ((i2 * self.prev_i2) + (q2 * self.prev_q2))) + (0.8 * self.re)
+        self.im = (0.2 * ((i2 * self.prev_q2) - (q2 * self.prev_i2))) + (0.8 * self.im)
+        self.prev_q2 = q2
+        self.prev_i2 = i2
+        temp = self.period
+        if (self.im != 0.0) and (self.re != 0.0):
+            self.period = 360.0 / (math.atan(self.im / self.re) * RAD2DEG)
+        temp2 = 1.5 * temp
+        if self.period > temp2:
+            self.period = temp2
+        temp2 = 0.67 * temp
+        if self.period < temp2:
+            self.period = temp2
+        if self.period < 6:
+            self.period = 6
+        elif self.period > 50:
+            self.period = 50
+        self.period = (0.2 * self.period) + (0.8 * temp)
+        self.smooth_period = (0.33 * self.period) + (0.67 * self.smooth_period)
+        return True
+
+    def advance_smooth_price(self) -> None:
+        self.smooth_price_idx += 1
+        if self.smooth_price_idx > 49:
+            self.smooth_price_idx = 0
+
+    def dc_phase(self, prev_phase: float) -> float:
+        dc_period_int = int(self.smooth_period + 0.5)
+        real_part = 0.0
+        imag_part = 0.0
+        idx = self.smooth_price_idx
+        for i in range(dc_period_int):
+            temp = (float(i) * CONST_DEG2RAD_BY_360) / float(dc_period_int)
+            temp2 = self.smooth_price[idx]
+            real_part += math.sin(temp) * temp2
+            imag_part += math.cos(temp) * temp2
+            idx = 49 if idx == 0 else idx - 1
+
+        phase = prev_phase
+        temp = abs(imag_part)
+        if temp > 0.0:
+            phase = math.atan(real_part / imag_part) * RAD2DEG
+        elif temp <= 0.01:
+            if real_part < 0.0:
+                phase -= 90.0
+            elif real_part > 0.0:
+                phase += 90.0
+        phase += 90.0
+        phase += 360.0 / self.smooth_period
+        if imag_part < 0.0:
+            phase += 180.0
+        if phase > 315.0:
+            phase -= 360.0
+        return phase
+
+    def trendline_average(self) -> float:
+        dc_period_int = int(self.smooth_period + 0.5)
+        temp = 0.0
+        for i in range(dc_period_int):
+            temp += self.prices[-1 - i]
+        if dc_period_int > 0:
+            temp = temp / float(dc_period_int)
+        return temp
+
+
+class _HTCycle:
+    """
+    HT_DCPERIOD と HT_PHASOR（出力開始は32本目）。
+    """
+    LOOKBACK = 32
+
+    def __init__(self):
+        self.core = _Hilbert(warm_up=9)
+
+    def update(self, x: float) -> Dict[str, float]:
+        active = self.core.update(x)
+        if active:
+            self.core.advance_smooth_price()
+        if not active or self.core.today <= self.LOOKBACK:
+            return {'HT_DCPERIOD': NAN, 'HT_PHASOR_inphase': NAN, 'HT_PHASOR_quadrature': NAN}
+        return {
+            'HT_DCPERIOD': self.core.smooth_period,
+            'HT_PHASOR_inphase': self.core.in_phase,
+            'HT_PHASOR_quadrature': self.core.quadrature,
+        }
+
+
+class _HTPhase:
+    """
+    HT_DCPHASE, HT_SINE, HT_TRENDLINE, HT_TRENDMODE（出力開始は63本目）。
+    """
+    LOOKBACK = 63
+
+    def __init__(self):
+        self.core = _Hilbert(warm_up=34)
+        self.dc_phase = 0.0
+        self.prev_dc_phase = 0.0
+        self.sine = 0.0
+        self.lead_sine = 0.0
+        self.itrend1 = self.itrend2 = self.itrend3 = 0.0
+        self.days_in_trend = 0
+
+    def update(self, x: float) -> Dict[str, float]:
+        result = {'HT_DCPHASE': NAN, 'HT_SINE_sine': NAN, 'HT_SINE_leadsine': NAN,
+                  'HT_TRENDLINE': NAN, 'HT_TRENDMODE': NAN}
+        core = self.core
+        if not core.update(x):
+            return result
+
+        self.prev_dc_phase = self.dc_phase
+        self.dc_phase = core.dc_phase(self.dc_phase)
+        prev_sine, prev_lead_sine = self.sine, self.lead_sine
+        self.sine = math.sin(self.dc_phase * DEG2RAD)
+        self.lead_sine = math.sin((self.dc_phase + 45) * DEG2RAD)
+
+        average = core.trendline_average()
+        trendline = (4.0 * average + 3.0 * self.itrend1 + 2.0 * self.itrend2 + self.itrend3) / 10.0
+        self.itrend3 = self.itrend2
+        self.itrend2 = self.itrend1
+        self.itrend1 = average
+
+        trend = 1
+        if ((self.sine > self.lead_sine) and (prev_sine <= prev_lead_sine)) or \
+                ((self.sine < self.lead_sine) and (prev_sine >= prev_lead_sine)):
+            self.days_in_trend = 0
+            trend = 0
+        self.days_in_trend += 1
+        if self.days_in_trend < (0.5 * core.smooth_period):
+            trend = 0
+        temp = self.dc_phase - self.prev_dc_phase
+        if (core.smooth_period != 0.0) and \
+                ((temp > (0.67 * 360.0 / core.smooth_period)) and (temp < (1.5 * 360.0 / core.smooth_period))):
+            trend = 0
+        temp = core.smooth_price[core.smooth_price_idx]
+        if (trendline != 0.0) and (abs((temp - trendline) / trendline) >= 0.015):
+            trend = 1
+        core.advance_smooth_price()
+
+        if core.today <= self.LOOKBACK:
+            return result
+        result.update({
+            'HT_DCPHASE': self.dc_phase,
+            'HT_SINE_sine': self.sine,
+            'HT_SINE_leadsine': self.lead_sine,
+            'HT_TRENDLINE': trendline,
+            'HT_TRENDMODE': float(trend),
+        })
+        return result
+
+
+class StreamingIndicatorEngine:
+    """
+    calc_technical_indicators と同じ特徴量を、ローソク足1本ごとの更新で計算するクラス。
+    各指標の途中状態を保持するため、1本あたりの計算量は履歴の長さによらない。
+    """
+    def __init__(self):
+        self.bbands = _BBANDS(5, 2, 2)
+        self.dema = _DEMA(30)
+        self.ema = _EMA(30)
+        self.kama = _KAMA(30)
+        self.ma = _SMA(30)
+        self.midpoint = _MIDPOINT(14)
+        self.sma = _SMA(30)
+        self.t3 = _T3(5, 0)
+        self.tema = _TEMA(30)
+        self.trima = _TRIMA(30)
+        self.wma = _WMA(30)
+        self.linearreg = _LINEARREG(14)
+        self.ad = _AD()
+        self.adosc = _ADOSC(3, 10)
+        self.apo = _APO(12, 26)
+        self.macd = _MACD(12, 26, 9)
+        self.dm = _DM(14)
+        self.mom = _MOM(10)
+        self.obv = _OBV()
+        self.stddev = _STDDEV(5, 1)
+        self.trange = _TRANGE()
+        self.directional = _DirectionalMovement(14)
+        self.aroon = _AROON(14)
+        self.cci = _CCI(14)
+        self.mfi = _MFI(14)
+        self.rsi = _RSI(14)
+        self.stoch = _STOCH(5, 3, 3)
+        self.stochf = _STOCHF(5, 3)
+        self.stochrsi = _STOCHRSI(14, 5, 3)
+        self.trix = _TRIX(30)
+        self.ultosc = _ULTOSC(7, 14, 28)
+        self.willr = _WILLR(14)
+        self.atr = _ATR(14)
+        self.ht_cycle = _HTCycle()
+        self.ht_phase = _HTPhase()
+        self.beta = _BETA(5)
+        self.correl = _CORREL(30)
+        self.last_index = None
+
+    def update(self, open_: float, high: float, low: float, close: float, volume: float) -> Dict[str, float]:
+        """
+        1本分の足で全指標を更新し、calc_technical_indicators と同じ列の値を返す。
+        ウォームアップ中の指標はNaNになる。
+        """
+        hilo = (high + low) / 2
+        row = {'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': volume}
+
+        upper, middle, lower = self.bbands.update(close)
+        row['BBANDS_upperband'] = (upper - hilo) / close
+        row['BBANDS_middleband'] = (middle - hilo) / close
+        row['BBANDS_lowerband'] = (lower - hilo) / close
+        row['DEMA'] = (self.dema.update(close) - hilo) / close
+        row['EMA'] = (self.ema.update(close) - hilo) / close
+        ht_phase = self.ht_phase.update(close)
+        row['HT_TRENDLINE'] = (ht_phase['HT_TRENDLINE'] - hilo) / close
+        row['KAMA'] = (self.kama.update(close) - hilo) / close
+        row['MA'] = (self.ma.update(close) - hilo) / close
+        row['MIDPOINT'] = (self.midpoint.update(close) - hilo) / close
+        row['SMA'] = (self.sma.update(close) - hilo) / close
+        row['T3'] = (self.t3.update(close) - hilo) / close
+        row['TEMA'] = (self.tema.update(close) - hilo) / close
+        row['TRIMA'] = (self.trima.update(close) - hilo) / close
+        row['WMA'] = (self.wma.update(close) - hilo) / close
+        linearreg = self.linearreg.update(close)
+        row['LINEARREG'] = (linearreg['value'] - close) / close
+        row['LINEARREG_INTERCEPT'] = (linearreg['intercept'] - close) / close
+
+        row['AD'] = self.ad.update(high, low, close, volume) / close
+        row['ADOSC'] = self.adosc.update(high, low, close, volume) / close
+        row['APO'] = self.apo.update(close) / close
+        ht_cycle = self.ht_cycle.update(close)
+        row['HT_PHASOR_inphase'] = ht_cycle['HT_PHASOR_inphase'] / close
+        row['HT_PHASOR_quadrature'] = ht_cycle['HT_PHASOR_quadrature'] / close
+        row['LINEARREG_SLOPE'] = linearreg['slope'] / close
+        macd, signal, hist = self.macd.update(close)
+        row['MACD_macd'] = macd / close
+        row['MACD_macdsignal'] = signal / close
+        row['MACD_macdhist'] = hist / close
+        plus_dm, minus_dm = self.dm.update(high, low)
+        row['MINUS_DM'] = minus_dm / close
+        row['MOM'] = self.mom.update(close) / close
+        row['OBV'] = self.obv.update(close, volume) / close
+        row['PLUS_DM'] = plus_dm / close
+        row['STDDEV'] = self.stddev.update(close) / close
+        row['TRANGE'] = self.trange.update(high, low, close) / close
+
+        directional = self.directional.update(high, low, close)
+        row['ADX'] = directional['ADX']
+        row['ADXR'] = directional['ADXR']
+        row['AROON_aroondown'], row['AROON_aroonup'], row['AROONOSC'] = self.aroon.update(high, low)
+        row['BOP'] = _BOP.update(open_, high, low, close)
+        row['CCI'] = self.cci.update(high, low, close)
+        row['DX'] = directional['DX']
+        row['MFI'] = self.mfi.update(high, low, close, volume)
+        row['MINUS_DI'] = directional['MINUS_DI']
+        row['PLUS_DI'] = directional['PLUS_DI']
+        row['RSI'] = self.rsi.update(close)
+        row['STOCH_slowk'], row['STOCH_slowd'] = self.stoch.update(high, low, close)
+        row['STOCHF_fastk'], row['STOCHF_fastd'] = self.stochf.update(high, low, close)
+        row['STOCHRSI_fastk'], row['STOCHRSI_fastd'] = self.stochrsi.update(close)
+        row['TRIX'] = self.trix.update(close)
+        row['ULTOSC'] = self.ultosc.update(high, low, close)
+        row['WILLR'] = self.willr.update(high, low, close)
+
+        row['ATR'], row['NATR'] = self.atr.update(high, low, close)
+
+        row['HT_DCPERIOD'] = ht_cycle['HT_DCPERIOD']
+        row['HT_DCPHASE'] = ht_phase['HT_DCPHASE']
+        row['HT_SINE_sine'] = ht_phase['HT_SINE_sine']
+        row['HT_SINE_leadsine'] = ht_phase['HT_SINE_leadsine']
+        row['HT_TRENDMODE'] = ht_phase['HT_TRENDMODE']
+
+        row['BETA'] = self.beta.update(high, low)
+        row['CORREL'] = self.correl.update(high, low)
+
+        row['LINEARREG_ANGLE'] = linearreg['angle']
+        return row
+
+    def update_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        まだ反映していない足（前回より新しいインデックス）だけを順に反映し、
+        calc_technical_indicators と同じ形式（NaNを含む行は除く）で返す。
+        """
+        if self.last_index is not None:
+            df = df[df.index > self.last_index]
+        if df.empty:
+            return pd.DataFrame(columns=OHLCV_COLUMNS + FEATURE_COLUMNS)
+
+        rows = [
+            self.update(o, h, l, c, v)
+            for o, h, l, c, v in df[OHLCV_COLUMNS].itertuples(index=False, name=None)
+        ]
+        self.last_index = df.index[-1]
+        result = pd.DataFrame(rows, index=df.index, columns=OHLCV_COLUMNS + FEATURE_COLUMNS)
+        return result.dropna()
+
+
+def assert_matches_batch(df: pd.DataFrame, warm: int = 300, tolerance: float = 1e-8) -> float:
+    """
+    df の最初の warm 本を update_frame で、残りを update_frame と update（1本ずつ）で別々のエンジンに流し、
+    すべての列が calc_technical_indicators（TA-Lib）の結果と一致し、update と update_frame の結果が同じであることを
+    確認する。列ごとの値の大きさに対する最大の相対誤差を返し、一致しない場合は AssertionError を送出する。
+    """
+    from calc_technical_indicators import calc_technical_indicators
+
+    columns = OHLCV_COLUMNS + FEATURE_COLUMNS
+    expected = calc_technical_indicators(df.copy())
+    assert list(expected.columns) == columns, f"calc_technical_indicators と列が異なります: {list(expected.columns)}"
+
+    engine = StreamingIndicatorEngine()
+    engine.update_frame(df.iloc[:warm])
+    streamed = engine.update_frame(df.iloc[warm:])
+    assert list(streamed.columns) == columns
+
+    engine = StreamingIndicatorEngine()
+    engine.update_frame(df.iloc[:warm])
+    rows = [engine.update(o, h, l, c, v)
+            for o, h, l, c, v in df.iloc[warm:][OHLCV_COLUMNS].itertuples(index=False, name=None)]
+    updated = pd.DataFrame(rows, index=df.index[warm:], columns=columns).dropna()
+    pd.testing.assert_frame_equal(updated, streamed, check_exact=True, check_freq=False)
+
+    expected = expected[expected.index >= df.index[warm]]
+    assert streamed.index.equals(expected.index), \
+        f"NaNを除いた行が一致しません: {len(streamed)}行 != {len(expected)}行"
+    worst = 0.0
+    mismatched = []
+    for column in columns:
+        a = expected[column].to_numpy(dtype=np.float64)
+        b = streamed[column].to_numpy(dtype=np.float64)
+        if column == 'LINEARREG_ANGLE':
+            # 角度は終値で割らない傾きのatanのため、価格の和の丸め誤差が傾き0付近で度の単位に拡大される。
+            # 傾きを終値で割った値（LINEARREG_SLOPE と同じ尺度）に戻して比較する
+            close = expected['Close'].to_numpy()
+            a, b = np.tan(a * DEG2RAD) / close, np.tan(b * DEG2RAD) / close
+        scale = max(float(np.max(np.abs(a))), 1e-12) if len(a) else 1.0
+        error = float(np.max(np.abs(a - b))) / scale if len(a) else 0.0
+        worst = max(worst, error)
+        if not error <= tolerance:
+            mismatched.append(f"{column} 相対誤差 {error:.3e}")
+    assert not mismatched, "TA-Libと一致しません: " + ", ".join(mismatched)
+    return worst
+
+
+# TA-Libとの一致確認と1本あたりの更新コスト
+if __name__ == "__main__":
+    import sys
+    import time
+    import os
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from calc_technical_indicators import calc_technical_indicators
+
+    rng = np.random.default_rng(0)
+    n = 2000
+    close = 4_000_000 + rng.normal(0, 5000, n).cumsum()
+    spread = np.abs(rng.normal(0, 3000, (n, 2)))
+    df = pd.DataFrame({
+        'Open': close + rng.normal(0, 1000, n),
+        'High': close + spread[:, 0],
+        'Low': close - spread[:, 1],
+        'Close': close,
+        'Volume': np.abs(rng.normal(1, 0.5, n)),
+    }, index=pd.date_range('2024-01-01', periods=n, freq='15min', tz='Asia/Tokyo'))
+    df['High'] = df[['Open', 'High', 'Close']].max(axis=1)
+    df['Low'] = df[['Open', 'Low', 'Close']].min(axis=1)
+
+    # 値幅も出来高もない足が続く区間（取引のない時間帯）
+    flat = df.copy()
+    flat.iloc[800:1000, :4] = flat['Close'].iloc[799]
+    flat.iloc[800:1000, 4] = 0.0
+    flat.iloc[1500:1510, 4] = 0.0
+
+    for name, frame in (('ランダムな足', df), ('値幅・出来高のない足を含む', flat)):
+        print(f"{name}: 最大相対誤差 {assert_matches_batch(frame):.3e}")
+
+    engine = StreamingIndicatorEngine()
+    warm = 300
+    engine.update_frame(df.iloc[:warm])
+    start = time.perf_counter()
+    streamed = engine.update_frame(df.iloc[warm:])
+    elapsed = time.perf_counter() - start
+    print(f"1本あたりの更新時間: {elapsed / len(streamed) * 1e6:.1f} us")
@@ -0,0 +1,323 @@
+# train_model.py
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostRegressor
+
+# curator をインポートできるようにリポジトリのルートをパスに追加する
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from curator.ohlcv_store import OhlcvStore
+from calc_technical_indicators import CUMULATIVE_COLUMNS, FEATURE_COLUMNS, FEATURE_FORMAT_VERSION, indicator_config_hash
+from feature_cache import FeatureCache
+
+logger = logging.getLogger(__name__)
+
+# 学習に使う特徴量の列。累積型の指標（AD, OBV）はキャッシュでは保存した全期間の累積になるが、
+# 推論では plan_lookback の本数の窓で計算するため水準が合わず、学習に使わない
+TRAIN_COLUMNS: Tuple[str, ...] = tuple(column for column in FEATURE_COLUMNS if column not in CUMULATIVE_COLUMNS)
+
+
+class TrainConfig(NamedTuple):
+    """
+    目的変数・ウォークフォワードの分割・CatBoostの設定。
+    """
+    horizon: int = 4                   # 何本先までのリターンを予測するか
+    target_scale: float = 100.0        # リターンに掛ける値（100の場合は%）
+    n_folds: int = 5
+    test_bars: int = 96 * 30           # 1つのフォールドの検証期間の本数
+    train_bars: Optional[int] = None   # 学習期間の本数（Noneの場合は先頭からすべて）
+    iterations: int = 1000
+    depth: int = 6
+    learning_rate: float = 0.05
+    random_seed: int = 0
+    chunk_bars: int = 50_000           # 特徴量を一度に計算する本数
+
+
+class Fold(NamedTuple):
+    """
+    ウォークフォワードの1つの分割。時刻はUNIXミリ秒で、終わりは含まない。
+    学習期間の終わりと検証期間の始まりの間は horizon 本空け、目的変数が検証期間と重ならないようにする。
+    """
+    number: int
+    train_start: int
+    train_end: int
+    test_start: int
+    test_end: int
+
+
+class _Source(NamedTuple):
+    # ワーカーがデータを開くための情報（配列そのものは渡さない）
+    store_dir: str
+    feature_dir: str
+    symbol: str
+    timeframe: str
+    columns: Tuple[str, ...]
+
+
+def update_features(store: OhlcvStore, cache: FeatureCache, symbol: str, timeframe: str,
+                    start, end, chunk_bars: int = 50_000) -> pd.DataFrame:
+    """
+    保存済みのOHLCVの特徴量を chunk_bars 本ずつキャッシュに追記し、OHLCVを返す。
+    2回目以降はキャッシュにない新しい足だけを計算する。
+    """
+    ohlcv = store.read_range(symbol, timeframe, start, end)
+    if ohlcv.empty:
+        raise ValueError(f"{symbol} {timeframe} のOHLCVが保存されていません: {store.root_dir}")
+    for chunk_end in range(min(chunk_bars, len(ohlcv)), len(ohlcv) + chunk_bars, chunk_bars):
+        chunk_end = min(chunk_end, len(ohlcv))
+        # 追記する足の前に指標のウォームアップに必要な本数を含める
+        chunk_start = max(0, chunk_end - chunk_bars - cache.warmup_bars)
+        cache.update(symbol, timeframe, ohlcv.iloc[chunk_start:chunk_end])
+        if chunk_end == len(ohlcv):
+            break
+    return ohlcv
+
+
+def make_targets(close: np.ndarray, horizon: int, scale: float = 100.0) -> np.ndarray:
+    """
+    horizon 本先の終値までのリターンを返す。最後の horizon 本はNaN。
+    """
+    target = np.full(len(close), np.nan)
+    target[:-horizon] = (close[horizon:] / close[:-horizon] - 1) * scale
+    return target
+
+
+def make_folds(timestamps: np.ndarray, config: TrainConfig) -> List[Fold]:
+    """
+    目的変数のある足の時刻から、新しい方へ進むウォークフォワードの分割を作る。
+    最後のフォールドの検証期間が最新の足で終わる。
+    """
+    n = len(timestamps)
+    folds = []
+    for number in range(config.n_folds):
+        test_end = n - (config.n_folds - 1 - number) * config.test_bars
+        test_start = test_end - config.test_bars
+        train_end = test_start - config.horizon
+        train_start = 0 if config.train_bars is None else max(0, train_end - config.train_bars)
+        if train_end - train_start < config.test_bars:
+            logger.warning(f"フォールド{number}は学習に使える足が少ないため除きます（{max(0, train_end - train_start)}本）。")
+            continue
+        end = int(timestamps[test_end]) if test_end < n else int(timestamps[-1]) + 1
+        folds.append(Fold(number, int(timestamps[train_start]), int(timestamps[train_end]),
+                          int(timestamps[test_start]), end))
+    if not folds:
+        raise ValueError(f"ウォークフォワードの分割を作れません（目的変数のある足が{n}本）。")
+    return folds
+
+
+def _load_rows(source: _Source, start: int, end: int, config: TrainConfig) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    [start, end) の特徴量（float32）と目的変数を読み込む。目的変数のため end の後の horizon 本も読む。
+    """
+    store = OhlcvStore(source.store_dir)
+    cache = FeatureCache(source.feature_dir)
+    interval = pd.Timedelta(source.timeframe.replace('m', 'min') if source.timeframe.endswith('m') else source.timeframe)
+    extended_end = end + int(interval.total_seconds() * 1000) * (config.horizon + 1)
+    ohlcv = store.read_range(source.symbol, source.timeframe, start, extended_end)
+    target = pd.Series(make_targets(ohlcv['Close'].to_numpy(), config.horizon, config.target_scale), index=ohlcv.index)
+    ohlcv = ohlcv.loc[ohlcv.index < pd.Timestamp(end, unit='ms')]
+    features = cache.read(source.symbol, source.timeframe, ohlcv, columns=source.columns, dtype=np.float32)
+    y = target.reindex(features.index).to_numpy()
+    valid = ~np.isnan(y)
+    return features.loc[valid, list(source.columns)], y[valid]
+
+
+def _fit(X: pd.DataFrame, y: np.ndarray, config: TrainConfig, thread_count: int) -> CatBoostRegressor:
+    model = CatBoostRegressor(iterations=config.iterations, depth=config.depth, learning_rate=config.learning_rate,
+                              random_seed=config.random_seed, thread_count=thread_count,
+                              verbose=False, allow_writing_files=False)
+    model.fit(X, y)
+    return model
+
+
+def _train_fold(fold: Fold, source: _Source, config: TrainConfig, thread_count: int) -> Dict[str, Any]:
+    """
+    1つのフォールドを学習して検証期間の指標を返す（ワーカーのプロセスで実行する）。
+    メモリに載るのはこのフォールドの期間の特徴量だけ。
+    """
+    start = time.perf_counter()
+    X_train, y_train = _load_rows(source, fold.train_start, fold.train_end, config)
+    X_test, y_test = _load_rows(source, fold.test_start, fold.test_end, config)
+    model = _fit(X_train, y_train, config, thread_count)
+    predictions = model.predict(X_test, thread_count=thread_count)
+    return {
+        **fold._asdict(),
+        'train_rows': len(y_train),
+        'test_rows': len(y_test),
+        'rmse': float(np.sqrt(np.mean((predictions - y_test) ** 2))),
+        'ic': float(np.corrcoef(predictions, y_test)[0, 1]) if len(y_test) > 1 else float('nan'),
+        'hit_rate': float(np.mean(np.sign(predictions) == np.sign(y_test))),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def latest_metadata(models_dir: str) -> Optional[Dict[str, Any]]:
+    """
+    最も新しいバージョンのメタデータを返す。
+    """
+    paths = sorted(glob.glob(os.path.join(models_dir, 'versions', '*.json')))
+    if not paths:
+        return None
+    with open(paths[-1]) as f:
+        return json.load(f)
+
+
+def train_walk_forward(store_dir: str, feature_dir: str, models_dir: str, symbol: str, timeframe: str,
+                       config: TrainConfig = TrainConfig(), start=0, end=None, max_workers: Optional[int] = None,
+                       promote_to: Optional[str] = None, force: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    保存済みのOHLCVからウォークフォワードの検証と最新期間での学習を行い、
+    models_dir/versions/<バージョン>.cbm と、特徴量の列と検証結果を書いた <バージョン>.json を保存する。
+
+    :param max_workers: フォールドを並列に学習するプロセス数（デフォルトはCPUのコア数とフォールド数の小さい方）
+    :param promote_to: 指定した場合は学習したモデルをこのパスに置き換える（ModelRegistry が読み込み直す）
+    :param force: 前回の学習から新しい足がなくても学習する
+    :return: 保存したメタデータ。新しい足がなく学習しなかった場合はNone。
+    """
+    store = OhlcvStore(store_dir)
+    end = end if end is not None else (store.last_timestamp(symbol, timeframe) or 0) + 1
+    previous = latest_metadata(models_dir)
+    if not force and previous is not None and previous.get('data_end') == end - 1 \
+            and previous.get('symbol') == symbol and previous.get('timeframe') == timeframe:
+        logger.info(f"前回の学習（{previous['version']}）から新しい足がないため学習しません。")
+        return None
+
+    started = time.perf_counter()
+    cache = FeatureCache(feature_dir)
+    ohlcv = update_features(store, cache, symbol, timeframe, start, end, config.chunk_bars)
+    logger.info(f"特徴量を更新しました（{len(ohlcv)}本, {time.perf_counter() - started:.1f}s）")
+
+    # 目的変数があり、特徴量がキャッシュされている足の時刻
+    cached = cache.read(symbol, timeframe, ohlcv, columns=[]).index
+    target = pd.Series(make_targets(ohlcv['Close'].to_numpy(), config.horizon), index=ohlcv.index)
+    usable = cached[~np.isnan(target.reindex(cached).to_numpy())]
+    timestamps = usable.as_unit('ms').asi8
+    folds = make_folds(timestamps, config)
+
+    source = _Source(store_dir, feature_dir, symbol, timeframe, TRAIN_COLUMNS)
+    cpu_count = os.cpu_count() or 1
+    max_workers = max_workers or min(cpu_count, len(folds))
+    thread_count = max(1, cpu_count // max_workers)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(_train_fold, fold, source, config, thread_count) for fold in folds]
+        fold_results = [future.result() for future in futures]
+    for result in fold_results:
+        logger.info(f"フォールド{result['number']}: 学習{result['train_rows']}本 検証{result['test_rows']}本 "
+                    f"RMSE {result['rmse']:.4f} IC {result['ic']:.4f} 的中率 {result['hit_rate']:.3f} "
+                    f"({result['seconds']:.1f}s)")
+
+    # 最新の期間で本番用のモデルを学習する
+    train_start = 0 if config.train_bars is None else max(0, len(timestamps) - config.train_bars)
+    X, y = _load_rows(source, int(timestamps[train_start]), int(timestamps[-1]) + 1, config)
+    model = _fit(X, y, config, thread_count=-1)
+
+    version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    versions_dir = os.path.join(models_dir, 'versions')
+    os.makedirs(versions_dir, exist_ok=True)
+    model_path = os.path.join(versions_dir, f'{version}.cbm')
+    model.save_model(model_path)
+    metadata = {
+        'version': version,
+        'symbol': symbol,
+        'timeframe': timeframe,
+        'data_start': int(timestamps[train_start]),
+        'data_end': end - 1,
+        'train_rows': len(y),
+        'feature_columns': list(model.feature_names_),
+        'indicator_config_hash': indicator_config_hash(),
+        'feature_format_version': FEATURE_FORMAT_VERSION,
+        'config': config._asdict(),
+        'folds': fold_results,
+        'mean_ic': float(np.nanmean([result['ic'] for result in fold_results])),
+        'seconds': time.perf_counter() - started,
+    }
+    with open(os.path.join(versions_dir, f'{version}.json'), 'w') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    logger.info(f"モデルを保存しました: {model_path} (平均IC {metadata['mean_ic']:.4f}, {metadata['seconds']:.1f}s)")
+
+    if promote_to is not None:
+        # 読み込み中のプロセスが途中までのファイルを読まないよう、一時ファイルに書いてから置き換える
+        tmp_path = promote_to + '.tmp'
+        shutil.copyfile(model_path, tmp_path)
+        os.replace(tmp_path, promote_to)
+        logger.info(f"{promote_to} を {version} に置き換えました。")
+    return metadata
+
+
+def parse_arguments() -> argparse.Namespace:
+    defaults = TrainConfig()
+    parser = argparse.ArgumentParser(description="保存済みのOHLCVからCatBoostのモデルをウォークフォワードで学習する")
+    parser.add_argument('--store', default='strage/ohlcv', help='OhlcvStore のディレクトリ')
+    parser.add_argument('--features', default='strage/features', help='FeatureCache のディレクトリ')
+    parser.add_argument('--models', default='models', help='モデルを保存するディレクトリ')
+    parser.add_argument('--symbol', default='BTC/USDT')
+    parser.add_argument('--timeframe', default='15m')
+    parser.add_argument('--start', default=None, help='学習に使う最初の日時（省略時は保存済みのすべて）')
+    parser.add_argument('--folds', type=int, default=defaults.n_folds)
+    parser.add_argument('--test-bars', type=int, default=defaults.test_bars)
+    parser.add_argument('--train-bars', type=int, default=None)
+    parser.add_argument('--horizon', type=int, default=defaults.horizon)
+    parser.add_argument('--iterations', type=int, default=defaults.iterations)
+    parser.add_argument('--depth', type=int, default=defaults.depth)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--promote', default=None,
+                        help='学習したモデルで置き換えるファイル（例: models/simple_catboost_model.cbm）')
+    parser.add_argument('--force', action='store_true', help='新しい足がなくても学習する')
+    parser.add_argument('--benchmark', action='store_true', help='合成データで学習の所要時間を測る')
+    return parser.parse_args()
+
+
+# 毎晩の再学習の例（cron）:
+#   10 0 * * * cd /path/to/TradeBotManager && python src/train_model.py --promote models/simple_catboost_model.cbm
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_arguments()
+    config = TrainConfig(horizon=args.horizon, n_folds=args.folds, test_bars=args.test_bars,
+                         train_bars=args.train_bars, iterations=args.iterations, depth=args.depth)
+
+    if args.benchmark:
+        import resource
+        import tempfile
+        from indicator_lookback import reference_prices
+
+        n = 2 * 365 * 96
+        df = pd.DataFrame({name.capitalize(): values for name, values in reference_prices(n).items()},
+                          index=pd.date_range('2023-01-01', periods=n, freq='15min', name='timestamp'))
+        with tempfile.TemporaryDirectory() as root:
+            OhlcvStore(os.path.join(root, 'ohlcv')).append(args.symbol, args.timeframe, df)
+            config = config._replace(iterations=min(config.iterations, 300))
+            kwargs = dict(store_dir=os.path.join(root, 'ohlcv'), feature_dir=os.path.join(root, 'features'),
+                          models_dir=os.path.join(root, 'models'), symbol=args.symbol, timeframe=args.timeframe,
+                          config=config, max_workers=args.workers,
+                          promote_to=os.path.join(root, 'models', 'simple_catboost_model.cbm'))
+            start = time.perf_counter()
+            metadata = train_walk_forward(**kwargs)
+            print(f"{n}本・{len(metadata['folds'])}フォールド: {time.perf_counter() - start:.1f}s  "
+                  f"最大RSS 親 {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB "
+                  f"ワーカー {resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.0f} MB")
+            # 新しい足がない場合は学習しない
+            start = time.perf_counter()
+            skipped = train_walk_forward(**kwargs)
+            print(f"新しい足がない場合: {'学習しない' if skipped is None else '学習した'} ({time.perf_counter() - start:.2f}s)")
+            # 1日分の足を追加して再学習する（特徴量は追加分だけ計算する）
+            extra = pd.DataFrame({name.capitalize(): values for name, values in reference_prices(n + 96).items()},
+                                 index=pd.date_range('2023-01-01', periods=n + 96, freq='15min', name='timestamp'))
+            OhlcvStore(os.path.join(root, 'ohlcv')).append(args.symbol, args.timeframe, extra.iloc[n:])
+            start = time.perf_counter()
+            train_walk_forward(**kwargs)
+            print(f"1日分追加して再学習: {time.perf_counter() - start:.1f}s")
+    else:
+        train_walk_forward(args.store, args.features, args.models, args.symbol, args.timeframe, config,
+                           start=args.start or 0, max_workers=args.workers, promote_to=args.promote, force=args.force)
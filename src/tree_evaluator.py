@@ -0,0 +1,275 @@
+# tree_evaluator.py
+import io
+import os
+import json
+import tempfile
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+# この行数以下はすべての木の分岐を1回の配列演算で比較する（1行の予測向け）
+_SMALL_BATCH_ROWS = 64
+# それより多い行は、この行数ずつ木を1本ずつ評価する（(行, 木, 深さ) の中間配列を作らない）
+_BLOCK_ROWS = 65_536
+
+
+class ObliviousTreeModel:
+    """
+    CatBoostの対称木(oblivious tree)をNumPyの配列だけで評価するモデル。
+    CatBoostRegressor の predict / feature_names_ / get_feature_importance と同じ名前で使え、予測値も一致する。
+
+    各木の深さ d の分岐は (特徴量, 閾値) の組で、特徴量が閾値を超えるかどうかの d ビットで葉を選ぶ。
+    """
+    def __init__(self, split_features: np.ndarray, split_borders: np.ndarray, leaf_values: np.ndarray,
+                 scale: float, bias: float, feature_names: List[str], nan_as_true: np.ndarray,
+                 feature_importances: Optional[np.ndarray] = None):
+        """
+        :param split_features: (木の数, 深さ) 各分岐で比べる特徴量の列番号
+        :param split_borders: (木の数, 深さ) 各分岐の閾値（float32）
+        :param leaf_values: (木の数, 2**深さ) 葉の値
+        :param nan_as_true: (特徴量の数,) NaNを閾値より大きいとみなす特徴量
+        """
+        self.split_features = np.ascontiguousarray(split_features, dtype=np.int32)
+        self.split_borders = np.ascontiguousarray(split_borders, dtype=np.float32)
+        self.leaf_values = np.ascontiguousarray(leaf_values, dtype=np.float64)
+        self.scale = float(scale)
+        self.bias = float(bias)
+        self.feature_names_ = list(feature_names)
+        self.nan_as_true = np.asarray(nan_as_true, dtype=bool)
+        self.feature_importances = feature_importances
+        depth = self.split_features.shape[1]
+        self._bit_weights = (1 << np.arange(depth)).astype(np.int64)
+        self._tree_offsets = np.arange(len(self.leaf_values), dtype=np.int64) * self.leaf_values.shape[1]
+        self._flat_features = self.split_features.ravel()
+        self._flat_borders = self.split_borders.ravel()
+        self._flat_leaves = self.leaf_values.ravel()
+        # DataFrameの列の並び -> モデルの特徴量の位置（毎回の get_indexer を省く）
+        self._positions = {}
+
+    @classmethod
+    def from_catboost(cls, model) -> 'ObliviousTreeModel':
+        """
+        学習済みのCatBoostRegressorから配列を取り出す。
+        """
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'model.json')
+            model.save_model(path, format='json')
+            with open(path) as f:
+                dump = json.load(f)
+
+        features_info = dump['features_info']
+        if features_info.get('categorical_features'):
+            raise ValueError("カテゴリ特徴量を使うモデルには対応していません。")
+        float_features = features_info.get('float_features', [])
+        flat_index = {feature['feature_index']: feature['flat_feature_index'] for feature in float_features}
+        nan_as_true = np.zeros(len(model.feature_names_), dtype=bool)
+        for feature in float_features:
+            nan_as_true[feature['flat_feature_index']] = feature.get('nan_value_treatment') == 'AsTrue'
+
+        trees = dump['oblivious_trees']
+        depth = max((len(tree['splits']) for tree in trees), default=0)
+        split_features = np.zeros((len(trees), depth), dtype=np.int32)
+        # 浅い木は常に偽になる分岐（閾値+inf）で深さをそろえる。足したビットは0なので葉の番号は変わらない
+        split_borders = np.full((len(trees), depth), np.inf, dtype=np.float32)
+        leaf_values = np.zeros((len(trees), 1 << depth), dtype=np.float64)
+        for i, tree in enumerate(trees):
+            splits = tree['splits']
+            if len(tree['leaf_values']) != 1 << len(splits):
+                raise ValueError("葉の値が1次元でないモデル（多クラス・多出力）には対応していません。")
+            for j, split in enumerate(splits):
+                if split['split_type'] != 'FloatFeature':
+                    raise ValueError(f"対応していない分岐です: {split['split_type']}")
+                split_features[i, j] = flat_index[split['float_feature_index']]
+                split_borders[i, j] = split['border']
+            leaf_values[i, :len(tree['leaf_values'])] = tree['leaf_values']
+
+        scale, biases = dump.get('scale_and_bias', [1.0, [0.0]])
+        return cls(split_features, split_borders, leaf_values, scale, biases[0] if biases else 0.0,
+                   model.feature_names_, nan_as_true, np.asarray(model.get_feature_importance(), dtype=np.float64))
+
+    @classmethod
+    def from_cbm_bytes(cls, blob: bytes) -> 'ObliviousTreeModel':
+        """
+        .cbmファイルの内容から作る（ModelRegistry のloaderとして使える）。変換時のみCatBoostを読み込む。
+        """
+        from catboost import CatBoostRegressor
+        model = CatBoostRegressor()
+        model.load_model(blob=blob)
+        return cls.from_catboost(model)
+
+    def save(self, path: str) -> None:
+        """
+        配列を.npzファイルに保存する。
+        """
+        np.savez(path, split_features=self.split_features, split_borders=self.split_borders,
+                 leaf_values=self.leaf_values, scale_and_bias=np.array([self.scale, self.bias]),
+                 feature_names=np.array(self.feature_names_), nan_as_true=self.nan_as_true,
+                 feature_importances=self.feature_importances if self.feature_importances is not None else np.empty(0))
+
+    @classmethod
+    def from_npz_bytes(cls, blob: bytes) -> 'ObliviousTreeModel':
+        """
+        save で保存した.npzファイルの内容から作る（ModelRegistry のloaderとして使える）。CatBoostは不要。
+        """
+        with np.load(io.BytesIO(blob)) as arrays:
+            scale, bias = arrays['scale_and_bias']
+            importances = arrays['feature_importances']
+            return cls(arrays['split_features'], arrays['split_borders'], arrays['leaf_values'], scale, bias,
+                       [str(name) for name in arrays['feature_names']], arrays['nan_as_true'],
+                       importances if len(importances) else None)
+
+    @classmethod
+    def load(cls, path: str) -> 'ObliviousTreeModel':
+        with open(path, 'rb') as f:
+            return cls.from_npz_bytes(f.read())
+
+    def get_feature_importance(self) -> np.ndarray:
+        if self.feature_importances is None:
+            raise ValueError("特徴量の重要度が保存されていません。")
+        return self.feature_importances
+
+    def _features(self, X: Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+        """
+        モデルの特徴量の順のfloat32配列にする。DataFrameにない特徴量は0で埋める（predict_and_save と同じ）。
+        """
+        if isinstance(X, pd.DataFrame):
+            key = tuple(X.columns)
+            positions = self._positions.get(key)
+            if positions is None:
+                positions = self._positions[key] = X.columns.get_indexer(self.feature_names_)
+            array = X.to_numpy(dtype=np.float32)[:, positions]
+            array[:, positions < 0] = 0.0
+        else:
+            array = np.asarray(X, dtype=np.float32).reshape(-1, len(self.feature_names_))
+        if self.nan_as_true.any():
+            columns = np.flatnonzero(self.nan_as_true)
+            array[:, columns] = np.where(np.isnan(array[:, columns]), np.inf, array[:, columns])
+        return array
+
+    def predict(self, X: Union[pd.DataFrame, np.ndarray], thread_count: int = -1) -> np.ndarray:
+        """
+        各行の予測値を返す。thread_count は CatBoostRegressor.predict との互換のためで使わない。
+        葉の値はCatBoostと同じく木の順に足すため、丸め誤差まで一致する。
+        """
+        array = self._features(X)
+        if len(array) <= _SMALL_BATCH_ROWS:
+            result = self._predict_small(array)
+        else:
+            result = np.concatenate([self._predict_block(array[start:start + _BLOCK_ROWS])
+                                     for start in range(0, len(array), _BLOCK_ROWS)])
+        return result * self.scale + self.bias
+
+    def _predict_small(self, array: np.ndarray) -> np.ndarray:
+        trees, depth = self.split_features.shape
+        # (行, 木, 深さ) の比較結果を葉の番号にし、全体の葉の配列での位置に変換する
+        bits = (array[:, self._flat_features] > self._flat_borders).reshape(len(array), trees, depth)
+        values = self._flat_leaves[bits @ self._bit_weights + self._tree_offsets]
+        # sumは順序を変えて足すため、先頭から順に足すcumsumの最後の値を使う
+        return np.cumsum(values, axis=1)[:, -1] if trees else np.zeros(len(array))
+
+    def _predict_block(self, array: np.ndarray) -> np.ndarray:
+        columns = np.ascontiguousarray(array.T)
+        result = np.zeros(len(array), dtype=np.float64)
+        # 葉の番号（深さ8までは1バイト、CatBoostの上限の16までは2バイト）
+        dtype = np.uint8 if self.split_features.shape[1] <= 8 else np.uint16
+        leaf = np.empty(len(array), dtype=dtype)
+        bit = np.empty(len(array), dtype=dtype)
+        for tree in range(len(self.leaf_values)):
+            features, borders = self.split_features[tree], self.split_borders[tree]
+            np.greater(columns[features[0]], borders[0], out=leaf, casting='unsafe')
+            for level in range(1, len(features)):
+                np.greater(columns[features[level]], borders[level], out=bit, casting='unsafe')
+                np.left_shift(bit, level, out=bit)
+                np.bitwise_or(leaf, bit, out=leaf)
+            result += self.leaf_values[tree].take(leaf)
+        return result
+
+
+def export_oblivious_trees(cbm_path: str, npz_path: Optional[str] = None) -> str:
+    """
+    .cbmファイルを ObliviousTreeModel の.npzファイルに変換する。
+
+    :param npz_path: 出力先（デフォルトは拡張子を.npzにしたパス）
+    """
+    with open(cbm_path, 'rb') as f:
+        model = ObliviousTreeModel.from_cbm_bytes(f.read())
+    npz_path = npz_path or os.path.splitext(cbm_path)[0] + '.npz'
+    model.save(npz_path)
+    return npz_path
+
+
+def assert_matches_catboost(model, X: pd.DataFrame) -> 'ObliviousTreeModel':
+    """
+    CatBoostRegressor の model を.cbmファイルから.npzファイルに変換した ObliviousTreeModel の予測値が、
+    model.predict と完全に一致することを確認し、変換したモデルを返す。一致しない場合は AssertionError を送出する。
+    まとめて評価する行数（_BLOCK_ROWS ずつ）、少ない行数（_SMALL_BATCH_ROWS 以下）、1行ずつ、配列での入力、
+    列の順序が異なるDataFrame を確認する。
+
+    :param X: model の feature_names_ の列を持つDataFrame（NaNを含めると nan_mode の扱いも確認できる）
+    """
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'model.cbm')
+        model.save_model(path)
+        evaluator = ObliviousTreeModel.load(export_oblivious_trees(path))
+
+    assert evaluator.feature_names_ == list(model.feature_names_)
+    np.testing.assert_array_equal(evaluator.get_feature_importance(), model.get_feature_importance())
+    X = X[list(model.feature_names_)]
+    expected = model.predict(X)
+    np.testing.assert_array_equal(evaluator.predict(X), expected, err_msg="まとめて予測した値が一致しません")
+    np.testing.assert_array_equal(evaluator.predict(X.to_numpy()), expected, err_msg="配列での予測値が一致しません")
+    np.testing.assert_array_equal(evaluator.predict(X[X.columns[::-1]]), expected,
+                                  err_msg="列の順序が異なるDataFrameの予測値が一致しません")
+    small = X.iloc[:_SMALL_BATCH_ROWS]
+    np.testing.assert_array_equal(evaluator.predict(small), expected[:len(small)], err_msg="少ない行の予測値が一致しません")
+    for i in range(min(len(X), 100)):
+        assert evaluator.predict(X.iloc[[i]])[0] == expected[i], f"{i}行目を1行で予測した値が一致しません"
+    return evaluator
+
+
+# CatBoostRegressor.predict との一致と、1行・大量の行の予測時間の比較
+if __name__ == "__main__":
+    import sys
+    import time
+    from catboost import CatBoostRegressor
+
+    if len(sys.argv) > 1:
+        print(f"変換しました: {export_oblivious_trees(sys.argv[1])}")
+        sys.exit()
+
+    def measure(func, repeat):
+        # 他の処理の影響を除くため、5回計測した最小値を使う
+        best = float('inf')
+        for _ in range(5):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                func()
+            best = min(best, (time.perf_counter() - start) / repeat)
+        return best
+
+    rng = np.random.default_rng(0)
+    columns = [f'f{i}' for i in range(67)]
+    X = pd.DataFrame(rng.normal(size=(20_000, len(columns))), columns=columns)
+    X.iloc[::11, 3] = np.nan
+    y = X['f0'] + np.nan_to_num(X['f3']) + rng.normal(size=len(X))
+    for nan_mode in ('Min', 'Max'):
+        model = CatBoostRegressor(iterations=1000, depth=6, nan_mode=nan_mode, verbose=False, allow_writing_files=False)
+        model.fit(X, y)
+
+        test = pd.DataFrame(rng.normal(size=(1_000_000, len(columns))), columns=columns)
+        test.iloc[::13, 3] = np.nan
+        evaluator = assert_matches_catboost(model, test)
+        print(f"nan_mode={nan_mode}: 100万行の予測値がCatBoostと一致しました")
+
+    row = test.iloc[[0]]
+    print(f"1行       CatBoost {measure(lambda: model.predict(row), 200) * 1e6:9.1f} µs  "
+          f"NumPy {measure(lambda: evaluator.predict(row), 200) * 1e6:9.1f} µs")
+    array = row.to_numpy()
+    print(f"1行(配列) CatBoost {measure(lambda: model.predict(array), 200) * 1e6:9.1f} µs  "
+          f"NumPy {measure(lambda: evaluator.predict(array), 200) * 1e6:9.1f} µs")
+    start = time.perf_counter()
+    model.predict(test)
+    middle = time.perf_counter()
+    evaluator.predict(test)
+    print(f"100万行   CatBoost {middle - start:9.3f} s   NumPy {time.perf_counter() - middle:9.3f} s")
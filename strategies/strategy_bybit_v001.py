@@ -24,6 +24,9 @@ class Strategy(BybitAuth):
     """
     取引戦略を定義するクラス。
     """
+    # 戦略が参照する特徴量の列
+    REQUIRED_COLUMNS = ['Close', 'ATR', 'RSI']
+
     def __init__(self, symbol: str, order_size: float):
         super().__init__()
         self.symbol = symbol
@@ -46,7 +49,7 @@ class Strategy(BybitAuth):
         rsi_value = df['RSI'].iloc[idx]
         
         current_price = df['Close'].iloc[idx]
-        balance_jpy = self.fetch_balance()
+        balance_jpy = self.bybit_trader.fetch_balance()
         long_threshold = 0.01
         short_threshold = -0.01
         atr_ratio = 0.95
@@ -65,7 +68,7 @@ class Strategy(BybitAuth):
             logger.info(f'trading_count: {self.trading_count}')
             #買いシグナル
             if not self.position:
-                self.cancel_order()
+                self.bybit_trader.cancel_all_orders()
                 logger.info(f'longシグナルを生成しました - 価格: {buy_price}')
                 #注文を作成
                 BybitOrder.create_limit_order(self.bybit_order, 'buy', buy_price)
@@ -73,7 +76,7 @@ class Strategy(BybitAuth):
                 logger.info('既にポジションを保有しています。保持中です。')
         else:
             if self.position:
-                self.cancel_order()
+                self.bybit_trader.cancel_all_orders()
                 position_size = float(self.bybit_trader.fetch_balance()['BTC']) 
                 position_size = position_size - (position_size % self.order_size)  # 小数部分の切り捨て
                 logger.info(f'ポジションをクローズするシグナルを生成しました - 価格: {sell_price}, サイズ: {position_size}')
@@ -81,5 +84,5 @@ class Strategy(BybitAuth):
 
                 BybitOrder.create_close_order(self.bybit_order, 'sell', sell_price, position_size)
             else:
-                self.cancel_order()
+                self.bybit_trader.cancel_all_orders()
                 logger.info('売りシグナルありだが、クローズするポジションがありません。')
@@ -1,6 +1,6 @@
 #strategy_v001.py
 import logging
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Set
 import asyncio
 
 import numpy as np
@@ -8,36 +8,61 @@ import pandas as pd
 
 from infra.gmo.gmo_auth import GmoAuth
 from infra.gmo.gmo_order import GmoCoin
+from infra.gmo.gmo_async_client import AsyncGmoClient
 from infra.gmo.gmo_websocket_client import websocket_order_events
-from modules.logging_config import logging_config
 from modules.calculate_position import calculate_position_size
 from modules.calculate_limit_price import calculate_limit_price_dist
 from modules.calculate_limit_price import LimitPrice
+from modules.order_reconciler import DesiredOrder, LiveOrder, ReconcilePlan, reconcile_orders
 
 
 
-class Strategy(GmoAuth, GmoCoin):
+class Strategy(GmoCoin):
     """
     取引戦略を定義するクラス。
     """
-    def __init__(self, symbol: str, equity_fraction: float = 0.7):
+    # 戦略が参照する特徴量の列
+    REQUIRED_COLUMNS = ['Close', 'ATR', 'RSI']
+
+    # cancelOrders で1回に取り消せる注文の数
+    CANCEL_BATCH_SIZE = 10
+
+    def __init__(self, symbol: str, equity_fraction: float = 0.7, reconcile: bool = True,
+                 price_tolerance_ticks: int = 1, size_tolerance_ratio: float = 0.02, order_events: bool = False):
+        """
+        :param reconcile: 毎回すべて取り消して出し直す代わりに、置かれている注文との差分だけを変更・取消・注文する
+        :param price_tolerance_ticks: 置かれている注文をそのままにする価格の差（呼値の単位の数）
+        :param size_tolerance_ratio: 価格の変更で済ませる数量の差（出したい数量に対する割合）
+        :param order_events: on_order_event に注文・約定のイベントが届く（Private WebSocketに接続している）。
+                             Trueの場合は、前の周期の注文の操作がすべて成功していれば手元の注文の一覧を信用し、
+                             有効な注文を取得しない。Falseの場合は毎回取得する。
+        """
         super().__init__()
         self.symbol = symbol
         self.equity_fraction = equity_fraction
         self.position: Optional[Dict[str, Any]] = None
         self.trading_count = 0
-        self.logger = logging_config.getLogger(__name__)
+        self.logger = logging.getLogger(__name__)
         market_info = self.fetch_symbols()
         self.min_order_size = market_info['minOrderSize']
         self.size_step = market_info['sizeStep']
-        self.reverse_side = 'buy'
+        self.reconcile = reconcile
+        self.price_tolerance = price_tolerance_ticks * market_info.get('tickSize', 1)
+        self.size_tolerance_ratio = size_tolerance_ratio
+        self.order_events = order_events
+        # 置いている注文（注文ID -> LiveOrder）。Noneはまだ取得していないことを表す
+        self.live_orders: Optional[Dict[int, LiveOrder]] = None
+        # 注文の応答より先に届いた約定・取消のイベント（FASの注文がすぐに約定した場合など）
+        self._closed_orders: Set[int] = set()
+        self._early_fills: Dict[int, float] = {}
+        # 失敗・タイムアウトした操作があり、手元の一覧が取引所と一致しているか分からない
+        self._book_stale = False
         
 
-    def long_atr_strategy(self, latest_data: pd.DataFrame, prediction: float) -> Optional[Dict[str, Any]]:
+    def _plan_orders(self, latest_data: pd.DataFrame, prediction: float, balance: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
-        ATRを用いたロング戦略を実行する。
+        最新の足と残高から出す指値注文（limit_order の引数）を決める。同期版と非同期版で共通。
         """
-        
         #TODO: data[(data['RSI'] < 30) & (data['RSI'].shift(1) >= 30)]　RSIの条件を追加する
 
         df = latest_data
@@ -45,40 +70,182 @@ class Strategy(GmoAuth, GmoCoin):
         atr_value = df['ATR'].iloc[idx]
         rsi_value = df['RSI'].iloc[idx]
         current_price = df['Close'].iloc[idx]
-        balance_jpy = self.fetch_balance()["JPY"]
+        balance_jpy = balance["JPY"]
         long_threshold = 0.01
         atr_ratio = 0.3
         limit_price = calculate_limit_price_dist(current_price=current_price, atr_value=atr_value, atr_ratio=atr_ratio)
-        former_size = float(self.fetch_balance()['BTC'])
+        former_size = float(balance['BTC'])
         former_size = former_size - (former_size % self.size_step)  # 小数部分の切り捨て
         
         
         #FIXME: floatの精度問題で最後に小さい値が残ることがある
         former_size = round(former_size, 4)
         self.logger.info(f'最新データ - Prediction: {prediction}, ATR: {atr_value}, Close: {current_price}, Balance: {balance_jpy} JPY, limit_price: {limit_price}')
-        self.cancel_order()
-        self.limit_order(symbol=self.symbol, side=self.reverse_side, amount=size, price=limit_price.buy_price)
-        
-        asyncio.run(websocket_order_events())
+        orders = []
+        if former_size >= self.min_order_size:
+            # 保有しているBTCの反対売買（ロングのみのため常に売り）の注文
+            orders.append({'symbol': self.symbol, 'side': 'sell', 'amount': former_size, 'price': limit_price.sell_price})
        
     
         if prediction > long_threshold:
             self.trading_count += 1
-            self.reverse_side = 'sell'
             self.logger.info(f'trading_count: {self.trading_count}')
             #買いシグナル
 
-            size = self.calculate_position_size(balance_jpy, current_price, self.equity_fraction, self.min_order_size, self.size_step)
+            size = calculate_position_size(balance_jpy, current_price, self.equity_fraction, self.min_order_size, self.size_step)
             self.logger.info(f'longポジションを開くシグナルを生成しました - 価格: {limit_price.buy_price}, サイズ: {size}')
 
-            self.limit_order(
-                symbol=self.symbol,
-                side='buy',
-                amount=size,
-                price=limit_price.buy_price
-            )       
+            orders.append({'symbol': self.symbol, 'side': 'buy', 'amount': size, 'price': limit_price.buy_price})
         else:
             self.logger.info(f'閾値未満のため、取引は行いませんでした。')
+        return orders
+
+    def on_order_event(self, event: Dict[str, Any]) -> None:
+        """
+        Private WebSocketのイベントで手元の注文の一覧を更新する。
+        """
+        super().on_order_event(event)
+        order_id = int(event.get('orderId', 0))
+        closed = event.get('orderStatus') in ('EXECUTED', 'CANCELED', 'EXPIRED')
+        if event.get('channel') == 'executionEvents':
+            # GMOコインの executionEvents には orderStatus がないため、約定済みの数量で判定する
+            if 'orderSize' in event and float(event['orderExecutedSize']) >= float(event['orderSize']):
+                closed = True
+            order = (self.live_orders or {}).get(order_id)
+            if order is None:
+                self._early_fills[order_id] = self._early_fills.get(order_id, 0.0) + float(event['executionSize'])
+            elif not closed:
+                self.live_orders[order_id] = order._replace(size=order.size - float(event['executionSize']))
+        if closed:
+            self._closed_orders.add(order_id)
+            if self.live_orders is not None:
+                self.live_orders.pop(order_id, None)
+
+    def resync_orders(self) -> None:
+        """
+        次の周期で有効な注文を取得し直す（WebSocketに再接続し、切断中のイベントが届いていない場合など）。
+        """
+        self._book_stale = True
+
+    def _needs_active_orders(self) -> bool:
+        # イベントが届かない場合は、置いた注文が約定・失効しているかは取得しないと分からない。
+        # イベントが届く場合も、応答が失われた注文（タイムアウトなど）は取得しないと分からない
+        return self.live_orders is None or self._book_stale or not self.order_events
+
+    def _set_active_orders(self, active: List[Dict[str, Any]]) -> None:
+        self.live_orders = {int(order['orderId']): LiveOrder(int(order['orderId']), order['side'].upper(),
+                                                             order['size'], order['price'])
+                            for order in active}
+        self._book_stale = False
+
+    def _reconcile(self, orders: List[Dict[str, Any]]) -> ReconcilePlan:
+        """
+        _plan_orders の注文と置いている注文の差分を求める。
+        """
+        self._closed_orders.clear()
+        self._early_fills.clear()
+        desired = [DesiredOrder(order['side'].upper(), order['amount'], int(order['price'])) for order in orders]
+        plan = reconcile_orders(desired, list(self.live_orders.values()), self.price_tolerance, self.size_step / 2,
+                                self.size_tolerance_ratio)
+        self.logger.info(f'注文の差分 - 維持: {len(plan.keep)}, 価格変更: {len(plan.change)}, '
+                         f'取消: {len(plan.cancel)}, 新規: {len(plan.place)}')
+        # 取り消す注文は結果によらず一覧から外す（取消に失敗するのは約定・失効済みの場合）
+        for order in plan.cancel:
+            self.live_orders.pop(order.order_id, None)
+        return plan
+
+    def _record_change(self, live: LiveOrder, target: DesiredOrder, response: Optional[Dict[str, Any]]) -> bool:
+        """
+        価格の変更の結果を手元の一覧に反映する。失敗した場合はFalse。
+        """
+        if response is not None and response.get('status') == 0:
+            if live.order_id in self.live_orders:
+                self.live_orders[live.order_id] = live._replace(price=target.price)
+            return True
+        self.live_orders.pop(live.order_id, None)
+        return False
+
+    def _record_place(self, order: DesiredOrder, response: Optional[Dict[str, Any]]) -> bool:
+        """
+        新規の注文の結果を手元の一覧に反映する。失敗した場合はFalse。
+        """
+        if response is None or response.get('status') != 0:
+            return False
+        order_id = int(response['data'])
+        if order_id not in self._closed_orders:
+            size = order.size - self._early_fills.pop(order_id, 0.0)
+            self.live_orders[order_id] = LiveOrder(order_id, order.side, size, order.price)
+        return True
+
+    @staticmethod
+    def _cancel_succeeded(response: Optional[Dict[str, Any]]) -> bool:
+        return response is not None and response.get('status') == 0 and not (response.get('data') or {}).get('failed')
+
+    def _cancel_batches(self, plan: ReconcilePlan) -> List[List[int]]:
+        ids = [order.order_id for order in plan.cancel]
+        return [ids[i:i + self.CANCEL_BATCH_SIZE] for i in range(0, len(ids), self.CANCEL_BATCH_SIZE)]
 
+    def _order_args(self, order: DesiredOrder) -> Dict[str, Any]:
+        return {'symbol': self.symbol, 'side': order.side.lower(), 'amount': order.size, 'price': order.price}
 
+    def long_atr_strategy(self, latest_data: pd.DataFrame, prediction: float) -> Optional[Dict[str, Any]]:
+        """
+        ATRを用いたロング戦略を実行する。
+        """
+        balance = self.fetch_balance()
+        if not self.reconcile:
+            self.cancel_order()
+            for order in self._plan_orders(latest_data, prediction, balance):
+                self.limit_order(**order)
+            return
+
+        if self._needs_active_orders():
+            self._set_active_orders(self.fetch_active_orders())
+        plan = self._reconcile(self._plan_orders(latest_data, prediction, balance))
+        # 途中で例外になった場合も次の周期で取得し直すよう、すべての操作が成功するまでは一覧を確かでないものとする
+        self._book_stale = True
+        ok = all([self._cancel_succeeded(self.cancel_orders(order_ids)) for order_ids in self._cancel_batches(plan)])
+        place = list(plan.place)
+        for live, target in plan.change:
+            if not self._record_change(live, target, self.change_order(live.order_id, target.price)):
+                # 約定・取消済みなどで変更できなかった注文は新しく出す
+                ok = False
+                place.append(target)
+        for order in place:
+            ok = self._record_place(order, self.limit_order(**self._order_args(order))) and ok
+        self._book_stale = not ok
 
+    async def long_atr_strategy_async(self, latest_data: pd.DataFrame, prediction: float, client: AsyncGmoClient) -> None:
+        """
+        long_atr_strategy の非同期版。互いに依存しないリクエストを client から同時に発行する。
+        差分を使う場合は、残高と有効な注文の取得、価格の変更と新規の注文をそれぞれ同時に行う。
+        """
+        if not self.reconcile:
+            # 残高は取消で変わらない（拘束中の数量を含む）ため、取消と同時に取得できる
+            balance, _ = await asyncio.gather(client.fetch_balance(), client.cancel_order())
+            orders = self._plan_orders(latest_data, prediction, balance)
+            await asyncio.gather(*(client.limit_order(**order) for order in orders))
+            return
+
+        if self._needs_active_orders():
+            balance, active = await asyncio.gather(client.fetch_balance(), client.fetch_active_orders())
+            self._set_active_orders(active)
+        else:
+            balance = await client.fetch_balance()
+        plan = self._reconcile(self._plan_orders(latest_data, prediction, balance))
+        self._book_stale = True
+        # 取消で拘束が外れた残高を新しい注文に使うため、取消が終わってから注文する
+        results = await asyncio.gather(*(client.cancel_orders(order_ids) for order_ids in self._cancel_batches(plan)))
+        ok = all([self._cancel_succeeded(result) for result in results])
+        results = await asyncio.gather(
+            *(client.change_order(live.order_id, target.price) for live, target in plan.change),
+            *(client.limit_order(**self._order_args(order)) for order in plan.place))
+        retry = [target for (live, target), result in zip(plan.change, results)
+                 if not self._record_change(live, target, result)]
+        ok = ok and not retry
+        for order, result in zip(plan.place, results[len(plan.change):]):
+            ok = self._record_place(order, result) and ok
+        results = await asyncio.gather(*(client.limit_order(**self._order_args(order)) for order in retry))
+        for order, result in zip(retry, results):
+            ok = self._record_place(order, result) and ok
+        self._book_stale = not ok